@@ -23,6 +23,7 @@ setup(name='duckietown-challenges',
       download_url='http://github.com/duckietown/duckietown-challenges/tarball/%s' % version,
       package_dir={'': 'src'},
       packages=find_packages('src'),
+      package_data={'duckietown_challenges_benchmarks': ['baselines.json']},
       install_requires=[
           'decorator',
           # 'duckietown-shell',
@@ -49,6 +50,9 @@ setup(name='duckietown-challenges',
           'console_scripts': [
               'dt-challenges-evaluator = duckietown_challenges:dt_challenges_evaluator',
               'dt-challenges-make-readme  = duckietown_challenges:make_readme',
+              'dt-challenges-cache = duckietown_challenges:dt_challenges_cache',
+              'dt-challenges-benchmark = duckietown_challenges_benchmarks:benchmark_main',
+              'dt-challenges-microbench = duckietown_challenges_benchmarks:micro_benchmarks_main',
           ]
       }
       )
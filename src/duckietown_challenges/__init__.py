@@ -16,8 +16,22 @@ from .challenge_solution import *
 from .challenge_results import *
 from .cie_concrete import *
 
-from .runner import dt_challenges_evaluator
-
 dclogger.info('duckietown-challenges %s' % __version__)
 
-from .make_readmes import make_readmes_main as make_readme
+
+# The entry points are imported lazily: solutions and evaluators only need
+# the API above, and should not pay at startup for the runner machinery.
+
+def dt_challenges_evaluator():
+    from .runner import dt_challenges_evaluator as f
+    return f()
+
+
+def dt_challenges_cache(args=None):
+    from .runner_cache import cache_main
+    return cache_main(args)
+
+
+def make_readme():
+    from .make_readmes import make_readmes_main
+    return make_readmes_main()
@@ -1,4 +1,8 @@
-from collections import namedtuple
+import copy
+import hashlib
+import logging
+import threading
+from collections import namedtuple, OrderedDict
 from datetime import datetime
 
 import yaml
@@ -6,6 +10,7 @@ import yaml
 from duckietown_challenges.utils import indent, safe_yaml_dump
 from . import dclogger
 from .challenges_constants import ChallengesConstants
+from .frozen import FrozenDict, FrozenList, freeze, freeze_object
 from .utils import raise_wrapped, check_isinstance, wrap_config_reader
 
 
@@ -303,6 +308,21 @@ class ChallengeTransitions(object):
             assert second in [STATE_ERROR, STATE_FAILED, STATE_SUCCESS] or second in self.steps, second
             assert condition in ALLOWED_CONDITION_TRIGGERS, condition
             self.transitions.append(Transition(first, condition, second))
+        self._compile()
+
+    def _compile(self):
+        """
+            Indexes the transitions by (first, condition). Each entry is a list of
+            (position, second, result), where result is the final result of the submission
+            if second is a terminal state, or None.
+        """
+        self._valid_steps = frozenset([STATE_START] + list(self.steps))
+        self._valid_status = frozenset(ChallengesConstants.ALLOWED_JOB_STATUS)
+        self._index = {}
+        for i, t in enumerate(self.transitions):
+            terminal = t.second in [STATE_ERROR, STATE_FAILED, STATE_SUCCESS]
+            result = t.second.lower() if terminal else None
+            self._index.setdefault((t.first, t.condition), []).append((i, t.second, result))
 
     def __repr__(self):
         return u"\n".join(self.steps_explanation())
@@ -329,45 +349,67 @@ class ChallengeTransitions(object):
 
                 START: success
 
-            Returns a list of steps.
+            Returns a tuple (complete, result, steps): steps is the list of the steps
+            to activate; if complete, result is one of "success", "failed", "error".
 
-            If the list is empty, then we are done
+        """
+        if dclogger.isEnabledFor(logging.DEBUG):
+            dclogger.debug('Received status = %s' % status)
+        res = self._get_next_steps(status)
+        if dclogger.isEnabledFor(logging.DEBUG):
+            dclogger.debug('Next steps: %s' % (res,))
+        return res
 
+    def get_next_steps_batch(self, statuses):
         """
-        dclogger.info('Received status = %s' % status)
+            Like get_next_steps(), for many status dictionaries (for example, of many
+            submissions) at once, without logging. Returns a list of results.
+        """
+        return [self._get_next_steps(status) for status in statuses]
+
+    def _get_next_steps(self, status):
         assert isinstance(status, dict)
         assert STATE_START in status
         assert status[STATE_START] == 'success'
-        status = dict(**status)
-        for k, ks in list(status.items()):
-            if k != STATE_START and k not in self.steps:
-                msg = 'Ignoring invalid step %s -> %s' % (k, ks)
-                dclogger.error(msg)
-                status.pop(k)
-            if ks not in ChallengesConstants.ALLOWED_JOB_STATUS:
-                msg = 'Ignoring invalid step %s -> %s' % (k, ks)
-                dclogger.error(msg)
-                status.pop(k)
+        valid_steps = self._valid_steps
+        valid_status = self._valid_status
+        for k, ks in status.items():
+            if k not in valid_steps or ks not in valid_status:
+                status = self._filter(status)
+                break
+
+        # the transitions that are activated, in the order in which they were given
+        index = self._index
+        active = []
+        for k, ks in status.items():
+            entries = index.get((k, ks))
+            if entries:
+                active.extend(entries)
+        if len(active) > 1:
+            active.sort()
 
         to_activate = []
-        for t in self.transitions:
-            if t.first in status and status[t.first] == t.condition:
-                dclogger.debug('Transition %s is activated' % str(t))
-
-                like_it_does_not_exist = [ChallengesConstants.STATUS_ABORTED]
-                if t.second in status and status[t.second] not in like_it_does_not_exist:
-                    dclogger.debug('Second %s already activated (and in %s)' % (t.second, status[t.second]))
-                else:
-                    if t.second in [STATE_ERROR, STATE_FAILED, STATE_SUCCESS]:
-                        dclogger.debug('Finishing here')
-                        return True, t.second.lower(), []
-                    else:
+        for _, second, result in active:
+            if second in status and status[second] != ChallengesConstants.STATUS_ABORTED:
+                # already activated
+                continue
+            if result is not None:
+                return True, result, []
+            to_activate.append(second)
 
-                        to_activate.append(t.second)
-
-        dclogger.debug('Incomplete; need to do: %s' % to_activate)
         return False, None, to_activate
 
+    def _filter(self, status):
+        """ Returns a copy of status without the invalid steps and statuses. """
+        filtered = {}
+        for k, ks in status.items():
+            if k not in self._valid_steps or ks not in self._valid_status:
+                msg = 'Ignoring invalid step %s -> %s' % (k, ks)
+                dclogger.error(msg)
+            else:
+                filtered[k] = ks
+        return filtered
+
 
 class Scoring(object):
     def __init__(self, scores):
@@ -476,6 +518,9 @@ class ChallengeDescription(object):
     def get_next_steps(self, status):
         return self.ct.get_next_steps(status)
 
+    def get_next_steps_batch(self, statuses):
+        return self.ct.get_next_steps_batch(statuses)
+
     @staticmethod
     @wrap_config_reader
     def from_yaml(data):
@@ -530,3 +575,102 @@ class ChallengeDescription(object):
 
     def as_yaml(self):
         return yaml.dump(self.as_dict())
+
+    @staticmethod
+    def from_yaml_cached(data):
+        """
+            Like from_yaml(), but `data` can also be the YAML string, and it is not modified.
+
+            The descriptions are cached by the hash of their contents: loading the same
+            challenge again returns the same object. For this reason, the object returned
+            is immutable (use copy.deepcopy() to get a mutable copy).
+        """
+        key = get_canonical_hash(data)
+        with _challenge_cache_lock:
+            if key in _challenge_cache:
+                cd = _challenge_cache.pop(key)
+                _challenge_cache[key] = cd
+                return cd
+
+        if isinstance(data, (str, _text_type)):
+            data = yaml.load(data, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+            if not isinstance(data, dict):
+                msg = 'Expected a dict, got %s' % type(data).__name__
+                raise InvalidChallengeDescription(msg)
+        else:
+            data = copy.deepcopy(data)
+        cd = freeze_challenge(ChallengeDescription.from_yaml(data))
+
+        with _challenge_cache_lock:
+            _challenge_cache[key] = cd
+            while len(_challenge_cache) > CHALLENGE_CACHE_SIZE:
+                _challenge_cache.popitem(last=False)
+        return cd
+
+
+# how many parsed challenge descriptions are kept by from_yaml_cached()
+CHALLENGE_CACHE_SIZE = 64
+
+# canonical hash -> ChallengeDescription (frozen); most recently used last
+_challenge_cache = OrderedDict()
+_challenge_cache_lock = threading.Lock()
+
+
+def clear_challenge_cache():
+    with _challenge_cache_lock:
+        _challenge_cache.clear()
+
+
+_text_type = type(u'')
+
+
+def get_canonical_hash(data):
+    """
+        Hash of a YAML string, or of a dict (through its repr()).
+
+        repr() keeps the types of keys and scalars: {1: 'a'} and {'1': 'a'} are different,
+        and so are 1, 1.0 and True, or a date and a dict that looks like one.
+        The keys are not sorted; equal dicts that iterate in a different order (or that
+        differ in repr() only, like 'a' and u'a') just do not share the entry.
+    """
+    if isinstance(data, (str, _text_type)):
+        if isinstance(data, _text_type):
+            data = data.encode('utf-8')
+        return hashlib.sha256(b'yaml:' + data).hexdigest()
+    s = repr(data)
+    if isinstance(s, _text_type):
+        s = s.encode('utf-8')
+    return hashlib.sha256(b'data:' + s).hexdigest()
+
+
+def freeze_challenge(cd):
+    """ Makes the ChallengeDescription and all of its parts immutable. Returns it. """
+    for step in cd.steps.values():
+        step.features_required = freeze(step.features_required)
+        ep = step.evaluation_parameters
+        for service in ep.services.values():
+            service.environment = freeze(service.environment)
+            if service.build is not None:
+                service.build.args = freeze(service.build.args)
+                freeze_object(service.build)
+            freeze_object(service)
+        ep.services = FrozenDict(ep.services)
+        freeze_object(ep)
+        freeze_object(step)
+    cd.steps = FrozenDict(cd.steps)
+    cd.roles = freeze(cd.roles)
+    cd.tags = freeze(cd.tags)
+    for score in cd.scoring.scores:
+        freeze_object(score)
+    cd.scoring.scores = FrozenList(cd.scoring.scores)
+    freeze_object(cd.scoring)
+    cd.ct.transitions = FrozenList(cd.ct.transitions)
+    cd.ct.steps = FrozenList(cd.ct.steps)
+    freeze_object(cd.ct)
+    return freeze_object(cd)
+
+
+# the frozen containers are written like the normal ones
+for _dumper in [yaml.Dumper, yaml.SafeDumper]:
+    yaml.add_representer(FrozenDict, yaml.representer.SafeRepresenter.represent_dict, Dumper=_dumper)
+    yaml.add_representer(FrozenList, yaml.representer.SafeRepresenter.represent_list, Dumper=_dumper)
@@ -1,6 +1,7 @@
 import os
 from collections import OrderedDict
 
+from . import dclogger
 from .constants import CHALLENGE_RESULTS_YAML, ChallengeResultsStatus
 from .yaml_utils import write_yaml, read_yaml_file
 
@@ -43,10 +44,22 @@ class ChallengeResults(object):
     def get_status(self):
         return self.status
 
-    def get_stats(self):
+    def get_stats(self, **runner_stats):
+        """
+            The statistics reported to the server: the scores, the message, the statistics added
+            by the runner (`runner_stats`, e.g. cache usage and timing), and those written by
+            the evaluator in the results, which cannot replace any of the others.
+        """
         stats = OrderedDict()
         stats['scores'] = self.scores
         stats['msg'] = self.msg
+        for k in sorted(runner_stats):
+            stats[k] = runner_stats[k]
+        for k, v in self.stats.items():
+            if k in stats:
+                dclogger.warning('Ignoring the statistic %r set by the evaluator.' % k)
+                continue
+            stats[k] = v
         return stats
 
 
@@ -3,17 +3,18 @@ import os
 import shutil
 import sys
 import tempfile
-import time
 import traceback
-from collections import namedtuple
+from collections import namedtuple, Counter
 
 from . import dclogger, ENV_CHALLENGE_STEP_NAME
 from .constants import CHALLENGE_DESCRIPTION_YAML, CHALLENGE_SOLUTION_OUTPUT_YAML, CHALLENGE_SOLUTION_OUTPUT_DIR, \
     CHALLENGE_EVALUATION_OUTPUT_DIR, CHALLENGE_DESCRIPTION_DIR, ChallengeResultsStatus, CHALLENGE_PREVIOUS_STEPS_DIR, \
     ENV_CHALLENGE_NAME
 from .exceptions import InvalidSubmission, InvalidEvaluator, InvalidEnvironment
+from .file_transfer import transfer_file
+from .file_waiting import wait_for_path
 from .solution_interface import ChallengeInterfaceSolution, ChallengeInterfaceEvaluator
-from .utils import raise_wrapped, d8n_make_sure_dir_exists
+from .utils import raise_wrapped, d8n_make_sure_dir_exists, map_threads, write_chunks_to_file, friendly_size
 from .yaml_utils import read_yaml_file, write_yaml
 
 ChallengeFile = namedtuple('ChallengeFile', 'basename from_file contents description')
@@ -24,16 +25,41 @@ def check_valid_basename(s):
     pass  # TODO
 
 
+# how many files are written at the same time by FS.write()
+DEFAULT_WRITE_WORKERS = 4
+
+
 class FS(object):
-    def __init__(self):
+    """
+        The files to be written in an output directory.
+
+        If `dest` is given, the files given as data are written there right away;
+        otherwise they are kept in a temporary directory until write() is called.
+    """
+
+    def __init__(self, dest=None):
         self.files = {}
+        self.dest = dest
+        self.spool_dir = None
 
     def add_from_data(self, basename, contents, description):
+        """ The contents can be bytes, unicode, a file-like object, or an iterable of chunks of bytes. """
+        check_valid_basename(basename)
+
         if basename in self.files:
             msg = 'Already know %r' % basename
             raise ValueError(msg)
 
-        self.files[basename] = ChallengeFile(basename, None, contents, description)
+        if self.dest is not None:
+            out = os.path.join(self.dest, basename)
+        else:
+            if self.spool_dir is None:
+                self.spool_dir = tempfile.mkdtemp(prefix='fs-spool')
+            out = os.path.join(self.spool_dir, basename)
+        size = write_chunks_to_file(contents, out)
+        dclogger.debug('Written %s (%s)' % (out, friendly_size(size)))
+
+        self.files[basename] = ChallengeFile(basename, out, None, description)
 
     def add(self, basename, from_file, description):
         if not os.path.exists(from_file):
@@ -48,18 +74,38 @@ class FS(object):
 
         self.files[basename] = ChallengeFile(basename, from_file, None, description)
 
-    def write(self, dest):
+    def write(self, dest, movable_dirs=(), nworkers=DEFAULT_WRITE_WORKERS):
+        """
+            Writes the files in `dest`, concurrently.
+
+            The files are hardlinked or cloned when possible, rather than copied.
+            The files inside one of the `movable_dirs` might be moved instead,
+            so they should not be used afterwards.
+        """
         rfs = list(self.files.values())
+        if self.spool_dir is not None:
+            movable_dirs = list(movable_dirs) + [self.spool_dir]
+        movable_dirs = [os.path.join(os.path.realpath(_), '') for _ in movable_dirs]
+        nreferences = Counter(os.path.realpath(rf.from_file) for rf in rfs)
 
-        for rf in rfs:
+        def write_one(rf):
             out = os.path.join(dest, rf.basename)
             d8n_make_sure_dir_exists(out)
 
-            if rf.from_file:
-                shutil.copy(rf.from_file, out)
-            else:
-                with open(out, 'wb') as f:
-                    f.write(rf.contents)
+            src = os.path.realpath(rf.from_file)
+            if src == os.path.realpath(out):
+                # written there by add_from_data()
+                return
+            move = nreferences[src] == 1 and any(src.startswith(_) for _ in movable_dirs)
+            method = transfer_file(src, out, move=move)
+            dclogger.debug('%s: %s' % (method, out))
+
+        map_threads(write_one, rfs, nworkers)
+
+        if self.spool_dir is not None:
+            # its files have been moved or copied to `dest`
+            shutil.rmtree(self.spool_dir)
+            self.spool_dir = None
 
 
 class ChallengeInterfaceSolutionConcrete(ChallengeInterfaceSolution):
@@ -67,13 +113,17 @@ class ChallengeInterfaceSolutionConcrete(ChallengeInterfaceSolution):
     def __init__(self, root):
         self.root = root
 
-        self.solution_output_files = FS()
+        self.solution_output_files = FS(os.path.join(root, CHALLENGE_SOLUTION_OUTPUT_DIR))
         self.solution_output_dict = None
         self.failure_declared = False
         self.failure_declared_msg = False
+        # the directories created by get_tmp_dir()
+        self.tmp_dirs = []
 
     def get_tmp_dir(self):
-        return tempfile.mkdtemp()
+        d = tempfile.mkdtemp()
+        self.tmp_dirs.append(d)
+        return d
 
     def get_challenge_parameters(self):
         fn = os.path.join(self.root, CHALLENGE_DESCRIPTION_YAML)
@@ -128,7 +178,8 @@ class ChallengeInterfaceSolutionConcrete(ChallengeInterfaceSolution):
 
     def _write_files(self):
         d = os.path.join(self.root, CHALLENGE_SOLUTION_OUTPUT_DIR)
-        self.solution_output_files.write(d)
+        # this is the end of the solution: the temporary files can be moved
+        self.solution_output_files.write(d, movable_dirs=self.tmp_dirs)
 
     def wait_for_preparation(self):
         fn = os.path.join(self.root, CHALLENGE_DESCRIPTION_YAML)
@@ -183,15 +234,10 @@ class Timeout(Exception):
 
 
 def wait_for_file(fn, timeout, wait):
-    t0 = time.time()
-    while not os.path.exists(fn):
-        passed = int(time.time() - t0)
-        to_wait = timeout - passed
-        dclogger.debug('Output %s not ready yet (%s secs passed, will wait %s secs more)' % (fn, passed, to_wait))
-        if time.time() > t0 + timeout:
-            msg = 'Timeout of %s while waiting for %s.' % (timeout, fn)
-            raise Timeout(msg)
-        time.sleep(wait)
+    """ Waits for `fn` to exist, using inotify where possible and checking every `wait` seconds. """
+    if not wait_for_path(fn, timeout=timeout, poll_interval=wait):
+        msg = 'Timeout of %s while waiting for %s.' % (timeout, fn)
+        raise Timeout(msg)
 
 
 class ChallengeInterfaceEvaluatorConcrete(ChallengeInterfaceEvaluator):
@@ -199,18 +245,22 @@ class ChallengeInterfaceEvaluatorConcrete(ChallengeInterfaceEvaluator):
     def __init__(self, root='/'):
         self.root = root
 
-        self.challenge_files = FS()  # -> ChallengeFile
+        self.challenge_files = FS(os.path.join(root, CHALLENGE_DESCRIPTION_DIR))  # -> ChallengeFile
         self.parameters = None
 
-        self.evaluation_files = FS()  # -> ChallengeFile
+        self.evaluation_files = FS(os.path.join(root, CHALLENGE_EVALUATION_OUTPUT_DIR))  # -> ChallengeFile
         self.scores = {}  # str -> ReportedScore
+        # the directories created by get_tmp_dir()
+        self.tmp_dirs = []
 
     def set_challenge_parameters(self, data):
         assert isinstance(data, dict)
         self.parameters = data
 
     def get_tmp_dir(self):
-        return tempfile.mkdtemp()
+        d = tempfile.mkdtemp()
+        self.tmp_dirs.append(d)
+        return d
 
     # preparation
 
@@ -299,7 +349,8 @@ class ChallengeInterfaceEvaluatorConcrete(ChallengeInterfaceEvaluator):
             raise InvalidEvaluator(msg)  # XXX
 
         d = os.path.join(self.root, CHALLENGE_EVALUATION_OUTPUT_DIR)
-        self.evaluation_files.write(d)
+        # this is the end of the evaluation: the temporary files can be moved
+        self.evaluation_files.write(d, movable_dirs=self.tmp_dirs)
 
         status = ChallengeResultsStatus.SUCCESS
         msg = None
@@ -30,6 +30,9 @@ CHALLENGE_DESCRIPTION_YAML = os.path.join(CHALLENGE_DESCRIPTION_DIR, 'descriptio
 
 ENV_CHALLENGE_NAME = 'challenge_name'
 ENV_CHALLENGE_STEP_NAME = 'challenge_step_name'
+# Encoding of the files above written by write_yaml(): "yaml" (default), "json" or "msgpack".
+# Readers recognize all of them.
+ENV_PROTOCOL_ENCODING = 'DTC_PROTOCOL_ENCODING'
 
 
 class ChallengeResultsStatus(object):
@@ -0,0 +1,156 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import shutil
+import sys
+
+__all__ = ['transfer_file', 'fast_copy', 'reflink']
+
+# from <linux/fs.h>
+FICLONE = 0x40049409
+
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+def reflink(src, dst):
+    """ Creates `dst` as a copy-on-write clone of `src`. Returns False if not supported. """
+    if not sys.platform.startswith('linux'):
+        return False
+
+    import fcntl
+    try:
+        with open(src, 'rb') as fs:
+            with open(dst, 'wb') as fd:
+                fcntl.ioctl(fd.fileno(), FICLONE, fs.fileno())
+        return True
+    except (IOError, OSError):
+        if os.path.exists(dst):
+            os.unlink(dst)
+        return False
+
+
+def fast_copy(src, dst, copy_mode=True):
+    """
+        Copies the contents and the permission bits of `src` to `dst`, like shutil.copy(),
+        but in the kernel (copy_file_range() or sendfile()) if possible.
+        If not `copy_mode`, `dst` gets the default permissions (as from open()) if it is created.
+
+        Returns the method used: one of 'copy_file_range', 'sendfile', 'copy'.
+    """
+    with open(src, 'rb') as fs:
+        with open(dst, 'wb') as fd:
+            method = _copy_in_kernel(fs.fileno(), fd.fileno(), os.fstat(fs.fileno()).st_size)
+            if method is None:
+                fs.seek(0)
+                fd.seek(0)
+                fd.truncate()
+                shutil.copyfileobj(fs, fd, COPY_BUFFER_SIZE)
+                method = 'copy'
+    if copy_mode:
+        shutil.copymode(src, dst)
+    return method
+
+
+_libc = None
+
+
+def get_libc():
+    """ Returns the libc with copy_file_range() and/or sendfile() set up, or None if not available. """
+    global _libc
+    if _libc is None:
+        _libc = False
+        if sys.platform.startswith('linux'):
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+            except OSError:
+                pass
+            else:
+                # copy_file_range() is only in glibc >= 2.27
+                if hasattr(libc, 'copy_file_range'):
+                    libc.copy_file_range.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p,
+                                                     ctypes.c_size_t, ctypes.c_uint]
+                    libc.copy_file_range.restype = ctypes.c_ssize_t
+                if hasattr(libc, 'sendfile'):
+                    libc.sendfile.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t]
+                    libc.sendfile.restype = ctypes.c_ssize_t
+                _libc = libc
+    return _libc or None
+
+
+def _call(f, *args):
+    """ Calls the libc function `f`, retrying on EINTR; raises OSError on failure. """
+    while True:
+        n = f(*args)
+        if n >= 0:
+            return n
+        e = ctypes.get_errno()
+        if e != errno.EINTR:
+            raise OSError(e, os.strerror(e))
+
+
+def _copy_in_kernel(fd_in, fd_out, size):
+    """
+        Copies `size` bytes from the current offset of `fd_in` to `fd_out` with copy_file_range(2)
+        or sendfile(2) (both advance the file offsets, as they are passed NULL offsets).
+
+        Returns the method used, or None if no method is available (nothing was written then).
+    """
+    libc = get_libc()
+    if libc is None:
+        return None
+    for name in ['copy_file_range', 'sendfile']:
+        f = getattr(libc, name, None)
+        if f is None:
+            continue
+        offset = 0
+        try:
+            while offset < size:
+                count = min(size - offset, 1 << 30)
+                if name == 'sendfile':
+                    n = _call(f, fd_out, fd_in, None, count)
+                else:
+                    n = _call(f, fd_in, None, fd_out, None, count, 0)
+                if n == 0:
+                    break
+                offset += n
+        except OSError as e:
+            if offset == 0 and e.errno in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                continue
+            raise
+        if offset < size:
+            # the file shrank while we were copying, or the method is not reliable here
+            return None
+        return name
+    return None
+
+
+def transfer_file(src, dst, move=False):
+    """
+        Makes `dst` have the contents of `src`, avoiding to copy the data when possible:
+        with a hardlink, or a rename (only if `move` is True: `src` is not needed anymore),
+        or a copy-on-write clone, or a copy in the kernel.
+
+        Returns the method used.
+    """
+    if os.path.lexists(dst):
+        os.unlink(dst)
+
+    try:
+        os.link(src, dst)
+        return 'hardlink'
+    except OSError:
+        # different device, or filesystem without hardlinks
+        pass
+
+    if move:
+        try:
+            os.rename(src, dst)
+            return 'rename'
+        except OSError:
+            pass
+
+    if reflink(src, dst):
+        return 'reflink'
+
+    return fast_copy(src, dst)
@@ -0,0 +1,177 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+from . import dclogger
+
+__all__ = ['wait_for_path']
+
+# from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CREATE | IN_MOVED_TO | IN_CLOSE_WRITE | IN_DELETE_SELF | IN_MOVE_SELF
+
+_libc = None
+
+
+def get_libc():
+    """ Returns the libc with the inotify functions, or None if not available. """
+    global _libc
+    if _libc is None:
+        _libc = False
+        if sys.platform.startswith('linux'):
+            try:
+                libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+                libc.inotify_init1
+                libc.inotify_add_watch
+                libc.inotify_rm_watch
+            except (OSError, AttributeError) as e:
+                dclogger.debug('inotify not available: %s' % e)
+            else:
+                _libc = libc
+    return _libc or None
+
+
+class DirectoryWatcher(object):
+    """
+        Notifies when something is created in a directory, using inotify.
+
+        Use create() to obtain one; it returns None if inotify is not available.
+    """
+
+    def __init__(self, libc, fd):
+        self.libc = libc
+        self.fd = fd
+        self.dirname = None
+        self.wd = None
+
+    @staticmethod
+    def create():
+        libc = get_libc()
+        if libc is None:
+            return None
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            dclogger.debug('inotify_init1() failed: %s' % os.strerror(ctypes.get_errno()))
+            return None
+        return DirectoryWatcher(libc, fd)
+
+    def watch(self, dirname):
+        """ Watches `dirname` instead of the previous directory. Returns False if not possible. """
+        if dirname == self.dirname:
+            return True
+        self.unwatch()
+        path = dirname if isinstance(dirname, bytes) else dirname.encode(sys.getfilesystemencoding())
+        wd = self.libc.inotify_add_watch(self.fd, path, WATCH_MASK)
+        if wd < 0:
+            dclogger.debug('Cannot watch %s: %s' % (dirname, os.strerror(ctypes.get_errno())))
+            return False
+        self.dirname = dirname
+        self.wd = wd
+        return True
+
+    def unwatch(self):
+        if self.wd is not None:
+            # fails harmlessly if the directory was removed in the meantime
+            self.libc.inotify_rm_watch(self.fd, self.wd)
+        self.dirname = None
+        self.wd = None
+
+    def wait(self, timeout):
+        """ Waits up to `timeout` seconds for some events; returns the number of events. """
+        try:
+            readable, _, _ = select.select([self.fd], [], [], timeout)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return 0
+            raise
+        if not readable:
+            return 0
+        return self._drain()
+
+    def _drain(self):
+        n = 0
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EINTR):
+                    return n
+                raise
+            header = struct.calcsize('iIII')
+            i = 0
+            while i + header <= len(data):
+                wd, mask, _cookie, length = struct.unpack_from('iIII', data, i)
+                if mask & (IN_DELETE_SELF | IN_MOVE_SELF) and wd == self.wd:
+                    # the watched directory is gone; watch again at the next check
+                    self.dirname = None
+                    self.wd = None
+                i += header + length
+                n += 1
+
+    def close(self):
+        os.close(self.fd)
+
+
+def deepest_existing_dir(fn):
+    d = os.path.dirname(os.path.abspath(fn))
+    while not os.path.isdir(d):
+        parent = os.path.dirname(d)
+        if parent == d:
+            break
+        d = parent
+    return d
+
+
+def wait_for_path(fn, timeout, poll_interval=1.0, log_interval=60.0):
+    """
+        Waits until `fn` exists. Returns True if it appeared, False on timeout.
+
+        On Linux we are woken up by inotify as soon as the file is created;
+        the directory that is watched is the deepest one that exists, so that
+        the directory of `fn` can also be created later.
+
+        We still check every `poll_interval` seconds, because on some filesystems
+        (network filesystems, some Docker bind mounts) the events are never delivered.
+    """
+    t0 = time.time()
+    watcher = DirectoryWatcher.create()
+    if watcher is None:
+        dclogger.debug('Waiting for %s by polling every %s s.' % (fn, poll_interval))
+    last_log = t0
+    try:
+        while True:
+            # watch before checking, so that we do not miss a file created in between
+            watching = watcher is not None and watcher.watch(deepest_existing_dir(fn))
+            if os.path.exists(fn):
+                return True
+
+            now = time.time()
+            remaining = t0 + timeout - now
+            if remaining <= 0:
+                return False
+
+            if now - last_log >= log_interval:
+                dclogger.debug('Output %s not ready yet (%d secs passed, will wait %d secs more)' %
+                               (fn, now - t0, remaining))
+                last_log = now
+
+            to_wait = min(poll_interval, remaining)
+            if watching:
+                watcher.wait(to_wait)
+            else:
+                time.sleep(to_wait)
+    finally:
+        if watcher is not None:
+            watcher.close()
@@ -0,0 +1,78 @@
+__all__ = ['FrozenDict', 'FrozenList', 'freeze', 'freeze_object']
+
+
+def _immutable(self, *args, **kwargs):
+    msg = 'This %s is shared and cannot be modified; use copy.deepcopy() to get a mutable copy.' % \
+          type(self).__name__
+    raise TypeError(msg)
+
+
+class FrozenDict(dict):
+    """ A dict that cannot be modified. Copies (copy, deepcopy, pickle) are plain dicts. """
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _immutable
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        from copy import deepcopy
+        return dict((deepcopy(k, memo), deepcopy(v, memo)) for k, v in self.items())
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+
+class FrozenList(list):
+    """ A list that cannot be modified. Copies (copy, deepcopy, pickle) are plain lists. """
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = __iadd__ = __imul__ = _immutable
+    append = extend = insert = pop = remove = reverse = sort = _immutable
+
+    def __copy__(self):
+        return list(self)
+
+    def __deepcopy__(self, memo):
+        from copy import deepcopy
+        return [deepcopy(_, memo) for _ in self]
+
+    def __reduce__(self):
+        return list, (list(self),)
+
+
+def freeze(x):
+    """ Returns a copy of `x` in which all dicts and lists are FrozenDict and FrozenList. """
+    if isinstance(x, dict):
+        return FrozenDict((k, freeze(v)) for k, v in x.items())
+    if isinstance(x, (list, tuple)):
+        return FrozenList(freeze(_) for _ in x)
+    return x
+
+
+def _new_object(cls, state):
+    ob = cls.__new__(cls)
+    ob.__dict__.update(state)
+    return ob
+
+
+def _reduce_frozen(self, protocol=None):
+    # copies and pickles are of the original, mutable, class
+    return _new_object, (type(self).__bases__[0], self.__dict__)
+
+
+_frozen_classes = {}
+
+
+def freeze_object(ob):
+    """
+        Makes the attributes of `ob` read-only, by changing its class to a subclass
+        without __setattr__. Its dicts and lists are not changed: use freeze() on them first.
+    """
+    cls = type(ob)
+    if cls not in _frozen_classes:
+        d = {'__setattr__': _immutable, '__delattr__': _immutable,
+             '__reduce_ex__': _reduce_frozen, '__reduce__': _reduce_frozen,
+             '__module__': cls.__module__}
+        _frozen_classes[cls] = type('Frozen' + cls.__name__, (cls,), d)
+    ob.__class__ = _frozen_classes[cls]
+    return ob
@@ -5,30 +5,38 @@ import copy
 import getpass
 import json
 import logging
-import mimetypes
 import os
-import platform
 import random
 import shutil
 import socket
-import subprocess
 import sys
+import threading
 import time
 import traceback
-from collections import OrderedDict
+from collections import OrderedDict, namedtuple
 
 import yaml
 
 from dt_shell.constants import DTShellConstants
 from dt_shell.env_checks import check_executable_exists, InvalidEnvironment, check_docker_environment
-from dt_shell.remote import ConnectionError, make_server_request, DEFAULT_DTSERVER
-from duckietown_challenges.runner_cache import copy_to_cache, get_file_from_cache
-from . import __version__
+from dt_shell.remote import ConnectionError, make_server_request, DEFAULT_DTSERVER, DEFAULT_TIMEOUT
+from duckietown_challenges.runner_cache import copy_to_cache, get_file_from_cache, JobCacheStats
+from . import __version__, runner_backends, runner_cache, runner_logs
 from .challenge import EvaluationParameters, SUBMISSION_CONTAINER_TAG
 from .challenge_results import read_challenge_results, ChallengeResults, ChallengeResultsStatus
 from .constants import CHALLENGE_SOLUTION_OUTPUT_DIR, CHALLENGE_RESULTS_DIR, CHALLENGE_DESCRIPTION_DIR, \
     CHALLENGE_EVALUATION_OUTPUT_DIR, ENV_CHALLENGE_NAME, ENV_CHALLENGE_STEP_NAME, CHALLENGE_PREVIOUS_STEPS_DIR
-from .utils import safe_yaml_dump, friendly_size, indent
+from .runner_backends import DockerComposeFail, get_backend, get_docker_client, BACKENDS
+from .runner_features import get_feature_provider
+from .runner_hashing import compute_artefacts_info
+from .runner_images import CouldNotPull, get_image_manager, get_required_images
+from .runner_logs import LogSink, HTMLRenderer, LOG_TAIL_SHOWN
+from .runner_metrics import get_metrics, start_metrics_server, start_metrics_textfile
+from .runner_polling import PollScheduler
+from .runner_resources import ResourceBudget, auto_nworkers
+from .runner_s3 import DEFAULT_S3_WORKERS, get_object_store, get_object_key_by_value
+from .runner_timing import PhaseTimer, get_timer
+from .utils import safe_yaml_dump, friendly_size, indent, map_threads
 
 logging.basicConfig()
 elogger = logging.getLogger('evaluator')
@@ -53,12 +61,6 @@ def dt_challenges_evaluator():
     elogger.info("dt-challenges-evaluator (DTC %s)" % __version__)
     elogger.info('called with:\n%s' % sys.argv)
     check_docker_environment()
-    try:
-        check_executable_exists('docker-compose')
-    except InvalidEnvironment:
-        msg = 'Could not find docker-compose. Please install it.'
-        msg += '\n\nSee: https://docs.docker.com/compose/install/#install-compose'
-        raise InvalidEnvironment(msg)
 
     usage = """
     
@@ -67,8 +69,26 @@ Usage:
 """
     parser = argparse.ArgumentParser(usage=usage)
     parser.add_argument("--continuous", action="store_true", default=False)
+    parser.add_argument("--workers", type=workers_option, default=1,
+                        help='Run this many jobs in parallel (implies --continuous; "auto" = based on CPUs '
+                             'and RAM)')
+    parser.add_argument("--pipeline", action="store_true", default=False,
+                        help='Prepare the next job and report the previous one while a job runs '
+                             '(implies --continuous)')
+    parser.add_argument("--poll-interval", dest='poll_interval', type=float, default=5.0,
+                        help='Seconds to wait before asking again for a job, when there are none')
+    parser.add_argument("--poll-max-interval", dest='poll_max_interval', type=float, default=60.0,
+                        help='Maximum interval between polls, reached by exponential backoff')
+    parser.add_argument("--long-poll", dest='long_poll', type=float, default=None,
+                        help='Ask the server to wait up to this many seconds for a job before answering')
+    parser.add_argument("--backend", dest='backend', default='compose', choices=sorted(BACKENDS),
+                        help='Run the containers with docker-compose, or directly with the Docker API')
     parser.add_argument("--no-pull", dest='no_pull', action="store_true", default=False)
     parser.add_argument("--no-upload", dest='no_upload', action="store_true", default=False)
+    parser.add_argument("--upload-workers", dest='upload_workers', type=int, default=DEFAULT_S3_WORKERS,
+                        help='Number of concurrent S3 uploads')
+    parser.add_argument("--download-workers", dest='download_workers', type=int, default=DEFAULT_S3_WORKERS,
+                        help='Number of concurrent S3 downloads of previous steps artefacts')
     parser.add_argument("--no-delete", dest='no_delete', action="store_true", default=False)
     parser.add_argument("--machine-id", default=None, help='Machine name')
     parser.add_argument("--name", default=None, help='Evaluator name')
@@ -76,6 +96,22 @@ Usage:
     parser.add_argument("--reset", dest='reset', action="store_true", default=False,
                         help='Reset submission')
     parser.add_argument("--features", default='{}')
+    parser.add_argument("--cache-max-size-gb", dest='cache_max_size_gb', type=float, default=None,
+                        help='Maximum size of the artefacts cache (default: unbounded)')
+    parser.add_argument("--cache-policy", dest='cache_policy', default='lru', choices=runner_cache.EVICTION_POLICIES,
+                        help='Which cache entries to evict first')
+    parser.add_argument("--log-max-size-mb", dest='log_max_size_mb', type=float, default=100,
+                        help='Maximum size of the log of each container; 0 for unlimited. '
+                             'Beyond this, only the end of the log is kept.')
+    parser.add_argument("--compress-logs", dest='compress_logs', action='store_true', default=False,
+                        help='Write the logs as log-<service>.txt.gz')
+    parser.add_argument("--log-html-max-size-mb", dest='log_html_max_size_mb', type=float, default=4,
+                        help='For longer logs, only the beginning and the end are rendered to HTML')
+    parser.add_argument("--metrics-port", dest='metrics_port', type=int, default=None,
+                        help='Serve metrics in the Prometheus format on this port (at /metrics)')
+    parser.add_argument("--metrics-textfile", dest='metrics_textfile', default=None,
+                        help='Write metrics in the Prometheus format to this file '
+                             '(for the textfile collector of node_exporter)')
     parsed = parser.parse_args()
 
     tmpdir = '/tmp/duckietown/DT18/evaluator/executions'
@@ -90,6 +126,25 @@ Usage:
         msg = 'I expected that the features are a dict; obtained %s: %r' % (type(more_features).__name__, more_features)
         raise Exception(msg)
 
+    if parsed.cache_max_size_gb is not None:
+        runner_cache.cache_max_size_bytes = int(parsed.cache_max_size_gb * 1024 * 1024 * 1024)
+    runner_cache.cache_eviction_policy = parsed.cache_policy
+    runner_backends.backend_name = parsed.backend
+    if parsed.backend == 'compose':
+        try:
+            check_executable_exists('docker-compose')
+        except InvalidEnvironment:
+            msg = 'Could not find docker-compose. Please install it.'
+            msg += '\n\nSee: https://docs.docker.com/compose/install/#install-compose'
+            raise InvalidEnvironment(msg)
+    runner_logs.log_max_size_bytes = int(parsed.log_max_size_mb * 1024 * 1024) or None
+    runner_logs.compress_logs = parsed.compress_logs
+    runner_logs.html_max_bytes = int(parsed.log_html_max_size_mb * 1024 * 1024)
+    if parsed.metrics_port is not None:
+        start_metrics_server(parsed.metrics_port)
+    if parsed.metrics_textfile is not None:
+        start_metrics_textfile(parsed.metrics_textfile)
+
     do_pull = not parsed.no_pull
     do_upload = not parsed.no_upload
     delete = not parsed.no_delete
@@ -99,31 +154,23 @@ Usage:
 
     args = dict(do_upload=do_upload, do_pull=do_pull, more_features=more_features,
                 delete=delete, evaluator_name=evaluator_name, machine_id=machine_id,
-                tmpdir=tmpdir)
-    if parsed.continuous:
-
-        timeout = 5.0  # seconds
-        multiplier = 1.0
-        max_multiplier = 10
-        while True:
-            multiplier = min(multiplier, max_multiplier)
-            try:
-                go_(None, reset=False, **args)
-                multiplier = 1.0
-            except NothingLeft:
-                sys.stderr.write('.')
-                # time.sleep(timeout * multiplier)
-                # elogger.info('No submissions available to evaluate.')
-            except ConnectionError as e:
-                elogger.error(e)
-                multiplier *= 1.5
-            except BaseException as e:
-                msg = 'Uncaught exception:\n%s' % traceback.format_exc(e)
-                elogger.error(msg)
-                multiplier *= 1.5
-
-            time.sleep(timeout * multiplier)
-
+                tmpdir=tmpdir, upload_workers=parsed.upload_workers,
+                download_workers=parsed.download_workers, long_poll=parsed.long_poll)
+    poll_options = dict(initial_interval=parsed.poll_interval, max_interval=parsed.poll_max_interval)
+    if parsed.pipeline:
+        if parsed.workers != 1:
+            msg = 'Cannot use --pipeline together with --workers.'
+            raise Exception(msg)
+        from .runner_pipeline import pipeline_loop
+        scheduler = PollScheduler(**poll_options)
+        get_metrics().register_scheduler(evaluator_name, scheduler)
+        pipeline_loop(args, scheduler)
+    elif parsed.workers != 1:
+        run_workers(parsed.workers, args, poll_options)
+    elif parsed.continuous:
+        scheduler = PollScheduler(**poll_options)
+        get_metrics().register_scheduler(evaluator_name, scheduler)
+        continuous_loop(args, scheduler)
     else:
         if parsed.submission:
             submissions = [parsed.submission]
@@ -143,43 +190,87 @@ Usage:
                 elogger.error(msg)
 
 
+def continuous_loop(args, scheduler):
+    """ Evaluates jobs forever, polling the server as decided by the PollScheduler. """
+    while True:
+        t0 = time.time()
+        try:
+            go_(None, reset=False, **args)
+            stats = scheduler.get_stats()
+            elogger.info('Job done; before it we were idle for %.0f s.' % stats['idle_seconds_current'])
+            wait = scheduler.on_job()
+        except NothingLeft:
+            sys.stderr.write('.')
+            # elogger.info('No submissions available to evaluate.')
+            wait = scheduler.on_nothing_left(time.time() - t0)
+            if args['do_pull']:
+                # nothing to do: refresh the images of the recent challenges
+                get_image_manager().prewarm()
+        except ConnectionError as e:
+            elogger.error(e)
+            wait = scheduler.on_error(time.time() - t0)
+        except BaseException as e:
+            msg = 'Uncaught exception:\n%s' % traceback.format_exc(e)
+            elogger.error(msg)
+            wait = scheduler.on_error(time.time() - t0)
+
+        scheduler.sleep(wait)
+
+
+def workers_option(s):
+    """ Parses the value of --workers: a number >= 1, or 'auto' (returned as 0). """
+    if s == 'auto':
+        return 0
+    try:
+        n = int(s)
+    except ValueError:
+        n = 0
+    if n < 1:
+        msg = 'Expected a number of workers >= 1, or "auto"; got %r.' % s
+        raise argparse.ArgumentTypeError(msg)
+    return n
+
+
+def run_workers(nworkers, args, poll_options):
+    """
+        Runs `nworkers` continuous loops in parallel (0 = decide based on the host features).
+
+        Each worker has its own process id (and therefore working directories
+        and Docker Compose projects); admission is controlled by a ResourceBudget.
+    """
+    features = get_features(args['more_features'])
+    if nworkers == 0:
+        nworkers = auto_nworkers(features)
+    resources = ResourceBudget(features, nworkers)
+    elogger.info('Starting %d workers; each job reserves by default %s' % (nworkers, resources.share))
+
+    threads = []
+    for i in range(nworkers):
+        wargs = dict(args)
+        wargs['evaluator_name'] = '%s-w%d' % (args['evaluator_name'], i)
+        wargs['resources'] = resources
+        # other workers might be starting their containers
+        wargs['prune_networks'] = False
+        scheduler = PollScheduler(**poll_options)
+        get_metrics().register_scheduler(wargs['evaluator_name'], scheduler)
+        t = threading.Thread(target=continuous_loop, args=(wargs, scheduler), name='worker%d' % i)
+        t.daemon = True
+        t.start()
+        threads.append(t)
+
+    # join() with a timeout, so that Ctrl-C still works
+    while any(t.is_alive() for t in threads):
+        for t in threads:
+            t.join(1.0)
+
+
 class NothingLeft(Exception):
     pass
 
 
 def get_features(more_features):
-    import psutil
-
-    features = {}
-
-    machine = platform.machine()
-    features['linux'] = sys.platform.startswith('linux')
-    features['mac'] = sys.platform.startswith('darwin')
-    features['x86_64'] = (machine == 'x86_64')
-    features['armv7l'] = (machine == 'armv7l')
-    meminfo = psutil.virtual_memory()
-    # svmem(total=16717422592, available=5376126976, percent=67.8, used=10359984128, free=1831890944, active=7191916544, inactive=2325667840, buffers=525037568, cached=4000509952, shared=626225152)
-
-    features['ram_total_mb'] = int(meminfo.total / (1024 * 1024.0))
-    features['ram_available_mb'] = int(meminfo.available / (1024 * 1024.0))
-    features['nprocessors'] = psutil.cpu_count()
-    cpu_freq = psutil.cpu_freq()
-    if cpu_freq is not None:
-        # None on Docker
-        features['processor_frequency_mhz'] = int(psutil.cpu_freq().max)
-    f = psutil.cpu_percent(interval=0.2)
-    features['processor_free_percent'] = int(100.0 - f)
-    features['p1'] = True
-
-    disk = psutil.disk_usage(os.getcwd())
-
-    features['disk_total_mb'] = disk.total / (1024 * 1024)
-    features['disk_available_mb'] = disk.free / (1024 * 1024)
-    features['picamera'] = False
-    features['nduckiebots'] = False
-    features['map_3x3'] = False
-
-    features['gpu'] = os.path.exists('/proc/driver/nvidia/version')
+    """ The features of this host (see runner_features), overridden by `more_features`. """
+    features = get_feature_provider().get_features()
 
     for k, v in more_features.items():
         if k in features:
@@ -192,25 +283,87 @@ def get_features(more_features):
     return features
 
 
-class DockerComposeFail(Exception):
-    pass
-
-
-def go_(submission_id, do_pull, more_features, do_upload, delete, reset, evaluator_name, machine_id, tmpdir):
-    features = get_features(more_features)
+class Job(object):
+    """ State of one evaluation job, as it goes through the stages of go_(). """
+
+    def __init__(self, res, token, machine_id, process_id, evaluator_version, timer=None):
+        self.res = res
+        self.job_id = res['job_id']
+        self.token = token
+        self.machine_id = machine_id
+        self.process_id = process_id
+        self.evaluator_version = evaluator_version
+        self.cache_stats = JobCacheStats()
+        # how long each phase took
+        self.timer = get_timer(timer)
+
+        self.aws_config = None
+        self.wd = None
+        self.project = None
+        self.config = None
+        # set when the job is completed, or as soon as something goes wrong
+        self.cr = None
+        self.uploaded = []
+        # true if there was an unexpected error; then we just report it
+        self.aborted = False
+        # renders the logs to HTML in the background
+        self.html_renderer = None
+
+    def set_error(self, msg):
+        elogger.error(msg)
+        self.aborted = True
+        status = ChallengeResultsStatus.ERROR
+        self.cr = ChallengeResults(status, msg, scores={})
+        self.uploaded = []
+
+
+def go_(submission_id, do_pull, more_features, do_upload, delete, reset, evaluator_name, machine_id, tmpdir,
+        upload_workers=DEFAULT_S3_WORKERS, download_workers=DEFAULT_S3_WORKERS, resources=None,
+        prune_networks=True, long_poll=None):
+    job = claim_job(submission_id, more_features, reset, evaluator_name, machine_id, resources=resources,
+                    long_poll=long_poll)
+    prepare_job(job, do_pull=do_pull, do_upload=do_upload, tmpdir=tmpdir, evaluator_name=evaluator_name,
+                download_workers=download_workers)
+    execute_job(job, prune_networks=prune_networks)
+    finish_job(job, do_upload=do_upload, delete=delete, upload_workers=upload_workers, resources=resources)
+
+
+def claim_job(submission_id, more_features, reset, evaluator_name, machine_id, resources=None, long_poll=None):
+    """
+        Asks the server for a job. Raises NothingLeft if there is nothing to do.
+
+        If `long_poll` is given, the server can wait up to that many seconds for a job.
+    """
+    timer = PhaseTimer()
+    with timer.phase('features'):
+        features = get_features(more_features)
     token = get_token_from_shell_config()
     evaluator_version = __version__
     process_id = evaluator_name
 
-    res = dtserver_work_submission(token, submission_id, machine_id, process_id, evaluator_version,
-                                   features=features, reset=reset)
+    def do_claim(features_):
+        return dtserver_work_submission(token, submission_id, machine_id, process_id, evaluator_version,
+                                        features=features_, reset=reset, long_poll=long_poll)
+
+    with timer.phase('claim'):
+        if resources is None:
+            res = do_claim(features)
+        else:
+            res = resources.claim(do_claim, features)
 
     if 'job_id' not in res:
         msg = 'Could not find jobs: %s' % res['msg']
         raise NothingLeft(msg)
 
-    job_id = res['job_id']
+    get_metrics().inc('dtc_jobs_claimed_total')
+    return Job(res, token=token, machine_id=machine_id, process_id=process_id,
+               evaluator_version=evaluator_version, timer=timer)
+
 
+def prepare_job(job, do_pull, do_upload, tmpdir, evaluator_name, download_workers=DEFAULT_S3_WORKERS):
+    """ Downloads the artefacts, writes and validates the Docker Compose file, and pulls the images. """
+    res = job.res
+    job_id = job.job_id
     try:
         elogger.info(safe_yaml_dump(res))
 
@@ -228,8 +381,9 @@ def go_(submission_id, do_pull, more_features, do_upload, delete, reset, evaluat
         aws_config = res['aws_config']
         if aws_config and do_upload:
             try_s3(aws_config)
+        job.aws_config = aws_config
 
-            # evaluation_protocol = challenge_parameters['protocol']
+        # evaluation_protocol = challenge_parameters['protocol']
         # assert evaluation_protocol == 'p1'
 
         # you get this from the server
@@ -247,14 +401,17 @@ def go_(submission_id, do_pull, more_features, do_upload, delete, reset, evaluat
         if os.path.exists(wd):
             shutil.rmtree(wd)
         os.makedirs(wd)
+        job.wd = wd
 
         challenge_parameters_ = EvaluationParameters.from_yaml(res['challenge_parameters'])
 
-        prepare_dir(wd, aws_config, steps2artefacts)
+        prepare_dir(wd, aws_config, steps2artefacts, nworkers=download_workers, cache_stats=job.cache_stats,
+                    timer=job.timer)
 
         config = get_config(challenge_parameters_, solution_container, challenge_name, challenge_step_name)
         config_yaml = yaml.safe_dump(config, encoding='utf-8', indent=4, allow_unicode=True)
         elogger.debug('YAML:\n' + config_yaml)
+        job.config = config
 
         dcfn = os.path.join(wd, 'docker-compose.yaml')
 
@@ -265,42 +422,96 @@ def go_(submission_id, do_pull, more_features, do_upload, delete, reset, evaluat
         # validate the configuration
 
         project = 'job%s-%s' % (job_id, random.randint(1, 10000))
+        job.project = project
 
+        backend = get_backend()
         try:
-            run_docker(wd, project, ['config'])
-            valid_config = True
-            valid_config_error = None
+            with job.timer.phase('config'):
+                backend.validate(wd, project)
         except DockerComposeFail as e:
             valid_config_error = 'Could not validate Docker Compose configuration:\n%s' % traceback.format_exc(e)
             elogger.error(valid_config_error)
-            valid_config = False
-
-        if valid_config:
-            cr = run(wd, project, do_pull)
-
-            write_logs(wd, project, services=config['services'])
-        else:
             status = ChallengeResultsStatus.ERROR
+            job.cr = ChallengeResults(status, valid_config_error, scores={})
+            return
 
-            cr = ChallengeResults(status, valid_config_error, scores={})
-
-        if not do_upload:
-            aws_config = None
+        if do_pull:
+            try:
+                elogger.info('pulling containers')
+                required_images = get_required_images(challenge_parameters_)
+                image_manager = get_image_manager()
+                with job.timer.phase('pull'):
+                    image_manager.ensure(required_images)
+                # the submission image will not be needed again
+                image_manager.remember(challenge_name, [_ for _ in required_images
+                                                        if _.image != solution_container])
+            except CouldNotPull as e:
+                msg = 'Could not pull the containers:\n%s' % traceback.format_exc(e)
+                elogger.error(msg)
+                status = ChallengeResultsStatus.ERROR
+                job.cr = ChallengeResults(status, msg, scores={})
 
-        uploaded = upload_files(wd, aws_config)
+    except BaseException as e:  # XXX
+        msg = 'Uncaught exception:\n%s' % traceback.format_exc(e)
+        job.set_error(msg)
 
-        if delete:
-            cmd = ['down']
-            run_docker(wd, project, cmd)
 
-        if delete:
-            shutil.rmtree(wd)
+def execute_job(job, prune_networks=True):
+    """ Runs the containers and collects their logs. Does nothing if the job already failed. """
+    if job.cr is not None:
+        return
+    try:
+        job.cr = run(job.wd, job.project, do_pull=False, prune_networks=prune_networks, timer=job.timer)
+
+        with job.timer.phase('logs'):
+            sinks = write_logs(job.wd, job.project, services=job.config['services'])
+        if job.cr.get_status() != ChallengeResultsStatus.SUCCESS:
+            for service, sink in sinks.items():
+                tail = sink.get_tail(LOG_TAIL_SHOWN)
+                elogger.info('Last lines of the log of %s:\n%s' % (service, indent(tail, '  | ')))
+
+        # The HTML versions are rendered while the other files are uploaded.
+        logs = [(sink.fn, os.path.join(job.wd, 'log-%s.html' % service)) for service, sink in sinks.items()]
+        job.html_renderer = HTMLRenderer(logs).start()
     except BaseException as e:  # XXX
         msg = 'Uncaught exception:\n%s' % traceback.format_exc(e)
-        elogger.error(msg)
-        status = ChallengeResultsStatus.ERROR
-        cr = ChallengeResults(status, msg, scores={})
-        uploaded = []
+        job.set_error(msg)
+
+
+def finish_job(job, do_upload, delete, upload_workers=DEFAULT_S3_WORKERS, resources=None):
+    """ Uploads the artefacts, cleans up, and reports the result to the server. """
+    cr = job.cr
+    job_id = job.job_id
+    if not job.aborted:
+        try:
+            aws_config = job.aws_config if do_upload else None
+
+            # the logs in HTML are uploaded last, as they might still be being rendered
+            renderer = job.html_renderer
+            pending = [os.path.relpath(_, job.wd) for _ in renderer.get_outputs()] if renderer is not None else []
+            job.uploaded = upload_files(job.wd, aws_config, nworkers=upload_workers, exclude=pending,
+                                        timer=job.timer)
+            if renderer is not None:
+                with job.timer.phase('wait_html'):
+                    renderer.join()
+                job.uploaded += upload_files(job.wd, aws_config, nworkers=upload_workers, only=pending,
+                                             timer=job.timer)
+
+            if delete:
+                if job.project is not None:
+                    with job.timer.phase('down'):
+                        get_backend().down(job.wd, job.project)
+
+            if delete:
+                with job.timer.phase('cleanup'):
+                    shutil.rmtree(job.wd)
+        except BaseException as e:  # XXX
+            msg = 'Uncaught exception:\n%s' % traceback.format_exc(e)
+            job.set_error(msg)
+            cr = job.cr
+
+    if resources is not None:
+        resources.release(job_id)
 
     msg = 'This is what is being reported.\n\nstatus = %s\n\n%s' % (cr.get_status(), cr.msg)
     if cr.get_status() != ChallengeResultsStatus.SUCCESS:
@@ -308,20 +519,27 @@ def go_(submission_id, do_pull, more_features, do_upload, delete, reset, evaluat
     else:
         elogger.info(msg)
 
-    stats = cr.get_stats()
+    cache_stats = job.cache_stats.as_dict()
+    # the time of the report itself is only logged
+    timing = job.timer.as_dict()
+    elogger.info('Timing (seconds):\n%s' % '\n'.join('%15s %8.2f' % _ for _ in timing.items()))
+    get_metrics().record_job(cr.get_status(), timing, cache_stats)
+    stats = cr.get_stats(cache=cache_stats, timing=timing)
+    t0 = time.time()
     # REST call to the duckietown chalenges server
     ntries = 5
     interval = 10
     while ntries >= 0:
         try:
-            dtserver_report_job(token,
+            dtserver_report_job(job.token,
                                 job_id=job_id,
                                 stats=stats,
                                 result=cr.get_status(),
-                                machine_id=machine_id,
-                                process_id=process_id,
-                                evaluator_version=evaluator_version,
-                                uploaded=uploaded)
+                                machine_id=job.machine_id,
+                                process_id=job.process_id,
+                                evaluator_version=job.evaluator_version,
+                                uploaded=job.uploaded)
+            elogger.debug('Reported in %.2f s' % (time.time() - t0))
             break
         except BaseException as e:
             msg = 'Could not report: %s' % e
@@ -331,29 +549,28 @@ def go_(submission_id, do_pull, more_features, do_upload, delete, reset, evaluat
             time.sleep(interval)
 
 
-def run(wd, project, do_pull):
-    import docker
-    client = docker.from_env()
+def run(wd, project, do_pull, prune_networks=True, timer=None):
+    backend = get_backend()
+    timer = get_timer(timer)
 
     try:
         if do_pull:
             elogger.info('pulling containers')
-            cmd = ['pull']
-            run_docker(wd, project, cmd)
+            with timer.phase('pull'):
+                backend.pull(wd, project)
 
-        pruned = client.networks.prune()
-        elogger.debug('pruned: %s' % pruned)
+        if prune_networks:
+            with timer.phase('prune_networks'):
+                pruned = get_docker_client().networks.prune()
+            elogger.debug('pruned: %s' % pruned)
 
         # elogger.info('Creating containers')
         # cmd = ['create', '--force-recreate']
         # run_docker(wd, project, cmd)
 
         elogger.info('Running containers')
-        cmd = ['up',
-               # '--remove-orphans',
-               '--abort-on-container-exit'
-               ]
-        run_docker(wd, project, cmd)
+        with timer.phase('up'):
+            backend.up(wd, project)
 
         cr = read_challenge_results(wd)
 
@@ -366,7 +583,7 @@ def run(wd, project, do_pull):
     return cr
 
 
-def prepare_dir(wd, aws_config, steps2artefacts):
+def prepare_dir(wd, aws_config, steps2artefacts, nworkers=DEFAULT_S3_WORKERS, cache_stats=None, timer=None):
     # output for the sub
     challenge_solution_output_dir = os.path.join(wd, CHALLENGE_SOLUTION_OUTPUT_DIR)
     # the yaml with the scores
@@ -380,7 +597,9 @@ def prepare_dir(wd, aws_config, steps2artefacts):
               challenge_evaluation_output_dir, previous_steps_dir]:
         os.makedirs(d)
 
-    download_artefacts(aws_config, steps2artefacts, previous_steps_dir)
+    with get_timer(timer).phase('download'):
+        download_artefacts(aws_config, steps2artefacts, previous_steps_dir, nworkers=nworkers,
+                           cache_stats=cache_stats)
 
 
 def get_config(challenge_parameters_, solution_container, challenge_name, challenge_step_name):
@@ -445,61 +664,57 @@ def get_config(challenge_parameters_, solution_container, challenge_name, challe
 
 
 def write_logs(wd, project, services):
-    for service in services:
-        cmd = ['ps', '-q', service]
+    """
+        Writes the logs of the services to log-<service>.txt (or .txt.gz), streaming them.
 
+        Returns a dict service -> LogSink (closed), which remembers the end of the log.
+    """
+    sinks = OrderedDict()
+    backend = get_backend()
+    for service in services:
         try:
-            o = run_docker(wd, project, cmd, get_output=True)
-            container_id = o.strip()  # \n at the end
+            container_id = backend.get_container_id(wd, project, service)
         except DockerComposeFail:
             continue
 
-        if not container_id:
-            logs = 'Service "%s" was not started.' % service
-            elogger.warning(logs)
-        else:
-            elogger.info('Found container ID = %r' % container_id)
-            import docker
-            client = docker.from_env()
-            logs = logs_for_container(client, container_id)
-
         fn = os.path.join(wd, 'log-%s.txt' % service)
-        with open(fn, 'w') as f:
-            f.write(logs)
-
-        from ansi2html import Ansi2HTMLConverter
-        conv = Ansi2HTMLConverter()
-        html = conv.convert(logs)
-        fn = os.path.join(wd, 'log-%s.html' % service)
-        with open(fn, 'w') as f:
-            f.write(html)
-
-
-def run_docker(cwd, project, cmd0, get_output=False):
-    cmd0 = ['docker-compose', '-p', project] + cmd0
-    elogger.info('Running:\n\t%s' % " ".join(cmd0) + '\n\n in %s' % cwd)
-
-    try:
-        if get_output:
-            return subprocess.check_output(cmd0, cwd=cwd, stderr=sys.stderr)
-        else:
-            subprocess.check_call(cmd0, cwd=cwd, stdout=sys.stdout, stderr=sys.stderr)
-    except subprocess.CalledProcessError as e:
-        msg = 'Could not run %s:\n\n %s' % (cmd0, indent(e, '  >  '))
-        msg += '\n\n%s' % indent(e.output, ' docker-compose stdout  | ')
-        # msg += '\n\n%s' % indent(e., ' docker-compose stderr  | ')
-        raise DockerComposeFail(msg)
-
-
-def upload_files(wd, aws_config, ignore_patterns=('.DS_Store',)):
+        if runner_logs.compress_logs:
+            fn += '.gz'
+        with LogSink(fn, max_bytes=runner_logs.log_max_size_bytes, compress=runner_logs.compress_logs) as sink:
+            if not container_id:
+                logs = 'Service "%s" was not started.' % service
+                elogger.warning(logs)
+                sink.write(logs)
+            else:
+                elogger.info('Found container ID = %r' % container_id)
+                logs_for_container(get_docker_client(), container_id, sink)
+
+            if sink.truncated:
+                elogger.warning('The log of %s was truncated (%s in total)' % (service, friendly_size(sink.total)))
+        sinks[service] = sink
+    return sinks
+
+
+def upload_files(wd, aws_config, ignore_patterns=('.DS_Store',), nworkers=DEFAULT_S3_WORKERS, only=None,
+                 exclude=(), timer=None):
+    """
+        Uploads the files in `wd`; if `only` is given, just the files with those relative paths.
+        The files with the relative paths in `exclude` are skipped.
+    """
+    timer = get_timer(timer)
     toupload = get_files_to_upload(wd, ignore_patterns=ignore_patterns)
-
-    if not aws_config:
-        msg = 'Not uploading artefacts because AWS config not passed.'
-        elogger.info(msg)
-        uploaded = only_copy_to_cache(toupload)
-    else:
-        uploaded = upload(aws_config, toupload)
+    if only is not None:
+        toupload = OrderedDict((k, v) for k, v in toupload.items() if k in only)
+    if exclude:
+        toupload = OrderedDict((k, v) for k, v in toupload.items() if k not in exclude)
+
+    with timer.phase('upload'):
+        if not aws_config:
+            msg = 'Not uploading artefacts because AWS config not passed.'
+            elogger.info(msg)
+            uploaded = only_copy_to_cache(toupload)
+        else:
+            uploaded = upload(aws_config, toupload, nworkers=nworkers)
 
     return uploaded
 
@@ -508,7 +723,21 @@ class CouldNotDownloadAll(Exception):
     pass
 
 
-def download_artefacts(aws_config, steps2artefacts, wd):
+ArtefactToDownload = namedtuple('ArtefactToDownload', 'rpath fn sha256hex size bucket_name object_key')
+
+
+def download_artefacts(aws_config, steps2artefacts, wd, nworkers=DEFAULT_S3_WORKERS, cache_stats=None):
+    """
+        Materializes the artefacts of the previous steps in `wd`.
+
+        First all the cache hits are served, and the list of the misses is computed,
+        so that we fail early if something cannot be downloaded. Then the misses
+        are downloaded concurrently; size and hash are verified while streaming.
+
+        The cache usage is accounted in `cache_stats` (a JobCacheStats), if given.
+    """
+    todownload = []
+    hits_bytes = 0
     for step_name, artefacts in steps2artefacts.items():
         step_dir = os.path.join(wd, step_name)
         os.makedirs(step_dir)
@@ -524,8 +753,9 @@ def download_artefacts(aws_config, steps2artefacts, wd):
             storage = data['storage']
 
             try:
-                get_file_from_cache(fn, sha256hex)
+                get_file_from_cache(fn, sha256hex, job_stats=cache_stats)
                 elogger.info('cache   %7s   %s' % (friendly_size(size), rpath))
+                hits_bytes += size
             except KeyError:
 
                 # no local
@@ -537,47 +767,70 @@ def download_artefacts(aws_config, steps2artefacts, wd):
                         s3ob = storage['s3']
                         bucket_name = s3ob['bucket_name']
                         object_key = s3ob['object_key']
-
-                        elogger.info('AWS     %7s   %s' % (friendly_size(size), rpath))
-                        get_object(aws_config, bucket_name, object_key, fn)
-                        copy_to_cache(fn, sha256hex)
-
-                    size_now = os.stat(fn).st_size
-                    if size_now != size:
-                        msg = 'Corrupt cache or download for %s at %s.' % (data, fn)
-                        raise ValueError(msg)
+                        todownload.append(ArtefactToDownload(rpath=rpath, fn=fn, sha256hex=sha256hex, size=size,
+                                                             bucket_name=bucket_name, object_key=object_key))
                 else:
                     msg = 'Not in cache and no way to download'
                     raise CouldNotDownloadAll(msg)
 
+    misses_bytes = sum(_.size for _ in todownload)
+    elogger.info('artefacts: %d from cache (%s), %d to download (%s)' %
+                 (sum(len(_) for _ in steps2artefacts.values()) - len(todownload), friendly_size(hits_bytes),
+                  len(todownload), friendly_size(misses_bytes)))
+    if not todownload:
+        return
+
+    stores = {}
+    for a in todownload:
+        if a.bucket_name not in stores:
+            stores[a.bucket_name] = get_object_store(aws_config, a.bucket_name, nworkers=nworkers)
+
+    def download_one(a):
+        elogger.info('AWS     %7s   %s' % (friendly_size(a.size), a.rpath))
+        size_now, sha256hex_now = stores[a.bucket_name].download_file(a.object_key, a.fn)
+        if size_now != a.size or sha256hex_now != a.sha256hex:
+            msg = 'Corrupt download for %s at %s (got %s bytes with hash %s).' % (a, a.fn, size_now, sha256hex_now)
+            raise ValueError(msg)
+        copy_to_cache(a.fn, a.sha256hex, origin='s3://%s/%s' % (a.bucket_name, a.object_key))
+        if cache_stats is not None:
+            cache_stats.record_download(size_now)
+
+    # the same content might be referenced more than once
+    sha2first = OrderedDict()
+    for a in todownload:
+        sha2first.setdefault(a.sha256hex, a)
+    unique = list(sha2first.values())
+
+    t0 = time.time()
+    # largest first, so that the long downloads do not end up at the tail
+    map_threads(download_one, sorted(unique, key=lambda _: -_.size), nworkers)
+    delta = time.time() - t0
+
+    for a in todownload:
+        first = sha2first[a.sha256hex]
+        if a is not first:
+            shutil.copy(first.fn, a.fn)
+
+    downloaded_bytes = sum(_.size for _ in unique)
+    elogger.info('downloaded %s in %.1f s (%s/s)' % (friendly_size(downloaded_bytes), delta,
+                                                     friendly_size(downloaded_bytes / max(delta, 0.001))))
+
 
 def try_s3(aws_config):
     bucket_name = aws_config['bucket_name']
-    aws_access_key_id = aws_config['aws_access_key_id']
-    aws_secret_access_key = aws_config['aws_secret_access_key']
     aws_root_path = aws_config['path']
-    import boto3
-    s3 = boto3.resource("s3",
-                        aws_access_key_id=aws_access_key_id,
-                        aws_secret_access_key=aws_secret_access_key)
+    store = get_object_store(aws_config, bucket_name)
 
     s = 'initial data'
     data = StringIO.StringIO(s)
     elogger.debug('trying bucket connection')
-    s3_object = s3.Object(bucket_name, os.path.join(aws_root_path, 'initial.txt'))
-    s3_object.upload_fileobj(data)
+    store.upload_fileobj(data, os.path.join(aws_root_path, 'initial.txt'))
     elogger.debug('uploaded')
 
 
 def get_object(aws_config, bucket_name, object_key, fn):
-    aws_access_key_id = aws_config['aws_access_key_id']
-    aws_secret_access_key = aws_config['aws_secret_access_key']
-    import boto3
-    s3 = boto3.resource("s3",
-                        aws_access_key_id=aws_access_key_id,
-                        aws_secret_access_key=aws_secret_access_key)
-    aws_object = s3.Object(bucket_name, object_key)
-    aws_object.download_file(fn)
+    store = get_object_store(aws_config, bucket_name)
+    store.download_file(object_key, fn)
 
 
 def get_files_to_upload(path, ignore_patterns=()):
@@ -604,85 +857,70 @@ def get_files_to_upload(path, ignore_patterns=()):
     return toupload
 
 
-def logs_for_container(client, container_id):
-    logs = ''
+def logs_for_container(client, container_id, sink):
+    """ Streams the logs of the container to the LogSink. """
     container = client.containers.get(container_id)
     for c in container.logs(stdout=True, stderr=True, stream=True, timestamps=True):
-        logs += c
-    return logs
+        sink.write(c)
 
 
 def only_copy_to_cache(toupload):
+    infos = compute_artefacts_info(toupload)
     uploaded = []
-    for rpath, realfile in toupload.items():
-        sha256hex = compute_sha256hex(realfile)
-        copy_to_cache(realfile, sha256hex)
-        size = os.stat(realfile).st_size
-        mime_type = guess_mime_type(realfile)
+    for rpath, info in infos.items():
+        copy_to_cache(info.realfile, info.sha256hex, origin='output:%s' % rpath)
         storage = {}
-        uploaded.append(dict(size=size,
-                             mime_type=mime_type, rpath=rpath, sha256hex=sha256hex, storage=storage))
+        uploaded.append(dict(size=info.size,
+                             mime_type=info.mime_type, rpath=rpath, sha256hex=info.sha256hex, storage=storage))
     return uploaded
 
 
-def guess_mime_type(filename):
-    mime_type, _encoding = mimetypes.guess_type(filename)
-
-    if mime_type is None:
-        if filename.endswith('.yaml'):
-            mime_type = 'text/yaml'
-        else:
-            mime_type = 'binary/octet-stream'
-    return mime_type
-
-
-def upload(aws_config, toupload):
-    import boto3
-    from botocore.exceptions import ClientError
+def upload(aws_config, toupload, nworkers=DEFAULT_S3_WORKERS):
+    """
+        Uploads the files to S3 by value, using up to `nworkers` concurrent requests.
 
+        Existence checks are done once per distinct hash; the returned list
+        has the same order as `toupload`.
+    """
     bucket_name = aws_config['bucket_name']
-    aws_access_key_id = aws_config['aws_access_key_id']
-    aws_secret_access_key = aws_config['aws_secret_access_key']
     # aws_root_path = aws_config['path']
-    aws_path_by_value = aws_config['path_by_value']
 
-    s3 = boto3.resource("s3",
-                        aws_access_key_id=aws_access_key_id,
-                        aws_secret_access_key=aws_secret_access_key)
+    store = get_object_store(aws_config, bucket_name, nworkers=nworkers)
 
-    uploaded = []
-    for rpath, realfile in toupload.items():
+    infos = compute_artefacts_info(toupload)
+    sha2info = OrderedDict()
+    for rpath, info in infos.items():
+        copy_to_cache(info.realfile, info.sha256hex, origin='output:%s' % rpath)
+        sha2info.setdefault(info.sha256hex, info)
 
-        sha256hex = compute_sha256hex(realfile)
-        copy_to_cache(realfile, sha256hex)
+    sha2key = OrderedDict((sha256hex, get_object_key_by_value(aws_config, sha256hex)) for sha256hex in sha2info)
+    known = store.exists_many(sha2key.values())
 
-        # path_by_value
-        object_key = os.path.join(aws_path_by_value, 'sha256', sha256hex)
+    to_upload = []
+    for sha256hex, object_key in sha2key.items():
+        if not known[object_key]:
+            to_upload.append(sha2info[sha256hex])
 
-        # object_key = os.path.join(aws_root_path, rpath)
+    uploading = set(info.sha256hex for info in to_upload)
+    for rpath, info in infos.items():
+        status = 'uploading' if info.sha256hex in uploading else 'known'
+        elogger.info('%15s %8s  %s' % (status, friendly_size(info.size), rpath))
 
-        size = os.stat(realfile).st_size
-        mime_type = guess_mime_type(realfile)
+    def upload_one(info):
+        store.upload_file(info.realfile, sha2key[info.sha256hex], info.mime_type)
 
-        aws_object = s3.Object(bucket_name, object_key)
-        try:
-            aws_object.load()
-            # elogger.info('Object %s already exists' % rpath)
-            status = 'known'
-            elogger.info('%15s %8s  %s' % (status, friendly_size(size), rpath))
-
-        except ClientError as e:
-            not_found = e.response['Error']['Code'] == '404'
-            if not_found:
-                status = 'uploading'
-                elogger.info('%15s %8s  %s' % (status, friendly_size(size), rpath))
-                aws_object.upload_file(realfile, ExtraArgs={'ContentType': mime_type})
+    # largest first, so that the long uploads do not end up at the tail
+    to_upload.sort(key=lambda _: -_.size)
+    map_threads(upload_one, to_upload, nworkers)
+    get_metrics().inc('dtc_upload_bytes_total', sum(_.size for _ in to_upload))
 
-            else:
-                raise
-        url = 'http://%s.s3.amazonaws.com/%s' % (bucket_name, object_key)
+    uploaded = []
+    for rpath, info in infos.items():
+        object_key = sha2key[info.sha256hex]
+        url = store.get_url(object_key)
         storage = dict(s3=dict(object_key=object_key, bucket_name=bucket_name, url=url))
-        uploaded.append(dict(size=size, mime_type=mime_type, rpath=rpath, sha256hex=sha256hex, storage=storage))
+        uploaded.append(dict(size=info.size, mime_type=info.mime_type, rpath=rpath, sha256hex=info.sha256hex,
+                             storage=storage))
 
     return uploaded
 
@@ -697,15 +935,6 @@ def object_exists(s3, bucket, key):
     return True
 
 
-def compute_sha256hex(filename):
-    cmd = ['shasum', '-a', '256', filename]
-    res = subprocess.check_output(cmd)
-    tokens = res.split()
-    h = tokens[0]
-    assert len(h) == len('08c1fe03d3a6ef7dbfaccc04613ca561b11b5fd7e9d66b643436eb611dfba348')
-    return h
-
-
 def dtserver_report_job(token, job_id, result, stats, machine_id,
                         process_id, evaluator_version, uploaded):
     endpoint = '/take-submission'
@@ -721,7 +950,8 @@ def dtserver_report_job(token, job_id, result, stats, machine_id,
     return make_server_request(token, endpoint, data=data, method=method)
 
 
-def dtserver_work_submission(token, submission_id, machine_id, process_id, evaluator_version, features, reset):
+def dtserver_work_submission(token, submission_id, machine_id, process_id, evaluator_version, features, reset,
+                             long_poll=None):
     endpoint = '/take-submission'
     method = 'GET'
     data = {'submission_id': submission_id,
@@ -730,7 +960,12 @@ def dtserver_work_submission(token, submission_id, machine_id, process_id, evalu
             'evaluator_version': evaluator_version,
             'features': features,
             'reset': reset}
-    return make_server_request(token, endpoint, data=data, method=method)
+    timeout = DEFAULT_TIMEOUT
+    if long_poll:
+        # servers that do not support long polling answer right away
+        data['wait'] = long_poll
+        timeout += long_poll
+    return make_server_request(token, endpoint, data=data, method=method, timeout=timeout)
 
 
 def create_index_files(wd, job_id):
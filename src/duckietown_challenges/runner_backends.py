@@ -0,0 +1,324 @@
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import yaml
+
+from .utils import indent
+
+elogger = logging.getLogger('evaluator')
+
+# Set from the command line (see dt_challenges_evaluator).
+backend_name = 'compose'
+
+COMPOSE_FILE = 'docker-compose.yaml'
+# how long to wait for the other containers to stop, once one has exited
+STOP_TIMEOUT = 10
+
+LABEL_PROJECT = 'com.docker.compose.project'
+LABEL_SERVICE = 'com.docker.compose.service'
+
+
+class DockerComposeFail(Exception):
+    """ Raised by the backends when the containers cannot be created or run. """
+
+
+_docker_client = None
+_docker_client_lock = threading.Lock()
+
+
+def get_docker_client():
+    """ Returns the Docker client, shared by all the jobs. """
+    global _docker_client
+    with _docker_client_lock:
+        if _docker_client is None:
+            import docker
+            _docker_client = docker.from_env()
+        return _docker_client
+
+
+def pull_image(client, image):
+    """
+        Pulls `image` (a reference by tag or by digest) with the Docker client.
+
+        A reference without a tag means the tag 'latest' (the SDK would pull all the tags).
+        Raises docker.errors.APIError.
+    """
+    from docker.utils import parse_repository_tag
+    if '@' in image:
+        client.images.pull(image)
+    else:
+        repository, tag = parse_repository_tag(image)
+        client.images.pull(repository, tag=tag or 'latest')
+
+
+def run_docker(cwd, project, cmd0, get_output=False):
+    cmd0 = ['docker-compose', '-p', project] + cmd0
+    elogger.info('Running:\n\t%s' % " ".join(cmd0) + '\n\n in %s' % cwd)
+
+    try:
+        if get_output:
+            return subprocess.check_output(cmd0, cwd=cwd, stderr=sys.stderr)
+        else:
+            subprocess.check_call(cmd0, cwd=cwd, stdout=sys.stdout, stderr=sys.stderr)
+    except subprocess.CalledProcessError as e:
+        msg = 'Could not run %s:\n\n %s' % (cmd0, indent(e, '  >  '))
+        msg += '\n\n%s' % indent(e.output, ' docker-compose stdout  | ')
+        # msg += '\n\n%s' % indent(e., ' docker-compose stderr  | ')
+        raise DockerComposeFail(msg)
+
+
+class Backend(object):
+    """
+        Runs the containers described by the Docker Compose configuration
+        written in `wd` (see get_config()), as project `project`.
+
+        All methods raise DockerComposeFail if something goes wrong.
+    """
+
+    def validate(self, wd, project):
+        raise NotImplementedError()
+
+    def pull(self, wd, project):
+        raise NotImplementedError()
+
+    def up(self, wd, project):
+        """ Runs the containers; when one exits, the others are stopped. """
+        raise NotImplementedError()
+
+    def get_container_id(self, wd, project, service):
+        """ Returns the ID of the container of the service, or None if it was not created. """
+        raise NotImplementedError()
+
+    def down(self, wd, project):
+        """ Removes the containers and the networks. """
+        raise NotImplementedError()
+
+
+class ComposeBackend(Backend):
+    """ Uses the docker-compose executable. """
+
+    def validate(self, wd, project):
+        run_docker(wd, project, ['config'])
+
+    def pull(self, wd, project):
+        run_docker(wd, project, ['pull'])
+
+    def up(self, wd, project):
+        cmd = ['up',
+               # '--remove-orphans',
+               '--abort-on-container-exit'
+               ]
+        run_docker(wd, project, cmd)
+
+    def get_container_id(self, wd, project, service):
+        o = run_docker(wd, project, ['ps', '-q', service], get_output=True)
+        return o.strip() or None  # \n at the end
+
+    def down(self, wd, project):
+        run_docker(wd, project, ['down'])
+
+
+class DockerSDKBackend(Backend):
+    """
+        Runs the configuration directly with the Docker API, using a single
+        long-lived client, instead of starting a docker-compose process for each command.
+
+        Only the subset of the Compose format produced by get_config() is supported.
+        The containers are labeled like docker-compose does.
+    """
+
+    SUPPORTED = {'image', 'environment', 'volumes', 'networks'}
+
+    def __init__(self, client=None):
+        self.client = client
+
+    def get_client(self):
+        if self.client is None:
+            self.client = get_docker_client()
+        return self.client
+
+    def read_config(self, wd):
+        fn = os.path.join(wd, COMPOSE_FILE)
+        with open(fn) as f:
+            return yaml.safe_load(f)
+
+    def validate(self, wd, project):
+        config = self.read_config(wd)
+        services = config.get('services')
+        if not isinstance(services, dict) or not services:
+            msg = 'No services defined in %s' % COMPOSE_FILE
+            raise DockerComposeFail(msg)
+        for name, service in services.items():
+            if 'image' not in service:
+                msg = 'Service %r does not have an image.' % name
+                raise DockerComposeFail(msg)
+            extra = set(service) - self.SUPPORTED
+            if extra:
+                msg = 'Service %r uses features not supported by this backend: %s' % (name, sorted(extra))
+                raise DockerComposeFail(msg)
+        networks = config.get('networks') or {}
+        for name, service in services.items():
+            for network in service.get('networks') or {}:
+                if network not in networks:
+                    msg = 'Service %r uses undefined network %r' % (name, network)
+                    raise DockerComposeFail(msg)
+
+    def pull(self, wd, project):
+        from docker.errors import APIError
+        config = self.read_config(wd)
+        images = sorted(set(_['image'] for _ in config['services'].values()))
+        client = self.get_client()
+        for image in images:
+            elogger.info('Pulling %s' % image)
+            try:
+                pull_image(client, image)
+            except APIError as e:
+                msg = 'Could not pull %s: %s' % (image, e)
+                raise DockerComposeFail(msg)
+
+    def _network_name(self, project, network):
+        return '%s_%s' % (project, network)
+
+    def _create(self, wd, project, config):
+        """ Creates the networks and the containers; returns the list of (service, container id). """
+        from docker.errors import ImageNotFound
+        api = self.get_client().api
+        labels = {LABEL_PROJECT: project}
+        for network in config.get('networks') or {}:
+            api.create_network(self._network_name(project, network), driver='bridge', labels=labels)
+
+        created = []
+        for service, sdef in config['services'].items():
+            binds = []
+            volumes = []
+            for v in sdef.get('volumes') or []:
+                host, container = v.split(':', 1)
+                host = os.path.normpath(os.path.join(wd, host))
+                binds.append('%s:%s' % (host, container))
+                volumes.append(container.split(':')[0])
+
+            # network name -> aliases
+            aliases = {}
+            for network, options in (sdef.get('networks') or {}).items():
+                name = self._network_name(project, network)
+                aliases[name] = [service] + list((options or {}).get('aliases', []))
+            networks = sorted(aliases)
+
+            # Docker can only connect a container to one network at creation
+            first = networks[:1]
+            networking_config = api.create_networking_config(
+                dict((k, api.create_endpoint_config(aliases=aliases[k])) for k in first))
+            host_config = api.create_host_config(binds=binds, network_mode=first[0] if first else None)
+            service_labels = dict(labels)
+            service_labels[LABEL_SERVICE] = service
+            # the strings are kept as they are (str() fails on non-ASCII unicode in Python 2)
+            environment = dict((k, v if isinstance(v, (str, type(u''))) else str(v))
+                               for k, v in (sdef.get('environment') or {}).items())
+            kwargs = dict(name='%s_%s_1' % (project, service), environment=environment, volumes=volumes,
+                          labels=service_labels, host_config=host_config, networking_config=networking_config,
+                          detach=True)
+            try:
+                res = api.create_container(sdef['image'], **kwargs)
+            except ImageNotFound:
+                # like docker-compose up, pull the missing images
+                elogger.info('Pulling %s' % sdef['image'])
+                pull_image(self.get_client(), sdef['image'])
+                res = api.create_container(sdef['image'], **kwargs)
+            container_id = res['Id']
+            for network in networks[1:]:
+                api.connect_container_to_network(container_id, network, aliases=aliases[network])
+            created.append((service, container_id))
+        return created
+
+    def up(self, wd, project):
+        from docker.errors import APIError, ImageNotFound
+        config = self.read_config(wd)
+        api = self.get_client().api
+        try:
+            created = self._create(wd, project, config)
+        except (APIError, ImageNotFound) as e:
+            msg = 'Could not create the containers: %s' % e
+            # remove what was created so far
+            try:
+                self.down(wd, project)
+            except DockerComposeFail as e2:
+                msg += '\n%s' % e2
+            raise DockerComposeFail(msg)
+
+        # subscribe before starting, so that we do not miss an early exit
+        since = int(time.time()) - 1
+        filters = {'type': 'container', 'event': 'die', 'label': '%s=%s' % (LABEL_PROJECT, project)}
+        events = api.events(since=since, filters=filters, decode=True)
+        try:
+            for service, container_id in created:
+                elogger.info('Starting %s' % service)
+                try:
+                    api.start(container_id)
+                except APIError as e:
+                    msg = 'Could not start %s: %s' % (service, e)
+                    raise DockerComposeFail(msg)
+
+            ids = set(_[1] for _ in created)
+            for event in events:
+                if event.get('id') in ids:
+                    break
+        finally:
+            events.close()
+
+        # --abort-on-container-exit: one exited, stop the others
+        for service, container_id in created:
+            info = api.inspect_container(container_id)
+            state = info['State']
+            if state['Running']:
+                elogger.info('Stopping %s' % service)
+                api.stop(container_id, timeout=STOP_TIMEOUT)
+            else:
+                elogger.info('%s exited with code %s' % (service, state['ExitCode']))
+
+    def _containers(self, project, service=None):
+        filters = {'label': ['%s=%s' % (LABEL_PROJECT, project)]}
+        if service is not None:
+            filters['label'].append('%s=%s' % (LABEL_SERVICE, service))
+        return self.get_client().api.containers(all=True, quiet=True, filters=filters)
+
+    def get_container_id(self, wd, project, service):
+        containers = self._containers(project, service)
+        return containers[0]['Id'] if containers else None
+
+    def down(self, wd, project):
+        from docker.errors import APIError
+        api = self.get_client().api
+        try:
+            for c in self._containers(project):
+                api.remove_container(c['Id'], force=True)
+            for n in api.networks(filters={'label': '%s=%s' % (LABEL_PROJECT, project)}):
+                api.remove_network(n['Id'])
+        except APIError as e:
+            msg = 'Could not clean up project %s: %s' % (project, e)
+            raise DockerComposeFail(msg)
+
+
+BACKENDS = {
+    'compose': ComposeBackend,
+    'docker': DockerSDKBackend,
+}
+
+_backends = {}
+
+
+def get_backend(name=None):
+    """ Returns the backend (shared) with the given name, by default the one chosen on the command line. """
+    if name is None:
+        name = backend_name
+    if name not in _backends:
+        _backends[name] = BACKENDS[name]()
+    return _backends[name]
+
+
+def set_backend(name, backend):
+    """ Uses the Backend instance `backend` for `name` (for example, a stub for benchmarks). """
+    _backends[name] = backend
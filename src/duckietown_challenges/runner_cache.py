@@ -1,8 +1,13 @@
+import argparse
 import os
-import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
 
 from . import dclogger
-# cache_max_size_gb = 3
+from .file_transfer import reflink, fast_copy
 from .utils import friendly_size
 
 cache_dir = '/tmp/duckietown/DT18/evaluator/cache'
@@ -10,31 +15,323 @@ cache_dir_by_value = os.path.join(cache_dir, 'by-value', 'sha256hex')
 
 disable_cache = False
 
+# Maximum size of the cache in bytes (None = unbounded).
+cache_max_size_bytes = None
+# Which entries to evict first: 'lru' (least recently used) or 'lfu' (least frequently used).
+cache_eviction_policy = 'lru'
+EVICTION_POLICIES = ['lru', 'lfu']
 
-def get_file_from_cache(fn, sha256hex):
+
+def get_file_from_cache(fn, sha256hex, job_stats=None):
+    """
+        Materializes the cache entry for `sha256hex` as `fn`.
+
+        Raises KeyError if the entry is not in the cache. If `job_stats` (a JobCacheStats)
+        is given, the hit or miss is accounted there as well.
+    """
     if disable_cache:
         dclogger.warning('Forcing cache disabled.')
         msg = 'cache disabled'
         raise KeyError(msg)
-    if not os.path.exists(cache_dir_by_value):
-        os.makedirs(cache_dir_by_value)
+    make_cache_dir()
+    index = get_cache_index()
     have = os.path.join(cache_dir_by_value, sha256hex)
     if os.path.exists(have):
-        shutil.copy(have, fn)
+        materialize(have, fn)
+        size = os.stat(have).st_size
+        index.record_hit(sha256hex, size)
+        if job_stats is not None:
+            job_stats.record_hit(size)
     else:
+        index.record_miss(sha256hex)
+        if job_stats is not None:
+            job_stats.record_miss()
         msg = 'Hash not in cache'
         raise KeyError(msg)
 
 
-def copy_to_cache(fn, sha256hex):
+def make_cache_dir():
+    try:
+        os.makedirs(cache_dir_by_value)
+    except OSError:
+        # created concurrently
+        if not os.path.isdir(cache_dir_by_value):
+            raise
+
+
+def copy_to_cache(fn, sha256hex, origin=None):
+    """ Adds the file to the cache; `origin` is a free-form description recorded in the index. """
     if disable_cache:
         dclogger.warning('Forcing cache disabled.')
         return
 
-    if not os.path.exists(cache_dir_by_value):
-        os.makedirs(cache_dir_by_value)
+    make_cache_dir()
     have = os.path.join(cache_dir_by_value, sha256hex)
     if not os.path.exists(have):
-        msg = 'Copying %s to cache %s' % (friendly_size(os.stat(fn).st_size), have)
+        # materialize under a temporary name, so that concurrent readers never see partial files;
+        # the name is unique, as other threads and processes might be adding the same file
+        fd, tmp = tempfile.mkstemp(dir=cache_dir_by_value, prefix=sha256hex + '.tmp-')
+        os.close(fd)
+        try:
+            method = materialize(fn, tmp)
+            # tmp is a new inode, not shared with `fn`
+            os.chmod(tmp, 0o444)
+            os.rename(tmp, have)
+        except OSError as e:
+            if os.path.lexists(tmp):
+                os.unlink(tmp)
+            if os.path.exists(have):
+                msg = 'Entry %s added concurrently (%s)' % (sha256hex, e)
+                dclogger.debug(msg)
+                return
+            raise
+        size = os.stat(have).st_size
+        msg = 'Cached %s at %s (%s)' % (friendly_size(size), have, method)
         dclogger.debug(msg)
-        shutil.copy(fn, have)
+        index = get_cache_index()
+        index.record_added(sha256hex, size, origin)
+        if cache_max_size_bytes is not None:
+            evict(cache_max_size_bytes, policy=cache_eviction_policy, protect=[sha256hex])
+
+
+def materialize(src, dst):
+    """
+        Makes `dst` a file with the same contents as `src`, avoiding copying data if possible.
+
+        Tries a copy-on-write clone (reflink), then a copy (see fast_copy()).
+        Hardlinks are not used: the files going in and out of the cache are in the
+        directories mounted in the containers, which often run as root, and could
+        modify the entry through a shared inode.
+
+        `dst` has the default permissions, whatever those of `src` (the cache entries are read-only).
+
+        Returns the method used: 'reflink', or the method returned by fast_copy().
+    """
+    if os.path.lexists(dst):
+        os.unlink(dst)
+
+    if reflink(src, dst):
+        return 'reflink'
+
+    return fast_copy(src, dst, copy_mode=False)
+
+
+class CacheIndex(object):
+    """
+        On-disk index of the cache entries, so that we do not need to stat the
+        whole cache directory to know its size and what to evict.
+
+        It is shared by the threads of this process (and by other processes on
+        the same host) through SQLite's locking.
+    """
+
+    def __init__(self, fn, dirname):
+        self.fn = fn
+        self.dirname = dirname
+        self.lock = threading.Lock()
+        create = not os.path.exists(fn)
+        self.conn = sqlite3.connect(fn, timeout=60, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS entries ('
+                              'sha256hex TEXT PRIMARY KEY, size INTEGER, last_access REAL, hits INTEGER, '
+                              'origin TEXT)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER)')
+            columns = [_[1] for _ in self.conn.execute('PRAGMA table_info(entries)').fetchall()]
+            if 'origin' not in columns:
+                # index created by a previous version
+                self.conn.execute('ALTER TABLE entries ADD COLUMN origin TEXT')
+        if create:
+            self.rebuild()
+
+    def rebuild(self):
+        """ Re-creates the list of entries by looking at the files in the directory. """
+        dirname = self.dirname
+        if not os.path.exists(dirname):
+            return
+        rows = []
+        for sha256hex in os.listdir(dirname):
+            if '.tmp-' in sha256hex:
+                continue
+            st = os.stat(os.path.join(dirname, sha256hex))
+            rows.append((sha256hex, st.st_size, st.st_atime, 0, None))
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM entries')
+            self.conn.executemany('INSERT INTO entries VALUES (?, ?, ?, ?, ?)', rows)
+        dclogger.info('Indexed %d cache entries in %s' % (len(rows), dirname))
+
+    def _increment(self, name, value):
+        self.conn.execute('INSERT OR IGNORE INTO counters VALUES (?, 0)', (name,))
+        self.conn.execute('UPDATE counters SET value = value + ? WHERE name = ?', (value, name))
+
+    def record_added(self, sha256hex, size, origin=None):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, 0, ?)',
+                              (sha256hex, size, time.time(), origin))
+
+    def record_hit(self, sha256hex, size):
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR IGNORE INTO entries VALUES (?, ?, 0, 0, NULL)', (sha256hex, size))
+            self.conn.execute('UPDATE entries SET last_access = ?, hits = hits + 1 WHERE sha256hex = ?',
+                              (time.time(), sha256hex))
+            self._increment('hits', 1)
+            self._increment('bytes_saved', size)
+
+    def record_miss(self, sha256hex):
+        with self.lock, self.conn:
+            # the file might have been removed by hand
+            self.conn.execute('DELETE FROM entries WHERE sha256hex = ?', (sha256hex,))
+            self._increment('misses', 1)
+
+    def record_removed(self, sha256hex):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM entries WHERE sha256hex = ?', (sha256hex,))
+            self._increment('evictions', 1)
+
+    def get_total_size(self):
+        with self.lock:
+            size, = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()
+        return size
+
+    def get_eviction_order(self, policy):
+        """ Returns the list of (sha256hex, size), in the order in which they should be evicted. """
+        if policy == 'lru':
+            order = 'last_access ASC'
+        elif policy == 'lfu':
+            order = 'hits ASC, last_access ASC'
+        else:
+            msg = 'Invalid eviction policy %r; use one of %s.' % (policy, EVICTION_POLICIES)
+            raise ValueError(msg)
+        with self.lock:
+            return self.conn.execute('SELECT sha256hex, size FROM entries ORDER BY ' + order).fetchall()
+
+    def get_entry(self, sha256hex):
+        """ Returns a dict with size, last_access, hits, origin; or None if not indexed. """
+        with self.lock:
+            row = self.conn.execute('SELECT size, last_access, hits, origin FROM entries WHERE sha256hex = ?',
+                                    (sha256hex,)).fetchone()
+        if row is None:
+            return None
+        size, last_access, hits, origin = row
+        return dict(size=size, last_access=last_access, hits=hits, origin=origin)
+
+    def get_stats(self):
+        with self.lock:
+            counters = dict(self.conn.execute('SELECT name, value FROM counters').fetchall())
+            nentries, size = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        stats = {}
+        stats['entries'] = nentries
+        stats['size'] = size
+        for k in ['hits', 'misses', 'bytes_saved', 'evictions']:
+            stats[k] = counters.get(k, 0)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = float(stats['hits']) / lookups if lookups else None
+        return stats
+
+
+class JobCacheStats(object):
+    """ Accounting of the cache usage by a single job; reported to the server with the job stats. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bytes_local = 0
+        self.bytes_downloaded = 0
+
+    def record_hit(self, size):
+        with self.lock:
+            self.hits += 1
+            self.bytes_local += size
+
+    def record_miss(self):
+        with self.lock:
+            self.misses += 1
+
+    def record_download(self, size):
+        with self.lock:
+            self.bytes_downloaded += size
+
+    def as_dict(self):
+        with self.lock:
+            return OrderedDict([('hits', self.hits),
+                                ('misses', self.misses),
+                                ('bytes_local', self.bytes_local),
+                                ('bytes_downloaded', self.bytes_downloaded)])
+
+
+_indices = {}
+_indices_lock = threading.Lock()
+
+
+def get_cache_index():
+    """ Returns the index for the current value of `cache_dir_by_value`. """
+    with _indices_lock:
+        if cache_dir_by_value not in _indices:
+            dn = os.path.dirname(cache_dir_by_value)
+            if not os.path.exists(dn):
+                os.makedirs(dn)
+            fn = os.path.join(dn, os.path.basename(cache_dir_by_value) + '-index.sqlite')
+            _indices[cache_dir_by_value] = CacheIndex(fn, cache_dir_by_value)
+        return _indices[cache_dir_by_value]
+
+
+def evict(max_size_bytes, policy='lru', protect=()):
+    """
+        Removes entries from the cache until its size is below `max_size_bytes`.
+
+        The entries in `protect` are never removed.
+
+        Returns the number of bytes freed.
+    """
+    index = get_cache_index()
+    total = index.get_total_size()
+    freed = 0
+    if total <= max_size_bytes:
+        return freed
+    for sha256hex, size in index.get_eviction_order(policy):
+        if total - freed <= max_size_bytes:
+            break
+        if sha256hex in protect:
+            continue
+        have = os.path.join(cache_dir_by_value, sha256hex)
+        try:
+            os.unlink(have)
+        except OSError as e:
+            if os.path.exists(have):
+                dclogger.error('Could not evict %s: %s' % (have, e))
+                continue
+        index.record_removed(sha256hex)
+        freed += size
+    dclogger.info('Evicted %s from the cache (%s policy); now %s.' %
+                  (friendly_size(freed), policy, friendly_size(total - freed)))
+    return freed
+
+
+def cache_main(args=None):
+    parser = argparse.ArgumentParser(prog='dt-challenges-cache',
+                                     description='Inspect and maintain the evaluator artefacts cache.')
+    parser.add_argument('command', nargs='?', default='stats', choices=['stats', 'evict', 'reindex'])
+    parser.add_argument('--max-size-gb', dest='max_size_gb', type=float, default=None,
+                        help='Size budget for the "evict" command')
+    parser.add_argument('--policy', default='lru', choices=EVICTION_POLICIES)
+    parsed = parser.parse_args(args)
+
+    index = get_cache_index()
+    if parsed.command == 'reindex':
+        index.rebuild()
+    elif parsed.command == 'evict':
+        if parsed.max_size_gb is None:
+            msg = 'Please specify the budget using --max-size-gb.'
+            raise Exception(msg)
+        evict(int(parsed.max_size_gb * 1024 * 1024 * 1024), policy=parsed.policy)
+
+    stats = index.get_stats()
+    print('cache:        %s' % cache_dir_by_value)
+    print('entries:      %d' % stats['entries'])
+    print('occupancy:    %s' % friendly_size(stats['size']))
+    print('hits:         %d' % stats['hits'])
+    print('misses:       %d' % stats['misses'])
+    if stats['hit_rate'] is not None:
+        print('hit rate:     %.1f%%' % (100 * stats['hit_rate']))
+    print('bytes saved:  %s' % friendly_size(stats['bytes_saved']))
+    print('evictions:    %d' % stats['evictions'])
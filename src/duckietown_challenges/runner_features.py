@@ -0,0 +1,115 @@
+import atexit
+import os
+import platform
+import sys
+import threading
+
+# How often the dynamic features are sampled (also the CPU usage averaging window).
+FEATURES_REFRESH_INTERVAL = 5.0
+
+
+def get_static_features():
+    """ The features of the host that do not change while we run. """
+    import psutil
+    features = {}
+
+    machine = platform.machine()
+    features['linux'] = sys.platform.startswith('linux')
+    features['mac'] = sys.platform.startswith('darwin')
+    features['x86_64'] = (machine == 'x86_64')
+    features['armv7l'] = (machine == 'armv7l')
+    meminfo = psutil.virtual_memory()
+    # svmem(total=16717422592, available=5376126976, percent=67.8, used=10359984128, free=1831890944, active=7191916544, inactive=2325667840, buffers=525037568, cached=4000509952, shared=626225152)
+
+    features['ram_total_mb'] = int(meminfo.total / (1024 * 1024.0))
+    features['nprocessors'] = psutil.cpu_count()
+    cpu_freq = psutil.cpu_freq()
+    if cpu_freq is not None:
+        # None on Docker
+        features['processor_frequency_mhz'] = int(cpu_freq.max)
+    features['p1'] = True
+
+    features['picamera'] = False
+    features['nduckiebots'] = False
+    features['map_3x3'] = False
+
+    features['gpu'] = os.path.exists('/proc/driver/nvidia/version')
+    return features
+
+
+def get_dynamic_features(path, cpu_interval):
+    """ The features that change: free CPU (measured over `cpu_interval` seconds), RAM and disk. """
+    import psutil
+    features = {}
+    f = psutil.cpu_percent(interval=cpu_interval)
+    features['processor_free_percent'] = int(100.0 - f)
+
+    meminfo = psutil.virtual_memory()
+    features['ram_available_mb'] = int(meminfo.available / (1024 * 1024.0))
+
+    disk = psutil.disk_usage(path)
+    features['disk_total_mb'] = disk.total / (1024 * 1024)
+    features['disk_available_mb'] = disk.free / (1024 * 1024)
+    return features
+
+
+class FeatureProvider(object):
+    """
+        Provides the features of the host without blocking.
+
+        The static features are computed once; the dynamic ones are sampled
+        by a background thread every `refresh_interval` seconds, and
+        get_features() returns the last sample.
+    """
+
+    def __init__(self, path=None, refresh_interval=FEATURES_REFRESH_INTERVAL):
+        self.path = path or os.getcwd()
+        self.refresh_interval = refresh_interval
+        self.static = get_static_features()
+        # the first sample is taken right away (this is the only time we block)
+        self.dynamic = get_dynamic_features(self.path, cpu_interval=0.2)
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._refresh_loop, name='features')
+        self.thread.daemon = True
+        self.thread.start()
+        # otherwise the thread might wake up while the interpreter is shutting down
+        atexit.register(self.stop)
+
+    def stop(self):
+        self.stopped.set()
+
+    def _refresh_loop(self):
+        from . import dclogger
+        while not self.stopped.is_set():
+            try:
+                # blocks for refresh_interval, measuring the CPU usage in the meantime
+                dynamic = get_dynamic_features(self.path, cpu_interval=self.refresh_interval)
+            except BaseException as e:
+                if self.stopped.is_set():
+                    return
+                dclogger.warning('Could not sample the features: %s' % e)
+                self.stopped.wait(self.refresh_interval)
+                continue
+            with self.lock:
+                self.dynamic = dynamic
+
+    def get_features(self):
+        """ Returns a new dict with the current features. """
+        features = dict(self.static)
+        with self.lock:
+            features.update(self.dynamic)
+        return features
+
+
+_feature_provider = None
+_feature_provider_lock = threading.Lock()
+
+
+def get_feature_provider():
+    """ Returns the FeatureProvider shared by all the jobs. """
+    global _feature_provider
+    with _feature_provider_lock:
+        if _feature_provider is None:
+            _feature_provider = FeatureProvider()
+        return _feature_provider
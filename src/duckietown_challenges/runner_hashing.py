@@ -0,0 +1,63 @@
+import hashlib
+import mimetypes
+import os
+from collections import OrderedDict, namedtuple
+
+from .utils import map_threads
+
+# Files are streamed through hashlib in chunks of this size.
+HASH_CHUNK_SIZE = 1024 * 1024
+# hashlib releases the GIL while hashing large buffers, so threads give real parallelism.
+DEFAULT_HASH_THREADS = 8
+
+ArtefactInfo = namedtuple('ArtefactInfo', 'rpath realfile size mime_type sha256hex')
+
+
+def compute_sha256hex(filename, chunk_size=HASH_CHUNK_SIZE):
+    """ Returns the hex SHA-256 digest of the file, computed in-process. """
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def guess_mime_type(filename):
+    mime_type, _encoding = mimetypes.guess_type(filename)
+
+    if mime_type is None:
+        if filename.endswith('.yaml'):
+            mime_type = 'text/yaml'
+        else:
+            mime_type = 'binary/octet-stream'
+    return mime_type
+
+
+def get_artefact_info(rpath, realfile):
+    """ Computes size, mime type and digest of one file in one pass. """
+    size = os.stat(realfile).st_size
+    mime_type = guess_mime_type(realfile)
+    sha256hex = compute_sha256hex(realfile)
+    return ArtefactInfo(rpath=rpath, realfile=realfile, size=size, mime_type=mime_type, sha256hex=sha256hex)
+
+
+def _get_artefact_info_star(args):
+    return get_artefact_info(*args)
+
+
+def compute_artefacts_info(toupload, nthreads=DEFAULT_HASH_THREADS):
+    """
+        Hashes the files concurrently.
+
+        :param toupload: dict rpath -> real filename
+        :return: OrderedDict rpath -> ArtefactInfo, in the same order as `toupload`.
+    """
+    infos = map_threads(_get_artefact_info_star, list(toupload.items()), nthreads)
+
+    res = OrderedDict()
+    for info in infos:
+        res[info.rpath] = info
+    return res
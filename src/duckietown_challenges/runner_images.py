@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from .runner_backends import pull_image
+from .utils import map_threads
+
+elogger = logging.getLogger('evaluator')
+
+DEFAULT_PULL_WORKERS = 4
+# how many of the challenges recently evaluated are pre-warmed
+MAX_RECENT_CHALLENGES = 10
+# minimum time between two pre-warms
+PREWARM_INTERVAL = 15 * 60
+
+# An image needed by a job: `digest` is ServiceDefinition.image_digest (None if unknown).
+RequiredImage = namedtuple('RequiredImage', 'image digest')
+
+
+class CouldNotPull(Exception):
+    pass
+
+
+def get_required_images(challenge_parameters):
+    """ Returns the list of RequiredImage for an EvaluationParameters. """
+    res = []
+    for service in challenge_parameters.services.values():
+        r = RequiredImage(image=service.image, digest=service.image_digest)
+        if r not in res:
+            res.append(r)
+    return res
+
+
+class ImageManager(object):
+    """
+        Makes sure that the images needed by the jobs are present locally.
+
+        An image is pulled only if we cannot prove that the local copy is the
+        right one: that is, if its digest is unknown, or not present locally.
+        Missing images are pulled concurrently.
+
+        It also remembers the images of the challenges recently evaluated,
+        so that they can be refreshed in the background between jobs (prewarm()).
+    """
+
+    def __init__(self, client, nworkers=DEFAULT_PULL_WORKERS):
+        self.client = client
+        self.nworkers = nworkers
+        self.lock = threading.Lock()
+        # challenge name -> list of RequiredImage; most recent last
+        self.recent = OrderedDict()
+        self.prewarm_thread = None
+        self.last_prewarm = 0
+
+    def is_present(self, required):
+        """ True if the image is present locally, with the required digest. """
+        from docker.errors import ImageNotFound, APIError
+        if required.digest is None and '@' not in required.image:
+            # a tag can have moved in the registry
+            return False
+        try:
+            image = self.client.images.get(required.image)
+        except (ImageNotFound, APIError):
+            return False
+        if required.digest is None:
+            # the image was referenced by digest
+            return True
+        repo_digests = [_.split('@', 1)[-1] for _ in image.attrs.get('RepoDigests') or []]
+        return required.digest == image.id or required.digest in repo_digests
+
+    def pull(self, image):
+        from docker.errors import APIError
+        t0 = time.time()
+        try:
+            pull_image(self.client, image)
+        except APIError as e:
+            msg = 'Could not pull %s: %s' % (image, e)
+            raise CouldNotPull(msg)
+        elogger.info('Pulled %s in %.1f s' % (image, time.time() - t0))
+
+    def ensure(self, required_images):
+        """
+            Pulls the images that are not present locally (concurrently).
+
+            Returns the list of the images that were pulled; raises CouldNotPull.
+        """
+        present = map_threads(self.is_present, required_images, self.nworkers)
+        to_pull = []
+        for required, is_present in zip(required_images, present):
+            if is_present:
+                elogger.info('Image %s already present (%s)' % (required.image, required.digest))
+            elif required.image not in to_pull:
+                to_pull.append(required.image)
+
+        map_threads(self.pull, to_pull, self.nworkers)
+        return to_pull
+
+    def remember(self, challenge_name, required_images):
+        """ Records the images used by a challenge, to be pre-warmed. """
+        with self.lock:
+            self.recent.pop(challenge_name, None)
+            self.recent[challenge_name] = list(required_images)
+            while len(self.recent) > MAX_RECENT_CHALLENGES:
+                self.recent.popitem(last=False)
+
+    def prewarm(self):
+        """
+            In a background thread, pulls the images of the challenges recently evaluated,
+            most recent first. Does nothing if a prewarm is already running, or if the
+            last one was less than PREWARM_INTERVAL seconds ago.
+        """
+        with self.lock:
+            if self.prewarm_thread is not None and self.prewarm_thread.is_alive():
+                return
+            if time.time() - self.last_prewarm < PREWARM_INTERVAL:
+                return
+            images = []
+            for required_images in reversed(list(self.recent.values())):
+                for r in required_images:
+                    if r not in images:
+                        images.append(r)
+            if not images:
+                return
+            self.last_prewarm = time.time()
+            self.prewarm_thread = threading.Thread(target=self._prewarm, args=(images,), name='prewarm')
+            self.prewarm_thread.daemon = True
+            self.prewarm_thread.start()
+
+    def _prewarm(self, images):
+        try:
+            pulled = self.ensure(images)
+            if pulled:
+                elogger.info('Pre-warmed %d images.' % len(pulled))
+        except BaseException as e:
+            elogger.warning('Could not pre-warm images: %s' % e)
+
+
+_image_manager = None
+_image_manager_lock = threading.Lock()
+
+
+def get_image_manager():
+    """ Returns the ImageManager shared by all the jobs. """
+    global _image_manager
+    with _image_manager_lock:
+        if _image_manager is None:
+            from .runner_backends import get_docker_client
+            _image_manager = ImageManager(get_docker_client())
+        return _image_manager
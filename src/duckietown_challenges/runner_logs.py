@@ -0,0 +1,232 @@
+import gzip
+import os
+import threading
+import time
+import traceback
+from collections import deque
+
+from . import dclogger
+
+# Set from the command line (see dt_challenges_evaluator).
+# Bytes written to each log file before the rest is dropped (None = unlimited).
+log_max_size_bytes = 100 * 1024 * 1024
+# Whether to gzip the logs.
+compress_logs = False
+
+# How much of the end of the log is kept in memory.
+DEFAULT_TAIL_BYTES = 64 * 1024
+# How much of it is shown when the evaluation fails.
+LOG_TAIL_SHOWN = 4096
+
+
+class LogSink(object):
+    """
+        Writes a log that arrives in chunks directly to a file,
+        without keeping it in memory.
+
+        After `max_bytes` have been written, the rest is dropped except for the
+        last `tail_bytes`, which are always kept in memory (for error messages)
+        and are appended to the file by close().
+
+        If `compress` is True, the file is gzipped.
+    """
+
+    def __init__(self, fn, max_bytes=None, compress=False, tail_bytes=DEFAULT_TAIL_BYTES):
+        self.fn = fn
+        self.max_bytes = max_bytes
+        self.tail_bytes = tail_bytes
+        if compress:
+            self.f = gzip.open(fn, 'wb')
+        else:
+            self.f = open(fn, 'wb')
+        self.written = 0
+        self.total = 0
+        self.truncated = False
+        self.tail = deque()
+        self.tail_size = 0
+
+    def write(self, chunk):
+        self.total += len(chunk)
+        if not self.truncated and self.max_bytes is not None and self.written + len(chunk) > self.max_bytes:
+            self.truncated = True
+        if not self.truncated:
+            self.f.write(chunk)
+            self.written += len(chunk)
+        self._add_to_tail(chunk)
+
+    def _add_to_tail(self, chunk):
+        self.tail.append(chunk)
+        self.tail_size += len(chunk)
+        while self.tail_size - len(self.tail[0]) >= self.tail_bytes:
+            self.tail_size -= len(self.tail.popleft())
+
+    def get_tail(self, nbytes=None):
+        """ Returns (at most) the last `nbytes` of the log. """
+        if nbytes is None:
+            nbytes = self.tail_bytes
+        if nbytes <= 0:
+            return b''
+        return b''.join(self.tail)[-nbytes:]
+
+    def close(self):
+        if self.truncated:
+            # what was not written, and which we still have
+            tail = self.get_tail(min(self.tail_bytes, self.total - self.written))
+            skipped = self.total - self.written - len(tail)
+            self.f.write(b'\n\n[... %d bytes skipped: the log was longer than %d bytes ...]\n\n' %
+                         (skipped, self.max_bytes))
+            self.f.write(tail)
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+# Logs longer than this are rendered to HTML only in part (the beginning and the end).
+html_max_bytes = 4 * 1024 * 1024
+# Size of the pieces given to the converter.
+HTML_CHUNK_BYTES = 256 * 1024
+
+HTML_HEADER = """<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01 Transitional//EN" "http://www.w3.org/TR/html4/loose.dtd">
+<html>
+<head>
+<meta http-equiv="Content-Type" content="text/html; charset=utf-8">
+<title>%(title)s</title>
+%(headers)s</head>
+<body class="body_foreground body_background" style="font-size: normal;" >
+<pre class="ansi2html-content">
+"""
+HTML_FOOTER = """</pre>
+</body>
+</html>
+"""
+
+
+def open_log(fn):
+    if fn.endswith('.gz'):
+        return gzip.open(fn, 'rb')
+    return open(fn, 'rb')
+
+
+def read_pieces(f, block_size=HTML_CHUNK_BYTES):
+    """
+        Reads `f` in blocks of `block_size` bytes, and yields pieces that end at a newline,
+        except for lines longer than `block_size`, which are split.
+        At most 2 * `block_size` bytes are in memory.
+    """
+    rest = b''
+    while True:
+        block = f.read(block_size)
+        if not block:
+            if rest:
+                yield rest
+            return
+        data = rest + block
+        i = data.rfind(b'\n')
+        if i >= 0:
+            yield data[:i + 1]
+            rest = data[i + 1:]
+        elif len(data) >= block_size:
+            yield data
+            rest = b''
+        else:
+            rest = data
+
+
+def render_log_html(fn, fn_html, max_bytes=None):
+    """
+        Converts the log `fn` (with ANSI escapes, possibly gzipped) to HTML,
+        block by block, so that the whole log (or a whole line) is never in memory.
+
+        If the log is longer than `max_bytes`, only the first and the last
+        `max_bytes/2` are rendered.
+    """
+    from ansi2html import Ansi2HTMLConverter
+    if max_bytes is None:
+        max_bytes = html_max_bytes
+    half = max_bytes // 2
+    conv = Ansi2HTMLConverter()
+
+    def convert(data):
+        return conv.convert(data.decode('utf-8', 'replace'), full=False).encode('utf-8')
+
+    tail = deque()
+    tail_size = 0
+    skipped = 0
+    rendered = 0
+    in_head = True
+    with open_log(fn) as f, open(fn_html, 'wb') as out:
+        out.write(HTML_HEADER % dict(title=os.path.basename(fn), headers=conv.produce_headers()))
+        for piece in read_pieces(f):
+            if in_head:
+                if rendered + len(piece) <= half:
+                    out.write(convert(piece))
+                    rendered += len(piece)
+                    continue
+                in_head = False
+                # the head ends at the last complete line that fits
+                n = half - rendered
+                i = piece.rfind(b'\n', 0, n)
+                cut = i + 1 if i >= 0 else n
+                if cut:
+                    out.write(convert(piece[:cut]))
+                piece = piece[cut:]
+            tail.append(piece)
+            tail_size += len(piece)
+            while tail and tail_size - len(tail[0]) >= half:
+                skipped += len(tail[0])
+                tail_size -= len(tail.popleft())
+
+        excess = tail_size - half
+        if excess > 0:
+            # the tail starts at the first complete line
+            i = tail[0].find(b'\n', excess - 1)
+            cut = i + 1 if i >= 0 else excess
+            skipped += cut
+            tail[0] = tail[0][cut:]
+
+        if skipped:
+            out.write(b'\n\n[... %d bytes not shown here; see %s for the complete log ...]\n\n' %
+                      (skipped, os.path.basename(fn)))
+        while tail:
+            out.write(convert(tail.popleft()))
+        out.write(HTML_FOOTER)
+
+
+class HTMLRenderer(object):
+    """
+        Renders a list of logs to HTML in a background thread.
+
+        :param logs: list of (fn, fn_html)
+    """
+
+    def __init__(self, logs):
+        self.logs = logs
+        self.thread = threading.Thread(target=self._run, name='html-renderer')
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def get_outputs(self):
+        return [fn_html for _, fn_html in self.logs]
+
+    def _run(self):
+        for fn, fn_html in self.logs:
+            t0 = time.time()
+            try:
+                render_log_html(fn, fn_html)
+            except BaseException as e:
+                # the HTML version is only a convenience
+                dclogger.error('Could not render %s: %s' % (fn, traceback.format_exc(e)))
+                if os.path.exists(fn_html):
+                    os.unlink(fn_html)
+            else:
+                dclogger.debug('Rendered %s in %.1f s' % (fn_html, time.time() - t0))
+
+    def join(self):
+        self.thread.join()
@@ -0,0 +1,229 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from . import dclogger
+
+# Buckets (seconds) of the histograms of the phase durations.
+PHASE_BUCKETS = [0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600]
+
+# How often the textfile is rewritten.
+TEXTFILE_INTERVAL = 15.0
+
+COUNTER = 'counter'
+GAUGE = 'gauge'
+HISTOGRAM = 'histogram'
+
+# name -> (type, help)
+METRICS = OrderedDict([
+    ('dtc_jobs_claimed_total', (COUNTER, 'Jobs claimed from the server.')),
+    ('dtc_jobs_finished_total', (COUNTER, 'Jobs reported to the server, by result (success, failed, error).')),
+    ('dtc_job_phase_seconds', (HISTOGRAM, 'Duration of the phases of the jobs.')),
+    ('dtc_upload_bytes_total', (COUNTER, 'Bytes uploaded to S3.')),
+    ('dtc_download_bytes_total', (COUNTER, 'Bytes of artefacts downloaded from S3.')),
+    ('dtc_cache_local_bytes_total', (COUNTER, 'Bytes of artefacts served from the local cache.')),
+    ('dtc_cache_hits_total', (COUNTER, 'Artefacts found in the local cache.')),
+    ('dtc_cache_misses_total', (COUNTER, 'Artefacts not found in the local cache.')),
+    ('dtc_cache_hit_ratio', (GAUGE, 'Fraction of the artefacts served from the local cache.')),
+    ('dtc_polls_total', (COUNTER, 'Requests for a job, by outcome (job, empty, error).')),
+    ('dtc_poll_idle_seconds_total', (COUNTER, 'Time spent waiting for a job.')),
+    ('dtc_poll_interval_seconds', (GAUGE, 'Current interval between requests for a job (backoff), by worker.')),
+])
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                             for k, v in labels)
+
+
+def format_value(v):
+    if v == float('inf'):
+        return '+Inf'
+    return repr(float(v))
+
+
+class Histogram(object):
+    def __init__(self, buckets):
+        self.buckets = list(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class MetricsRegistry(object):
+    """
+        The metrics of the evaluator, in the Prometheus text format.
+
+        Counters and histograms are updated by the runner; the polling metrics
+        are read from the registered PollSchedulers when rendering.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = OrderedDict()  # (name, labels) -> value
+        self.gauges = OrderedDict()  # (name, labels) -> value
+        self.histograms = OrderedDict()  # (name, labels) -> Histogram
+        self.schedulers = OrderedDict()  # worker -> PollScheduler
+
+    @staticmethod
+    def _key(name, labels):
+        assert name in METRICS, name
+        return name, tuple(sorted((labels or {}).items()))
+
+    def inc(self, name, value=1, labels=None):
+        with self.lock:
+            key = self._key(name, labels)
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, labels=None):
+        with self.lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, labels=None, buckets=PHASE_BUCKETS):
+        with self.lock:
+            key = self._key(name, labels)
+            if key not in self.histograms:
+                self.histograms[key] = Histogram(buckets)
+            self.histograms[key].observe(value)
+
+    def register_scheduler(self, worker, scheduler):
+        with self.lock:
+            self.schedulers[worker] = scheduler
+
+    def record_job(self, status, timing, cache_stats):
+        """
+            Records a finished job.
+
+            :param status: the ChallengeResultsStatus reported
+            :param timing: phase -> seconds (PhaseTimer.as_dict())
+            :param cache_stats: JobCacheStats.as_dict()
+        """
+        self.inc('dtc_jobs_finished_total', labels=dict(result=status))
+        for phase, seconds in timing.items():
+            self.observe('dtc_job_phase_seconds', seconds, labels=dict(phase=phase))
+        self.inc('dtc_download_bytes_total', cache_stats['bytes_downloaded'])
+        self.inc('dtc_cache_local_bytes_total', cache_stats['bytes_local'])
+        self.inc('dtc_cache_hits_total', cache_stats['hits'])
+        self.inc('dtc_cache_misses_total', cache_stats['misses'])
+
+    def _update_derived(self):
+        with self.lock:
+            hits = self.counters.get(('dtc_cache_hits_total', ()), 0)
+            misses = self.counters.get(('dtc_cache_misses_total', ()), 0)
+            schedulers = list(self.schedulers.items())
+        if hits + misses:
+            self.set('dtc_cache_hit_ratio', float(hits) / (hits + misses))
+
+        for worker, scheduler in schedulers:
+            stats = scheduler.get_stats()
+            labels = dict(worker=worker)
+            self.set('dtc_poll_interval_seconds', stats['interval'], labels=labels)
+            # these are totals kept by the scheduler, so they are exported as they are
+            with self.lock:
+                self.counters[self._key('dtc_poll_idle_seconds_total', labels)] = stats['idle_seconds']
+                for outcome, k in [('job', 'jobs'), ('empty', 'polls_empty'), ('error', 'polls_error')]:
+                    key = self._key('dtc_polls_total', dict(worker=worker, outcome=outcome))
+                    self.counters[key] = stats[k]
+
+    def render(self):
+        """ Returns the metrics in the Prometheus text exposition format. """
+        self._update_derived()
+        lines = []
+        with self.lock:
+            for name, (type_, help_) in METRICS.items():
+                lines.append('# HELP %s %s' % (name, help_))
+                lines.append('# TYPE %s %s' % (name, type_))
+                values = self.histograms if type_ == HISTOGRAM else \
+                    (self.counters if type_ == COUNTER else self.gauges)
+                for (name_, labels), v in values.items():
+                    if name_ != name:
+                        continue
+                    if type_ != HISTOGRAM:
+                        lines.append('%s%s %s' % (name, format_labels(labels), format_value(v)))
+                        continue
+                    for b, c in zip(v.buckets + [float('inf')], v.counts + [v.count]):
+                        lb = labels + (('le', format_value(b)),)
+                        lines.append('%s_bucket%s %d' % (name, format_labels(lb), c))
+                    lines.append('%s_sum%s %s' % (name, format_labels(labels), format_value(v.sum)))
+                    lines.append('%s_count%s %d' % (name, format_labels(labels), v.count))
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, fn):
+        """ Writes the metrics atomically to `fn` (for node_exporter's textfile collector). """
+        tmp = fn + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.render())
+        os.rename(tmp, fn)
+
+
+_metrics = None
+_metrics_lock = threading.Lock()
+
+
+def get_metrics():
+    """ Returns the MetricsRegistry of this process. """
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = MetricsRegistry()
+        return _metrics
+
+
+def start_metrics_server(port, registry=None):
+    """ Serves the metrics on http://0.0.0.0:<port>/metrics, in a background thread. """
+    try:
+        from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    except ImportError:  # Python 3
+        from http.server import BaseHTTPRequestHandler, HTTPServer
+
+    registry = registry or get_metrics()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ['/', '/metrics']:
+                self.send_error(404)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = HTTPServer(('', port), Handler)
+    t = threading.Thread(target=server.serve_forever, name='metrics-server')
+    t.daemon = True
+    t.start()
+    dclogger.info('Serving metrics on port %s' % server.server_address[1])
+    return server
+
+
+def start_metrics_textfile(fn, registry=None, interval=TEXTFILE_INTERVAL):
+    """ Rewrites the metrics in `fn` every `interval` seconds, in a background thread. """
+    registry = registry or get_metrics()
+
+    def loop():
+        while True:
+            try:
+                registry.write_textfile(fn)
+            except BaseException as e:
+                dclogger.warning('Could not write metrics to %s: %s' % (fn, e))
+            time.sleep(interval)
+
+    t = threading.Thread(target=loop, name='metrics-textfile')
+    t.daemon = True
+    t.start()
+    return t
@@ -0,0 +1,112 @@
+import sys
+import threading
+import time
+import traceback
+
+try:
+    from Queue import Queue, Empty
+except ImportError:  # Python 3
+    from queue import Queue, Empty
+
+from dt_shell.remote import ConnectionError
+from .runner import claim_job, prepare_job, execute_job, finish_job, NothingLeft, elogger
+from .runner_images import get_image_manager
+
+
+class PrepareFailed(Exception):
+    """ Raised by pipeline_loop() if the thread preparing the jobs died. """
+
+
+def pipeline_loop(args, scheduler, max_finishing=2):
+    """
+        Like continuous_loop(), but overlapping the stages of consecutive jobs:
+
+        - a "prepare" thread claims job N+1, downloads its artefacts and pulls
+          its images while the containers of job N execute;
+        - a "finish" thread uploads and reports job N-1 in the background.
+
+        At most one job is claimed ahead of the one running, and at most
+        `max_finishing` jobs wait to be uploaded; when the queues are full
+        the previous stage waits.
+
+        :param args: the same arguments as for go_()
+        :param scheduler: a PollScheduler
+    """
+    ready = Queue(maxsize=1)
+    finishing = Queue(maxsize=max_finishing)
+    # released by the running stage when it takes a job
+    ahead = threading.Semaphore(1)
+
+    def prepare_stage():
+        try:
+            while True:
+                ahead.acquire()
+                job = claim_next(args, scheduler)
+                prepare_job(job, do_pull=args['do_pull'], do_upload=args['do_upload'], tmpdir=args['tmpdir'],
+                            evaluator_name=args['evaluator_name'], download_workers=args['download_workers'])
+                ready.put(job)
+        except BaseException as e:
+            msg = 'Uncaught exception while preparing the next job:\n%s' % traceback.format_exc(e)
+            elogger.error(msg)
+            # the main loop would wait forever
+            ready.put(PrepareFailed(msg))
+
+    def finish_stage():
+        while True:
+            job = get_interruptible(finishing)
+            try:
+                finish_job(job, do_upload=args['do_upload'], delete=args['delete'],
+                           upload_workers=args['upload_workers'])
+            except BaseException as e:
+                msg = 'Uncaught exception while finishing job %s:\n%s' % (job.job_id, traceback.format_exc(e))
+                elogger.error(msg)
+
+    for f in [prepare_stage, finish_stage]:
+        t = threading.Thread(target=f, name=f.__name__)
+        t.daemon = True
+        t.start()
+
+    while True:
+        job = get_interruptible(ready)
+        if isinstance(job, PrepareFailed):
+            raise job
+        ahead.release()
+        elogger.info('Running job %s (%d waiting to be finished)' % (job.job_id, finishing.qsize()))
+        # the finish stage might be running "down" on the previous job: pruning now would race with it
+        execute_job(job, prune_networks=False)
+        finishing.put(job)
+
+
+def claim_next(args, scheduler):
+    """ Polls the server until a job is available. """
+    while True:
+        t0 = time.time()
+        try:
+            job = claim_job(None, args['more_features'], reset=False, evaluator_name=args['evaluator_name'],
+                            machine_id=args['machine_id'], long_poll=args.get('long_poll'))
+            scheduler.on_job()
+            return job
+        except NothingLeft:
+            sys.stderr.write('.')
+            wait = scheduler.on_nothing_left(time.time() - t0)
+            if args['do_pull']:
+                # nothing to do: refresh the images of the recent challenges
+                get_image_manager().prewarm()
+        except ConnectionError as e:
+            elogger.error(e)
+            wait = scheduler.on_error(time.time() - t0)
+        except BaseException as e:
+            msg = 'Uncaught exception:\n%s' % traceback.format_exc(e)
+            elogger.error(msg)
+            wait = scheduler.on_error(time.time() - t0)
+
+        scheduler.sleep(wait)
+
+
+def get_interruptible(queue):
+    # In Python 2, a blocking get() without timeout cannot be interrupted by Ctrl-C.
+    while True:
+        try:
+            return queue.get(timeout=1.0)
+        except Empty:
+            pass
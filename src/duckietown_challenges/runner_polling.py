@@ -0,0 +1,95 @@
+import random
+import threading
+import time
+from collections import OrderedDict
+
+
+class PollScheduler(object):
+    """
+        Decides how long to wait between two requests to /take-submission.
+
+        - After a job was evaluated, we poll again right away.
+        - If there is nothing to do, or there was an error, the interval grows
+          exponentially from `initial_interval` up to `max_interval`.
+        - A random jitter is added so that a fleet of evaluators started
+          at the same time does not poll in lockstep.
+
+        It also keeps the statistics of the time spent idle.
+    """
+
+    def __init__(self, initial_interval=5.0, max_interval=60.0, factor=1.5, jitter=0.2, after_job_interval=0.0):
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.jitter = jitter
+        self.after_job_interval = after_job_interval
+
+        self.lock = threading.Lock()
+        self.interval = initial_interval
+        self.npolls = 0
+        self.nempty = 0
+        self.nerrors = 0
+        self.njobs = 0
+        # time spent polling without getting a job, and sleeping
+        self.idle_seconds = 0.0
+        # idle time since the last job
+        self.idle_seconds_current = 0.0
+
+    def _with_jitter(self, interval):
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def _backoff(self):
+        interval = self.interval
+        self.interval = min(self.interval * self.factor, self.max_interval)
+        return self._with_jitter(interval)
+
+    def on_job(self):
+        """ A job was evaluated. Returns how long to wait. """
+        with self.lock:
+            self.npolls += 1
+            self.njobs += 1
+            self.interval = self.initial_interval
+            self.idle_seconds_current = 0.0
+            return self.after_job_interval
+
+    def on_nothing_left(self, poll_duration=0.0):
+        """ The server had nothing for us. Returns how long to wait. """
+        with self.lock:
+            self.npolls += 1
+            self.nempty += 1
+            self._add_idle(poll_duration)
+            return self._backoff()
+
+    def on_error(self, poll_duration=0.0):
+        """ We could not talk to the server (or something else went wrong). Returns how long to wait. """
+        with self.lock:
+            self.npolls += 1
+            self.nerrors += 1
+            self._add_idle(poll_duration)
+            return self._backoff()
+
+    def _add_idle(self, seconds):
+        self.idle_seconds += seconds
+        self.idle_seconds_current += seconds
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            time.sleep(seconds)
+            with self.lock:
+                self._add_idle(seconds)
+
+    def get_current_interval(self):
+        with self.lock:
+            return self.interval
+
+    def get_stats(self):
+        with self.lock:
+            stats = OrderedDict()
+            stats['polls'] = self.npolls
+            stats['polls_empty'] = self.nempty
+            stats['polls_error'] = self.nerrors
+            stats['jobs'] = self.njobs
+            stats['idle_seconds'] = self.idle_seconds
+            stats['idle_seconds_current'] = self.idle_seconds_current
+            stats['interval'] = self.interval
+            return stats
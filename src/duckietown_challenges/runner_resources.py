@@ -0,0 +1,92 @@
+import threading
+from collections import namedtuple
+
+from . import dclogger
+
+# When auto-sizing the number of workers, each job is assumed to need this much.
+AUTO_RAM_PER_JOB_MB = 4096
+AUTO_PROCESSORS_PER_JOB = 2
+
+Reservation = namedtuple('Reservation', 'nprocessors ram_mb')
+
+
+def auto_nworkers(features):
+    """ Number of concurrent jobs that the host described by `features` can sustain. """
+    by_cpu = features['nprocessors'] // AUTO_PROCESSORS_PER_JOB
+    by_ram = features['ram_total_mb'] // AUTO_RAM_PER_JOB_MB
+    return max(1, min(by_cpu, by_ram))
+
+
+class ResourceBudget(object):
+    """
+        Keeps track of the host resources reserved by the jobs that run concurrently.
+
+        Claims are serialized: the features sent to the server are reduced by what is
+        already reserved, so that the server only gives us jobs that fit, and the
+        job is reserved before the next worker can claim.
+    """
+
+    def __init__(self, features, nworkers):
+        self.nprocessors = features['nprocessors']
+        self.ram_mb = features['ram_total_mb']
+        self.nworkers = nworkers
+        # what we reserve for a job that does not declare its requirements
+        self.share = Reservation(nprocessors=max(1, self.nprocessors // nworkers),
+                                 ram_mb=max(1, self.ram_mb // nworkers))
+        self.reserved = {}  # job_id -> Reservation
+        self.cond = threading.Condition()
+        self.claim_lock = threading.Lock()
+
+    def get_free(self):
+        with self.cond:
+            nprocessors = self.nprocessors - sum(_.nprocessors for _ in self.reserved.values())
+            ram_mb = self.ram_mb - sum(_.ram_mb for _ in self.reserved.values())
+        return Reservation(nprocessors=nprocessors, ram_mb=ram_mb)
+
+    def _fits_share(self):
+        free = self.get_free()
+        return free.nprocessors >= self.share.nprocessors and free.ram_mb >= self.share.ram_mb
+
+    def wait_for_admission(self):
+        """ Blocks until at least a share of the host is free. """
+        with self.cond:
+            while not self._fits_share():
+                self.cond.wait(5.0)
+
+    def adjust_features(self, features):
+        """ Returns a copy of the features, minus the resources already reserved. """
+        free = self.get_free()
+        features = dict(features)
+        features['nprocessors'] = max(0, free.nprocessors)
+        if 'ram_available_mb' in features:
+            features['ram_available_mb'] = max(0, min(features['ram_available_mb'], free.ram_mb))
+        return features
+
+    def get_reservation(self, features_required):
+        nprocessors = features_required.get('nprocessors', self.share.nprocessors)
+        ram_mb = features_required.get('ram_available_mb', features_required.get('ram_mb', self.share.ram_mb))
+        return Reservation(nprocessors=nprocessors, ram_mb=ram_mb)
+
+    def claim(self, do_claim, features):
+        """
+            Claims a job, calling `do_claim(features)` with the adjusted features.
+
+            If a job is returned (it has a 'job_id'), its resources are reserved
+            until `release()` is called.
+        """
+        self.wait_for_admission()
+        with self.claim_lock:
+            res = do_claim(self.adjust_features(features))
+            if 'job_id' in res:
+                # The server might not tell us what the step requires; then we reserve a share.
+                features_required = res.get('features_required') or {}
+                reservation = self.get_reservation(features_required)
+                with self.cond:
+                    self.reserved[res['job_id']] = reservation
+                dclogger.debug('Reserved %s for job %s' % (reservation, res['job_id']))
+        return res
+
+    def release(self, job_id):
+        with self.cond:
+            self.reserved.pop(job_id, None)
+            self.cond.notify_all()
@@ -0,0 +1,166 @@
+import hashlib
+import os
+import shutil
+import threading
+
+from . import dclogger
+from .runner_hashing import HASH_CHUNK_SIZE
+from .utils import map_threads
+
+# Number of concurrent S3 requests per job.
+DEFAULT_S3_WORKERS = 8
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_s3_client(aws_config, max_pool_connections=DEFAULT_S3_WORKERS):
+    """
+        Returns a boto3 S3 client shared by all the threads that use the same credentials.
+
+        Contrary to boto3 resources, clients are thread-safe; the connection pool
+        is sized so that `max_pool_connections` workers never wait for a connection.
+    """
+    aws_access_key_id = aws_config['aws_access_key_id']
+    aws_secret_access_key = aws_config['aws_secret_access_key']
+    # for S3-compatible services
+    endpoint_url = aws_config.get('endpoint_url', None)
+    key = (aws_access_key_id, aws_secret_access_key, endpoint_url, max_pool_connections)
+    with _clients_lock:
+        if key not in _clients:
+            import boto3
+            from botocore.config import Config
+            session = boto3.session.Session(aws_access_key_id=aws_access_key_id,
+                                            aws_secret_access_key=aws_secret_access_key)
+            config = Config(max_pool_connections=max_pool_connections)
+            _clients[key] = session.client('s3', config=config, endpoint_url=endpoint_url)
+            dclogger.debug('Created S3 client with %d connections' % max_pool_connections)
+        return _clients[key]
+
+
+class S3ObjectStore(object):
+    """ The few S3 operations used by the evaluator, on top of a shared client. """
+
+    def __init__(self, aws_config, bucket_name, nworkers=DEFAULT_S3_WORKERS):
+        self.bucket_name = bucket_name
+        self.nworkers = nworkers
+        self.client = get_s3_client(aws_config, max_pool_connections=nworkers)
+
+    def exists(self, object_key):
+        from botocore.exceptions import ClientError
+        try:
+            self.client.head_object(Bucket=self.bucket_name, Key=object_key)
+        except ClientError as e:
+            not_found = e.response['Error']['Code'] in ['404', 'NoSuchKey']
+            if not_found:
+                return False
+            raise
+        return True
+
+    def exists_many(self, object_keys):
+        """ Checks the existence of many objects concurrently. Returns a dict key -> bool. """
+        object_keys = sorted(set(object_keys))
+        found = map_threads(self.exists, object_keys, self.nworkers)
+        return dict(zip(object_keys, found))
+
+    def upload_file(self, fn, object_key, mime_type):
+        self.client.upload_file(fn, self.bucket_name, object_key, ExtraArgs={'ContentType': mime_type})
+
+    def download_file(self, object_key, fn, chunk_size=HASH_CHUNK_SIZE):
+        """
+            Streams the object to the file `fn`, hashing it on the way.
+
+            :return: a tuple (size, sha256hex) of the data received.
+        """
+        res = self.client.get_object(Bucket=self.bucket_name, Key=object_key)
+        body = res['Body']
+        h = hashlib.sha256()
+        size = 0
+        tmp = fn + '.download'
+        with open(tmp, 'wb') as f:
+            while True:
+                chunk = body.read(chunk_size)
+                if not chunk:
+                    break
+                h.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+        os.rename(tmp, fn)
+        return size, h.hexdigest()
+
+    def upload_fileobj(self, f, object_key):
+        self.client.upload_fileobj(f, self.bucket_name, object_key)
+
+    def get_url(self, object_key):
+        return 'http://%s.s3.amazonaws.com/%s' % (self.bucket_name, object_key)
+
+
+class FileObjectStore(S3ObjectStore):
+    """
+        Same interface as S3ObjectStore, but the objects are files in the directory
+        `<root>/<bucket_name>/`. Used when aws_config has the key 'local_root'
+        (for example, for benchmarks and tests without S3).
+    """
+
+    def __init__(self, aws_config, bucket_name, nworkers=DEFAULT_S3_WORKERS):
+        self.bucket_name = bucket_name
+        self.nworkers = nworkers
+        self.root = os.path.join(aws_config['local_root'], bucket_name)
+
+    def _fn(self, object_key):
+        return os.path.join(self.root, object_key)
+
+    def _makedirs(self, fn):
+        dn = os.path.dirname(fn)
+        try:
+            os.makedirs(dn)
+        except OSError:
+            if not os.path.isdir(dn):
+                raise
+
+    def exists(self, object_key):
+        return os.path.exists(self._fn(object_key))
+
+    def upload_file(self, fn, object_key, mime_type):
+        dest = self._fn(object_key)
+        self._makedirs(dest)
+        tmp = dest + '.upload-%s' % threading.current_thread().ident
+        shutil.copyfile(fn, tmp)
+        os.rename(tmp, dest)
+
+    def download_file(self, object_key, fn, chunk_size=HASH_CHUNK_SIZE):
+        h = hashlib.sha256()
+        size = 0
+        tmp = fn + '.download'
+        with open(self._fn(object_key), 'rb') as fin:
+            with open(tmp, 'wb') as f:
+                while True:
+                    chunk = fin.read(chunk_size)
+                    if not chunk:
+                        break
+                    h.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+        os.rename(tmp, fn)
+        return size, h.hexdigest()
+
+    def upload_fileobj(self, f, object_key):
+        dest = self._fn(object_key)
+        self._makedirs(dest)
+        with open(dest, 'wb') as fout:
+            shutil.copyfileobj(f, fout)
+
+    def get_url(self, object_key):
+        return 'file://%s' % self._fn(object_key)
+
+
+def get_object_store(aws_config, bucket_name, nworkers=DEFAULT_S3_WORKERS):
+    """ Returns a FileObjectStore if aws_config has 'local_root', otherwise a S3ObjectStore. """
+    if aws_config.get('local_root', None):
+        return FileObjectStore(aws_config, bucket_name, nworkers=nworkers)
+    return S3ObjectStore(aws_config, bucket_name, nworkers=nworkers)
+
+
+def get_object_key_by_value(aws_config, sha256hex):
+    aws_path_by_value = aws_config['path_by_value']
+    return os.path.join(aws_path_by_value, 'sha256', sha256hex)
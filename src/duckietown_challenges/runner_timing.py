@@ -0,0 +1,47 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class PhaseTimer(object):
+    """
+        Accumulates the wall-clock time spent in the phases of a job.
+
+        Use as:
+
+            with timer.phase('download'):
+                ...
+
+        Phases can be nested, and the same phase can be timed several times
+        (the durations are added). Thread-safe.
+    """
+
+    def __init__(self):
+        self.t0 = time.time()
+        self.timings = OrderedDict()  # phase -> seconds
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        t0 = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - t0)
+
+    def add(self, name, seconds):
+        with self.lock:
+            self.timings[name] = self.timings.get(name, 0.0) + seconds
+
+    def as_dict(self):
+        """ Returns phase -> seconds (rounded to ms), plus the total time since creation. """
+        with self.lock:
+            res = OrderedDict((k, round(v, 3)) for k, v in self.timings.items())
+        res['total'] = round(time.time() - self.t0, 3)
+        return res
+
+
+def get_timer(timer):
+    """ Returns `timer`, or a PhaseTimer whose measurements are discarded if it is None. """
+    return timer if timer is not None else PhaseTimer()
@@ -97,8 +97,11 @@ class ChallengeInterfaceSolution(object):
         """
             Same as before, but the contents is passed as a string.
 
+            The contents can also be a file-like object or an iterator of chunks
+            of bytes; they are written to the output directory as they are read.
+
             :param basename: Name that can be used later to refer to the file.
-            :param contents: Contents of the file.
+            :param contents: Contents of the file (string, file-like object, or iterator of strings).
             :param description: Optional description of the artefact.
             :return: None
         """
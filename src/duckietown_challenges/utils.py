@@ -2,7 +2,6 @@ import math
 import os
 
 import decorator
-import yaml
 
 from . import dclogger, InvalidConfiguration
 
@@ -12,8 +11,11 @@ def write_data_to_file(data, filename):
         Writes the data to the given filename.
         If the data did not change, the file is not touched.
 
+        The data can be bytes or unicode (written as UTF-8).
     """
-    if not isinstance(data, str):
+    if isinstance(data, type(u'')):
+        data = data.encode('utf-8')
+    if not isinstance(data, bytes):
         msg = 'Expected "data" to be a string, not %s.' % type(data).__name__
         raise ValueError(msg)
     if len(filename) > 256:
@@ -23,20 +25,74 @@ def write_data_to_file(data, filename):
     filename = expand_all(filename)
     d8n_make_sure_dir_exists(filename)
 
-    if os.path.exists(filename):
-        current = open(filename).read()
-        if current == data:
-            if not 'assets/' in filename:
-                dclogger.debug('already up to date %s' % (filename))
-            return
+    if file_has_contents(filename, data):
+        if not 'assets/' in filename:
+            dclogger.debug('already up to date %s' % (filename))
+        return
 
     tmp = filename + '.tmp'
-    with open(tmp, 'w') as f:
+    with open(tmp, 'wb') as f:
         f.write(data)
     os.rename(tmp, filename)
     dclogger.debug('Written to: %s' % (filename))
 
 
+def file_has_contents(filename, data, chunk_size=1024 * 1024):
+    """ True if the file exists and contains exactly `data`; reads it in chunks. """
+    if not os.path.exists(filename) or os.path.getsize(filename) != len(data):
+        return False
+    with open(filename, 'rb') as f:
+        for i in range(0, len(data), chunk_size):
+            if f.read(chunk_size) != data[i:i + chunk_size]:
+                return False
+    return True
+
+
+def iterate_chunks(contents, chunk_size=1024 * 1024):
+    """
+        Yields the contents as chunks of bytes. The contents can be bytes,
+        unicode (encoded as UTF-8), a file-like object, or an iterable of chunks.
+    """
+    if isinstance(contents, type(u'')):
+        yield contents.encode('utf-8')
+    elif isinstance(contents, bytes):
+        yield contents
+    elif hasattr(contents, 'read'):
+        while True:
+            chunk = contents.read(chunk_size)
+            if not chunk:
+                break
+            if isinstance(chunk, type(u'')):
+                chunk = chunk.encode('utf-8')
+            yield chunk
+    else:
+        for chunk in contents:
+            if isinstance(chunk, type(u'')):
+                chunk = chunk.encode('utf-8')
+            yield chunk
+
+
+def write_chunks_to_file(contents, filename):
+    """
+        Writes the contents (anything accepted by iterate_chunks()) to the file as it is
+        produced, so that it is never all in memory. Returns the number of bytes written.
+    """
+    d8n_make_sure_dir_exists(filename)
+    tmp = filename + '.tmp'
+    n = 0
+    try:
+        with open(tmp, 'wb') as f:
+            for chunk in iterate_chunks(contents):
+                f.write(chunk)
+                n += len(chunk)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    os.rename(tmp, filename)
+    return n
+
+
 def expand_all(filename):
     """
         Expands ~ and ${ENV} in the string.
@@ -106,6 +162,7 @@ def wrap_config_reader(f, x, *args, **kwargs):
 
 
 def safe_yaml_dump(x):
+    import yaml
     s = yaml.safe_dump(x, encoding='utf-8', indent=4, allow_unicode=True)
     return s
 
@@ -148,6 +205,22 @@ def friendly_size2(b):
     return '%.2f GB' % gbs
 
 
+def map_threads(f, args, nworkers):
+    """ Like map(f, args) but using up to `nworkers` threads. The order of the results is preserved. """
+    args = list(args)
+    nworkers = min(nworkers, len(args))
+    if nworkers <= 1:
+        return [f(_) for _ in args]
+
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(nworkers)
+    try:
+        return pool.map(f, args)
+    finally:
+        pool.close()
+        pool.join()
+
+
 import traceback
 
 
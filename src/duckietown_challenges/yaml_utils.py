@@ -1,23 +1,163 @@
+import json
 import os
+import sys
+from collections import OrderedDict
 
-
+from . import dclogger
+from .constants import ENV_PROTOCOL_ENCODING
 from .utils import write_data_to_file
 
+ENCODING_YAML = 'yaml'
+ENCODING_JSON = 'json'
+ENCODING_MSGPACK = 'msgpack'
+ENCODINGS = [ENCODING_YAML, ENCODING_JSON, ENCODING_MSGPACK]
+
+# msgpack files start with this, so that they can be recognized when reading
+MSGPACK_MAGIC = b'\x00dtc-msgpack\n'
+
+PY2 = sys.version_info[0] == 2
+
+_yaml = None
+
+
+def get_yaml():
+    """ Returns the ruamel.yaml module and the fastest Loader and Dumper (libyaml-based if available). """
+    global _yaml
+    if _yaml is None:
+        # noinspection PyUnresolvedReferences
+        try:
+            import ruamel.ordereddict as s
+        except ImportError:
+            pass
+        from ruamel import yaml
+        Loader = getattr(yaml, 'CLoader', yaml.Loader)
+        Dumper = getattr(yaml, 'CDumper', yaml.Dumper)
+        _yaml = yaml, Loader, Dumper
+    return _yaml
+
+
+def get_protocol_encoding():
+    """ The encoding used by write_yaml(), from the environment variable ENV_PROTOCOL_ENCODING. """
+    encoding = os.environ.get(ENV_PROTOCOL_ENCODING, ENCODING_YAML)
+    if encoding not in ENCODINGS:
+        msg = 'Invalid %s = %r; using %s. Valid values: %s' % (ENV_PROTOCOL_ENCODING, encoding, ENCODING_YAML,
+                                                              ENCODINGS)
+        dclogger.warning(msg)
+        encoding = ENCODING_YAML
+    return encoding
+
 
 def read_yaml_file(fn):
+    """
+        Reads a protocol file, which can be YAML, JSON or msgpack
+        (recognized from the content).
+    """
     assert os.path.exists(fn)
-    # noinspection PyUnresolvedReferences
-    try:
-        import ruamel.ordereddict as s
-    except ImportError:
-        pass
-    from ruamel import yaml
-    with open(fn) as f:
+    with open(fn, 'rb') as f:
         data = f.read()
-        return yaml.load(data, Loader=yaml.Loader)
+    return decode_data(data)
+
+
+def _native(x):
+    # the dicts are converted already by _native_pairs()
+    if isinstance(x, type(u'')):
+        try:
+            return x.encode('ascii')
+        except UnicodeEncodeError:
+            return x
+    if isinstance(x, list):
+        x[:] = [_native(_) for _ in x]
+    return x
+
+
+def _native_pairs(pairs):
+    return OrderedDict([(_native(k), _native(v)) for k, v in pairs])
+
+
+def _identity(x):
+    return x
+
+
+# JSON and msgpack give unicode for all the strings; in Python 2 the ASCII ones are
+# converted to str, as the YAML loader does. The order of the dicts is preserved.
+native_strings = _native if PY2 else _identity
+object_pairs_hook = _native_pairs if PY2 else OrderedDict
+
+
+def decode_data(data):
+    if data.startswith(MSGPACK_MAGIC):
+        import msgpack
+        return native_strings(msgpack.unpackb(data[len(MSGPACK_MAGIC):], raw=False,
+                                              object_pairs_hook=object_pairs_hook))
+
+    if data.lstrip()[:1] == b'{':
+        try:
+            return json.loads(data.decode('utf-8'), object_pairs_hook=object_pairs_hook)
+        except ValueError:
+            pass  # YAML flow style
+
+    yaml, Loader, _ = get_yaml()
+    return yaml.load(data, Loader=Loader)
+
+
+def write_yaml(data, fn, encoding=None):
+    """
+        Writes a protocol file. By default, the encoding is YAML;
+        it can be changed with the environment variable ENV_PROTOCOL_ENCODING,
+        or with `encoding`. If the data cannot be represented in JSON or msgpack,
+        YAML is used.
+    """
+    if encoding is None:
+        encoding = get_protocol_encoding()
+    s = encode_data(data, encoding)
+    write_data_to_file(s, fn)
+
+
+_string_types = (str, type(u''))
+
+
+def check_exact(x, string_keys):
+    """
+        Raises ValueError if `x` contains something that JSON or msgpack would silently change:
+        tuples (read back as lists) and, if `string_keys`, keys that are not strings.
+        The types that cannot be encoded at all are left to the encoder.
+    """
+    if isinstance(x, dict):
+        for k, v in x.items():
+            if string_keys and not isinstance(k, _string_types):
+                msg = 'key %r is not a string' % (k,)
+                raise ValueError(msg)
+            check_exact(v, string_keys)
+    elif isinstance(x, list):
+        for v in x:
+            check_exact(v, string_keys)
+    elif isinstance(x, tuple):
+        msg = 'tuples are read back as lists'
+        raise ValueError(msg)
+
 
+def encode_data(data, encoding):
+    """
+        Encodes `data` with `encoding`, or with YAML if the encoding cannot represent it exactly:
+        JSON and msgpack have no tuples and no dates, and JSON has only string keys and no NaN/infinity.
+    """
+    if encoding == ENCODING_JSON:
+        try:
+            check_exact(data, string_keys=True)
+            return json.dumps(data, indent=1, separators=(',', ': '), allow_nan=False)
+        except (TypeError, ValueError) as e:
+            dclogger.debug('Cannot encode as JSON (%s); using YAML.' % e)
+    elif encoding == ENCODING_MSGPACK:
+        try:
+            import msgpack
+        except ImportError:
+            dclogger.warning('msgpack is not installed; using YAML.')
+        else:
+            try:
+                check_exact(data, string_keys=False)
+                return MSGPACK_MAGIC + msgpack.packb(data, use_bin_type=True)
+            except (TypeError, ValueError) as e:
+                dclogger.debug('Cannot encode as msgpack (%s); using YAML.' % e)
 
-def write_yaml(data, fn):
-    from ruamel import yaml
-    y = yaml.dump(data, default_flow_style=False)
-    write_data_to_file(y, fn)
+    yaml, _, Dumper = get_yaml()
+    return yaml.dump(data, Dumper=Dumper, default_flow_style=False)
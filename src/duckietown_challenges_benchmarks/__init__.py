@@ -0,0 +1,5 @@
+from .fake_server import *
+from .stub_backend import *
+from .synthetic_jobs import *
+from .run_evaluator import *
+from .micro import *
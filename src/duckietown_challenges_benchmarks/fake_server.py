@@ -0,0 +1,83 @@
+import json
+import threading
+from collections import OrderedDict
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:  # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+__all__ = ['FakeServer']
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeServer(object):
+    """
+        A stand-in for the challenges server: it answers the evaluator's
+        requests to /take-submission from a list of jobs, and records the reports.
+
+        Use it by setting the environment variable DTSERVER to `url`.
+    """
+
+    def __init__(self, jobs):
+        self.lock = threading.Lock()
+        self.jobs = list(jobs)
+        # job_id -> the data posted by the evaluator
+        self.reports = {}
+        self.httpd = None
+        self.url = None
+
+    def take(self):
+        with self.lock:
+            if not self.jobs:
+                return {'msg': 'No jobs available.'}
+            return self.jobs.pop(0)
+
+    def report(self, data):
+        with self.lock:
+            self.reports[data['job_id']] = data
+        return {}
+
+    def start(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _answer(self, f):
+                if self.path.rstrip('/') != '/take-submission':
+                    self.send_error(404)
+                    return
+                n = int(self.headers.get('Content-Length') or 0)
+                data = json.loads(self.rfile.read(n).decode('utf-8'), object_pairs_hook=OrderedDict) if n else {}
+                body = json.dumps({'ok': True, 'result': f(data)}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                self._answer(lambda _: server.take())
+
+            def do_POST(self):
+                self._answer(server.report)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = _ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:%d' % self.httpd.server_address[1]
+        t = threading.Thread(target=self.httpd.serve_forever, name='fake-server')
+        t.daemon = True
+        t.start()
+        return self
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
@@ -0,0 +1,313 @@
+import argparse
+import copy
+import json
+import logging
+import os
+import platform
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import yaml
+
+from duckietown_challenges import dclogger
+from duckietown_challenges.challenge import ChallengeDescription, EvaluationParameters
+from duckietown_challenges.challenge_results import ChallengeResults
+from duckietown_challenges.constants import ChallengeResultsStatus
+from duckietown_challenges.utils import wrap_config_reader
+from duckietown_challenges.yaml_utils import encode_data, decode_data, ENCODINGS, ENCODING_MSGPACK
+
+__all__ = ['run_micro_benchmarks', 'compare_to_baselines', 'micro_benchmarks_main', 'make_challenge_data']
+
+# The baselines shipped with the package.
+BASELINES_FN = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+# Each benchmark is run on a number of calls that takes at least this long;
+# the best of REPEAT runs is kept.
+MIN_TIME = 0.2
+REPEAT = 3
+
+# A benchmark is reported as a regression if it is this much slower than the baseline.
+DEFAULT_THRESHOLD = 1.25
+
+
+def make_challenge_data(nsteps=2):
+    """ The data of a challenge whose steps step1, ..., step<n> are evaluated one after the other. """
+    steps = OrderedDict()
+    transitions = [['START', 'success', 'step1']]
+    for i in range(1, nsteps + 1):
+        name = 'step%d' % i
+        services = OrderedDict([('evaluator', {'image': 'org/evaluator%d:latest' % i, 'environment': {'A': 1}}),
+                                ('solution', {'image': 'SUBMISSION_CONTAINER'})])
+        steps[name] = {'title': 'Step %d' % i,
+                       'description': 'Description of step %d.' % i,
+                       'evaluation_parameters': {'version': '3', 'services': services},
+                       'features_required': {'ram_mb': 8000},
+                       'timeout': 100}
+        second = 'step%d' % (i + 1) if i < nsteps else 'SUCCESS'
+        transitions.append([name, 'success', second])
+        transitions.append([name, 'failed', 'FAILED'])
+        transitions.append([name, 'error', 'ERROR'])
+
+    return {'challenge': 'challenge-benchmark',
+            'title': 'Benchmark',
+            'tags': ['benchmark'],
+            'description': 'A challenge for benchmarks.',
+            'protocol': 'p1',
+            'date-open': datetime(2018, 1, 1),
+            'date-close': datetime(2028, 1, 1),
+            'roles': {'user:benchmark': {'grant': True}},
+            'scoring': {'scores': [{'name': 'score1', 'description': 'description'}]},
+            'steps': steps,
+            'transitions': transitions}
+
+
+def make_results_data():
+    scores = OrderedDict(('score%d' % i, i * 0.1) for i in range(10))
+    stats = {'cache': {'hits': 3, 'misses': 1}, 'timing': {'download': 1.0, 'up': 30.0}}
+    return ChallengeResults(ChallengeResultsStatus.SUCCESS, 'All good.', scores, stats).to_yaml()
+
+
+# Each benchmark is a function (n) -> seconds taken by n calls;
+# the setup is done outside the timed region.
+
+def bench_challenge_from_yaml(n):
+    data = make_challenge_data(nsteps=5)
+    # from_yaml() consumes its argument
+    copies = [copy.deepcopy(data) for _ in range(n)]
+    t0 = time.time()
+    for d in copies:
+        ChallengeDescription.from_yaml(d)
+    return time.time() - t0
+
+
+def to_plain(x):
+    """ Converts the OrderedDicts to dicts, for yaml.safe_dump(). """
+    if isinstance(x, dict):
+        return dict((k, to_plain(v)) for k, v in x.items())
+    if isinstance(x, list):
+        return [to_plain(_) for _ in x]
+    return x
+
+
+def make_challenge_from_yaml_cached(as_yaml):
+    def bench(n):
+        data = make_challenge_data(nsteps=5)
+        if as_yaml:
+            data = yaml.safe_dump(to_plain(data))
+        ChallengeDescription.from_yaml_cached(data)
+        t0 = time.time()
+        for _ in range(n):
+            ChallengeDescription.from_yaml_cached(data)
+        return time.time() - t0
+
+    return bench
+
+
+def bench_get_next_steps(n):
+    c = ChallengeDescription.from_yaml(make_challenge_data(nsteps=5))
+    statuses = [{'START': 'success'},
+                {'START': 'success', 'step1': 'success', 'step2': 'evaluating'},
+                {'START': 'success', 'step1': 'success', 'step2': 'success', 'step3': 'failed'},
+                {'START': 'success', 'step1': 'success', 'step2': 'success', 'step3': 'success',
+                 'step4': 'success', 'step5': 'success'}]
+    statuses = [statuses[i % len(statuses)] for i in range(n)]
+    t0 = time.time()
+    for status in statuses:
+        c.get_next_steps(status)
+    return time.time() - t0
+
+
+def bench_get_next_steps_batch(n):
+    c = ChallengeDescription.from_yaml(make_challenge_data(nsteps=5))
+    statuses = [{'START': 'success', 'step1': 'success', 'step2': 'success', 'step3': 'failed'}] * n
+    t0 = time.time()
+    c.get_next_steps_batch(statuses)
+    return time.time() - t0
+
+
+def bench_results_from_yaml(n):
+    data = make_results_data()
+    t0 = time.time()
+    for _ in range(n):
+        ChallengeResults.from_yaml(data)
+    return time.time() - t0
+
+
+def bench_results_to_yaml(n):
+    cr = ChallengeResults.from_yaml(make_results_data())
+    t0 = time.time()
+    for _ in range(n):
+        cr.to_yaml()
+    return time.time() - t0
+
+
+def bench_evaluation_parameters_equivalent(n):
+    data = make_challenge_data(nsteps=1)['steps']['step1']['evaluation_parameters']
+    # without digests, services are never equivalent
+    for i, service in enumerate(data['services'].values()):
+        service['image_digest'] = 'sha256:%064d' % i
+    a = EvaluationParameters.from_yaml(copy.deepcopy(data))
+    b = EvaluationParameters.from_yaml(copy.deepcopy(data))
+    t0 = time.time()
+    for _ in range(n):
+        a.equivalent(b)
+    return time.time() - t0
+
+
+def bench_wrap_config_reader(n):
+    """ The cost of calling a trivial function decorated with wrap_config_reader. """
+
+    @wrap_config_reader
+    def identity(x):
+        return x
+
+    x = {}
+    t0 = time.time()
+    for _ in range(n):
+        identity(x)
+    return time.time() - t0
+
+
+def make_yaml_roundtrip(encoding):
+    def bench(n):
+        data = make_results_data()
+        t0 = time.time()
+        for _ in range(n):
+            decode_data(encode_data(data, encoding))
+        return time.time() - t0
+
+    return bench
+
+
+def has_msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        return False
+    return True
+
+
+def get_micro_benchmarks():
+    """ Returns an OrderedDict name -> benchmark function. """
+    benchmarks = OrderedDict()
+    benchmarks['challenge_from_yaml'] = bench_challenge_from_yaml
+    benchmarks['challenge_from_yaml_cached'] = make_challenge_from_yaml_cached(as_yaml=False)
+    benchmarks['challenge_from_yaml_cached_text'] = make_challenge_from_yaml_cached(as_yaml=True)
+    benchmarks['get_next_steps'] = bench_get_next_steps
+    benchmarks['get_next_steps_batch'] = bench_get_next_steps_batch
+    benchmarks['results_from_yaml'] = bench_results_from_yaml
+    benchmarks['results_to_yaml'] = bench_results_to_yaml
+    benchmarks['evaluation_parameters_equivalent'] = bench_evaluation_parameters_equivalent
+    benchmarks['wrap_config_reader'] = bench_wrap_config_reader
+    for encoding in ENCODINGS:
+        if encoding == ENCODING_MSGPACK and not has_msgpack():
+            continue
+        benchmarks['yaml_utils_roundtrip_%s' % encoding] = make_yaml_roundtrip(encoding)
+    return benchmarks
+
+
+def measure(f, min_time=MIN_TIME, repeat=REPEAT):
+    """ Returns the seconds per call of the benchmark `f` (best of `repeat` runs). """
+    n = 1
+    while True:
+        dt = f(n)
+        if dt >= min_time:
+            break
+        # aim a bit above min_time
+        n = max(n * 2, int(n * 1.2 * min_time / max(dt, 1e-6)))
+    best = dt / n
+    for _ in range(repeat - 1):
+        best = min(best, f(n) / n)
+    return best
+
+
+def run_micro_benchmarks(pattern=None, min_time=MIN_TIME, repeat=REPEAT):
+    """
+        Runs the micro-benchmarks whose name matches the regular expression `pattern`.
+
+        Returns an OrderedDict name -> seconds per call.
+        The package logger is silenced meanwhile (the cost of the formatting remains).
+    """
+    res = OrderedDict()
+    level = dclogger.level
+    dclogger.setLevel(logging.WARNING)
+    try:
+        for name, f in get_micro_benchmarks().items():
+            if pattern is not None and not re.search(pattern, name):
+                continue
+            res[name] = measure(f, min_time=min_time, repeat=repeat)
+    finally:
+        dclogger.setLevel(level)
+    return res
+
+
+def read_baselines(fn=BASELINES_FN):
+    with open(fn) as f:
+        return json.load(f, object_pairs_hook=OrderedDict)
+
+
+def write_baselines(results, fn=BASELINES_FN):
+    data = OrderedDict()
+    data['python'] = platform.python_version()
+    data['machine'] = platform.machine()
+    data['results'] = results
+    with open(fn, 'w') as f:
+        json.dump(data, f, indent=2, separators=(',', ': '))
+        f.write('\n')
+
+
+def compare_to_baselines(results, baselines, threshold=DEFAULT_THRESHOLD):
+    """
+        Compares the results of run_micro_benchmarks() with the baselines (as in read_baselines()).
+
+        Returns a tuple (report, regressions), where regressions is the list of
+        the names of the benchmarks slower than the baseline by more than `threshold`.
+    """
+    base = baselines['results']
+    lines = ['baselines: Python %s on %s' % (baselines.get('python'), baselines.get('machine')),
+             '',
+             '%34s %12s %12s %7s' % ('benchmark', 'baseline', 'now', 'ratio')]
+    regressions = []
+    for name, seconds in results.items():
+        if name not in base:
+            lines.append('%34s %12s %10.2f us %7s' % (name, '-', seconds * 1e6, ''))
+            continue
+        ratio = seconds / base[name]
+        if ratio > threshold:
+            note = 'SLOWER'
+            regressions.append(name)
+        elif ratio < 1.0 / threshold:
+            note = 'faster'
+        else:
+            note = ''
+        lines.append('%34s %9.2f us %9.2f us %6.2fx  %s' % (name, base[name] * 1e6, seconds * 1e6, ratio, note))
+    return '\n'.join(lines), regressions
+
+
+def micro_benchmarks_main(args=None):
+    parser = argparse.ArgumentParser(prog='dt-challenges-microbench',
+                                     description='Micro-benchmarks of the challenge definitions, transitions '
+                                                 'and results, compared with stored baselines.')
+    parser.add_argument('--filter', default=None, help='Only run the benchmarks matching this regexp')
+    parser.add_argument('--baselines', default=BASELINES_FN, help='The baselines file')
+    parser.add_argument('--save-baselines', dest='save_baselines', action='store_true', default=False,
+                        help='Store the results as the new baselines')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='Report a regression if slower than the baseline by this factor')
+    parsed = parser.parse_args(args)
+
+    results = run_micro_benchmarks(pattern=parsed.filter)
+    if parsed.save_baselines:
+        write_baselines(results, parsed.baselines)
+        print('Baselines written to %s' % parsed.baselines)
+        return 0
+
+    report, regressions = compare_to_baselines(results, read_baselines(parsed.baselines),
+                                               threshold=parsed.threshold)
+    print(report)
+    if regressions:
+        print('\nSlower than the baselines: %s' % ', '.join(regressions))
+        return 1
+    return 0
@@ -0,0 +1,143 @@
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+from duckietown_challenges import runner_backends, runner_cache
+from duckietown_challenges.constants import ChallengeResultsStatus
+from duckietown_challenges.utils import friendly_size
+from .fake_server import FakeServer
+from .stub_backend import StubBackend
+from .synthetic_jobs import make_aws_config, make_jobs
+
+__all__ = ['run_evaluator_benchmark', 'benchmark_main']
+
+
+def get_peak_rss():
+    """ Peak resident set size of this process, in bytes. """
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on OS X
+    return r if sys.platform == 'darwin' else r * 1024
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = int(round((len(values) - 1) * p))
+    return values[k]
+
+
+def run_evaluator_benchmark(njobs=10, nartefacts=10, artefact_size=1024 * 1024, noutputs=5,
+                            output_size=1024 * 1024, container_seconds=0.0, shared_artefacts=False):
+    """
+        Runs `njobs` synthetic jobs through the evaluator (claim, download, run, upload, report),
+        against a FakeServer, a FileObjectStore and a StubBackend, in a temporary directory.
+
+        Returns a dict with the jobs per hour, the statistics of each phase, and the peak RSS.
+    """
+    from duckietown_challenges.runner import go_
+    from dt_shell.constants import DTShellConstants
+
+    d = tempfile.mkdtemp(prefix='dtc-benchmark-')
+    environ = dict(os.environ)
+    cache_dir_by_value = runner_cache.cache_dir_by_value
+    backend_name = runner_backends.backend_name
+    server = None
+    try:
+        # a token for get_token_from_shell_config()
+        home = os.path.join(d, 'home')
+        config_dir = os.path.expanduser(DTShellConstants.ROOT.replace('~', home))
+        os.makedirs(config_dir)
+        with open(os.path.join(config_dir, 'config'), 'w') as f:
+            json.dump({DTShellConstants.DT1_TOKEN_CONFIG_KEY: 'dt1-benchmark'}, f)
+        os.environ['HOME'] = home
+
+        runner_cache.cache_dir_by_value = os.path.join(d, 'cache', 'by-value', 'sha256hex')
+        runner_backends.set_backend('stub', StubBackend(container_seconds=container_seconds, noutputs=noutputs,
+                                                        output_size=output_size))
+        runner_backends.backend_name = 'stub'
+
+        aws_config = make_aws_config(os.path.join(d, 'objects'))
+        jobs = make_jobs(aws_config, njobs, nartefacts, artefact_size, shared_artefacts=shared_artefacts)
+        server = FakeServer(jobs).start()
+        os.environ['DTSERVER'] = server.url
+
+        t0 = time.time()
+        for _ in range(njobs):
+            go_(None, do_pull=False, more_features={}, do_upload=True, delete=True, reset=False,
+                evaluator_name='benchmark', machine_id='benchmark', tmpdir=os.path.join(d, 'executions'),
+                prune_networks=False)
+        elapsed = time.time() - t0
+    finally:
+        if server is not None:
+            server.stop()
+        os.environ.clear()
+        os.environ.update(environ)
+        runner_cache.cache_dir_by_value = cache_dir_by_value
+        runner_backends.backend_name = backend_name
+        shutil.rmtree(d)
+
+    statuses = [r['result'] for r in server.reports.values()]
+    failed = [s for s in statuses if s != ChallengeResultsStatus.SUCCESS]
+    if len(statuses) != njobs or failed:
+        msg = 'Expected %d successful jobs; got %d reports, with results %s' % (njobs, len(statuses), statuses)
+        raise Exception(msg)
+
+    phases = OrderedDict()
+    for job_id in sorted(server.reports):
+        for phase, seconds in server.reports[job_id]['stats']['timing'].items():
+            phases.setdefault(phase, []).append(seconds)
+
+    res = OrderedDict()
+    res['jobs'] = njobs
+    res['elapsed'] = elapsed
+    res['jobs_per_hour'] = njobs * 3600.0 / elapsed
+    res['peak_rss'] = get_peak_rss()
+    res['phases'] = OrderedDict()
+    for phase, values in phases.items():
+        res['phases'][phase] = OrderedDict([('mean', sum(values) / len(values)),
+                                            ('p50', percentile(values, 0.5)),
+                                            ('p95', percentile(values, 0.95)),
+                                            ('max', max(values))])
+    return res
+
+
+def format_results(res):
+    s = 'jobs:          %d in %.1f s\n' % (res['jobs'], res['elapsed'])
+    s += 'jobs/hour:     %.0f\n' % res['jobs_per_hour']
+    s += 'peak RSS:      %s\n' % friendly_size(res['peak_rss'])
+    s += '\n%15s %8s %8s %8s %8s\n' % ('phase (s)', 'mean', 'p50', 'p95', 'max')
+    for phase, stats in res['phases'].items():
+        s += '%15s %8.3f %8.3f %8.3f %8.3f\n' % (phase, stats['mean'], stats['p50'], stats['p95'], stats['max'])
+    return s
+
+
+def benchmark_main(args=None):
+    parser = argparse.ArgumentParser(prog='dt-challenges-benchmark',
+                                     description='Measures the overhead of the evaluator on synthetic jobs, '
+                                                 'with local stand-ins for the server, S3 and Docker.')
+    parser.add_argument('--jobs', type=int, default=10)
+    parser.add_argument('--artefacts', type=int, default=10, help='Artefacts downloaded by each job')
+    parser.add_argument('--artefact-size-kb', dest='artefact_size_kb', type=int, default=1024)
+    parser.add_argument('--outputs', type=int, default=5, help='Files produced (and uploaded) by each job')
+    parser.add_argument('--output-size-kb', dest='output_size_kb', type=int, default=1024)
+    parser.add_argument('--container-seconds', dest='container_seconds', type=float, default=0.0,
+                        help='Simulated run time of the containers')
+    parser.add_argument('--shared-artefacts', dest='shared_artefacts', action='store_true', default=False,
+                        help='All jobs use the same artefacts (cache hits after the first job)')
+    parser.add_argument('--output', default=None, help='Also write the results to this JSON file')
+    parsed = parser.parse_args(args)
+
+    res = run_evaluator_benchmark(njobs=parsed.jobs, nartefacts=parsed.artefacts,
+                                  artefact_size=parsed.artefact_size_kb * 1024, noutputs=parsed.outputs,
+                                  output_size=parsed.output_size_kb * 1024,
+                                  container_seconds=parsed.container_seconds,
+                                  shared_artefacts=parsed.shared_artefacts)
+    print(format_results(res))
+    if parsed.output:
+        with open(parsed.output, 'w') as f:
+            json.dump(res, f, indent=2)
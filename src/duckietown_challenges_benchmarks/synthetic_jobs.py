@@ -0,0 +1,56 @@
+import hashlib
+import io
+import os
+
+from duckietown_challenges.challenge import SUBMISSION_CONTAINER_TAG
+from duckietown_challenges.runner_s3 import FileObjectStore, get_object_key_by_value
+
+__all__ = ['make_aws_config', 'make_jobs']
+
+BUCKET_NAME = 'benchmark'
+
+
+def make_aws_config(root):
+    """ An aws_config for a FileObjectStore in `root`. """
+    return dict(local_root=root, bucket_name=BUCKET_NAME, path='evaluator', path_by_value='by-value',
+                aws_access_key_id='', aws_secret_access_key='')
+
+
+def make_artefact(store, aws_config, size):
+    data = os.urandom(size)
+    sha256hex = hashlib.sha256(data).hexdigest()
+    object_key = get_object_key_by_value(aws_config, sha256hex)
+    store.upload_fileobj(io.BytesIO(data), object_key)
+    storage = dict(s3=dict(bucket_name=store.bucket_name, object_key=object_key))
+    return dict(sha256hex=sha256hex, size=size, storage=storage)
+
+
+def make_jobs(aws_config, njobs, nartefacts, artefact_size, shared_artefacts=False):
+    """
+        Creates `njobs` jobs, as returned by the server, each with `nartefacts`
+        artefacts of `artefact_size` bytes from a previous step, stored in the object store.
+
+        If `shared_artefacts` is True, all jobs use the same artefacts
+        (so that after the first job they come from the cache).
+    """
+    store = FileObjectStore(aws_config, aws_config['bucket_name'])
+    challenge_parameters = {
+        'version': '3',
+        'services': {
+            'evaluator': {'image': 'benchmark/evaluator:latest', 'environment': {}},
+            'solution': {'image': SUBMISSION_CONTAINER_TAG, 'environment': {}},
+        }
+    }
+
+    artefacts = None
+    jobs = []
+    for i in range(njobs):
+        if artefacts is None or not shared_artefacts:
+            artefacts = dict(('file%d.bin' % k, make_artefact(store, aws_config, artefact_size))
+                             for k in range(nartefacts))
+        job = dict(job_id=i + 1, challenge_name='benchmark', step_name='step2', submission_id=i + 1,
+                   aws_config=aws_config, steps2artefacts={'step1': artefacts},
+                   parameters={'hash': 'benchmark/solution:latest'},
+                   challenge_parameters=challenge_parameters)
+        jobs.append(job)
+    return jobs
@@ -1,6 +1,21 @@
 from .read_challenge_definition import *
+from .test_benchmarks import *
+from .test_challenge_results import *
 from .test_interaction import *
 from .test_interaction_two_steps import *
+from .test_file_transfer import *
+from .test_file_waiting import *
+from .test_import_time import *
+from .test_runner_backends import *
+from .test_runner_cache import *
+from .test_runner_features import *
+from .test_runner_images import *
+from .test_runner_logs import *
+from .test_runner_metrics import *
+from .test_runner_pipeline import *
+from .test_runner_polling import *
+from .test_runner_timing import *
+from .test_yaml_utils import *
 
 
 def jobs_comptests(context):
@@ -1,3 +1,5 @@
+import copy
+
 import yaml
 from comptests import comptest, run_module_tests
 
@@ -161,6 +163,57 @@ def read_challenge_1():
     assert steps == [], steps
 
 
+@comptest
+def read_challenge_next_steps_batch():
+    c = ChallengeDescription.from_yaml(yaml.load(data))
+    statuses = [{'START': 'success'},
+                {'START': 'success', 'step1': 'success'},
+                {'START': 'success', 'step1': 'success', 'step2': 'aborted'},
+                {'START': 'success', 'step1': 'success', 'step2': 'success'},
+                {'START': 'success', 'step1': 'error', 'invalid': 'success'}]
+    res = c.get_next_steps_batch(statuses)
+    assert res == [c.get_next_steps(_) for _ in statuses], res
+    assert res == [(False, None, ['step1']),
+                   (False, None, ['step2']),
+                   (False, None, ['step2']),
+                   (True, 'success', []),
+                   (True, 'error', [])], res
+
+
+@comptest
+def canonical_hash_types():
+    from datetime import date
+    from duckietown_challenges.challenge import get_canonical_hash
+    assert get_canonical_hash({'a': [1, None]}) == get_canonical_hash({'a': [1, None]})
+    different = [{1: 'a'}, {'1': 'a'}, {True: 'a'}, {1.0: 'a'},
+                 {'d': date(2018, 1, 1)}, {'d': {'__type__': 'date', 'value': '2018-01-01'}}, {'d': '2018-01-01'},
+                 {'l': ['a', 'b']}, {'l': ['ab']}, {'l': 'ab'}, {'l': None}, {'l': 'None'}, {'l': ('a', 'b')}]
+    hashes = [get_canonical_hash(_) for _ in different]
+    assert len(set(hashes)) == len(different), hashes
+
+
+@comptest
+def read_challenge_cached():
+    c = ChallengeDescription.from_yaml_cached(data)
+    assert ChallengeDescription.from_yaml_cached(data) is c
+
+    d = yaml.load(data)
+    c2 = ChallengeDescription.from_yaml_cached(d)
+    assert 'steps' in d  # not consumed
+    assert ChallengeDescription.from_yaml_cached(yaml.load(data)) is c2
+    assert c2.as_dict() == c.as_dict()
+
+    assert_raises_s(TypeError, 'cannot be modified', setattr, c, 'title', 'new')
+    assert_raises_s(TypeError, 'cannot be modified', c.steps.pop, 'step1')
+    assert_raises_s(TypeError, 'cannot be modified', c.roles['user:AndreaCensi'].update, {'grant': False})
+
+    # copies can be modified
+    c3 = copy.deepcopy(c)
+    c3.title = 'new'
+    c3.steps.pop('step1')
+    assert len(c.get_steps()) == 2
+
+
 @comptest
 def empty_services():
     data = """
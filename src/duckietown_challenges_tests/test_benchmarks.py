@@ -0,0 +1,27 @@
+from comptests import comptest, run_module_tests
+
+from duckietown_challenges_benchmarks import run_evaluator_benchmark, run_micro_benchmarks, compare_to_baselines
+
+
+@comptest
+def test_evaluator_benchmark():
+    res = run_evaluator_benchmark(njobs=2, nartefacts=3, artefact_size=1000, noutputs=2, output_size=1000)
+    assert res['jobs'] == 2, res
+    assert res['jobs_per_hour'] > 0, res
+    for phase in ['claim', 'download', 'up', 'upload', 'total']:
+        assert phase in res['phases'], res
+
+
+@comptest
+def test_micro_benchmarks():
+    results = run_micro_benchmarks(pattern='results|equivalent', min_time=0.001, repeat=1)
+    assert list(results) == ['results_from_yaml', 'results_to_yaml', 'evaluation_parameters_equivalent'], results
+
+    baselines = {'results': {'results_from_yaml': results['results_from_yaml'] / 2}}
+    report, regressions = compare_to_baselines(results, baselines, threshold=1.5)
+    assert regressions == ['results_from_yaml'], report
+    assert 'SLOWER' in report, report
+
+
+if __name__ == '__main__':
+    run_module_tests()
@@ -0,0 +1,20 @@
+from comptests import comptest, run_module_tests
+
+from duckietown_challenges.challenge_results import ChallengeResults
+from duckietown_challenges.constants import ChallengeResultsStatus
+
+
+@comptest
+def test_challenge_results_stats():
+    # the evaluator cannot replace what the runner reports
+    evaluator_stats = {'scores': {'fake': 1}, 'msg': 'fake', 'cache': 'fake', 'frames': 100}
+    cr = ChallengeResults(ChallengeResultsStatus.SUCCESS, 'ok', {'score': 1.0}, evaluator_stats)
+    stats = cr.get_stats(cache={'hits': 1}, timing={'up': 2.0})
+    assert list(stats) == ['scores', 'msg', 'cache', 'timing', 'frames'], stats
+    assert stats['scores'] == {'score': 1.0} and stats['msg'] == 'ok', stats
+    assert stats['cache'] == {'hits': 1} and stats['timing'] == {'up': 2.0}, stats
+    assert stats['frames'] == 100, stats
+
+
+if __name__ == '__main__':
+    run_module_tests()
@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+from StringIO import StringIO
+
+from comptests import comptest, run_module_tests
+
+from duckietown_challenges.cie_concrete import FS
+from duckietown_challenges.file_transfer import fast_copy, get_libc
+
+
+@comptest
+def test_fs_write():
+    d = tempfile.mkdtemp()
+    try:
+        tmp = os.path.join(d, 'tmp')
+        os.mkdir(tmp)
+        keep = os.path.join(d, 'keep.txt')
+        move = os.path.join(tmp, 'move.txt')
+        for fn in [keep, move]:
+            with open(fn, 'w') as f:
+                f.write(os.path.basename(fn))
+
+        fs = FS()
+        fs.add('a/keep.txt', keep, None)
+        fs.add('move.txt', move, None)
+        fs.add_from_data('data.txt', 'data', None)
+        out = os.path.join(d, 'out')
+        fs.write(out, movable_dirs=[tmp])
+
+        for basename, contents in [('a/keep.txt', 'keep.txt'), ('move.txt', 'move.txt'), ('data.txt', 'data')]:
+            with open(os.path.join(out, basename)) as f:
+                assert f.read() == contents, basename
+        assert os.path.exists(keep)
+
+        dst = os.path.join(d, 'copy.txt')
+        os.chmod(keep, 0o640)
+        method = fast_copy(keep, dst)
+        assert method in ['copy_file_range', 'sendfile', 'copy'], method
+        assert open(dst).read() == 'keep.txt'
+        assert os.stat(dst).st_mode & 0o777 == 0o640
+    finally:
+        shutil.rmtree(d)
+
+
+@comptest
+def test_fast_copy():
+    d = tempfile.mkdtemp()
+    try:
+        src = os.path.join(d, 'src')
+        data = os.urandom(3 * 1024 * 1024 + 17)
+        with open(src, 'wb') as f:
+            f.write(data)
+        dst = os.path.join(d, 'dst')
+        # overwrites a longer file
+        with open(dst, 'wb') as f:
+            f.write(b'x' * (4 * 1024 * 1024))
+        method = fast_copy(src, dst)
+        if get_libc() is not None:
+            # the copy is done by the kernel
+            assert method in ['copy_file_range', 'sendfile'], method
+        with open(dst, 'rb') as f:
+            assert f.read() == data
+
+        empty = os.path.join(d, 'empty')
+        open(empty, 'wb').close()
+        fast_copy(empty, dst)
+        assert os.path.getsize(dst) == 0
+    finally:
+        shutil.rmtree(d)
+
+
+@comptest
+def test_fs_add_from_data():
+    d = tempfile.mkdtemp()
+    try:
+        out = os.path.join(d, 'out')
+        fs = FS(dest=out)
+        fs.add_from_data('bytes.txt', b'abc', None)
+        fs.add_from_data('unicode.txt', u'\xe9', None)
+        fs.add_from_data('chunks.txt', ('%d\n' % i for i in range(3)), None)
+        fs.add_from_data('sub/file.txt', StringIO('x' * 10000), None)
+        # written right away
+        assert sorted(os.listdir(out)) == ['bytes.txt', 'chunks.txt', 'sub', 'unicode.txt']
+        fs.write(out)
+
+        # without a destination, they are written when write() is called
+        fs2 = FS()
+        fs2.add_from_data('later.txt', 'later', None)
+        spool_dir = fs2.spool_dir
+        assert os.path.exists(spool_dir)
+        out2 = os.path.join(d, 'out2')
+        fs2.write(out2)
+        # the temporary directory is removed
+        assert not os.path.exists(spool_dir)
+
+        expected = [(out, 'bytes.txt', 'abc'), (out, 'unicode.txt', '\xc3\xa9'), (out, 'chunks.txt', '0\n1\n2\n'),
+                    (out, 'sub/file.txt', 'x' * 10000), (out2, 'later.txt', 'later')]
+        for dirname, basename, contents in expected:
+            with open(os.path.join(dirname, basename), 'rb') as f:
+                assert f.read() == contents, basename
+    finally:
+        shutil.rmtree(d)
+
+
+if __name__ == '__main__':
+    run_module_tests()
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from comptests import comptest, run_module_tests
+
+from duckietown_challenges.file_waiting import wait_for_path, get_libc
+
+
+def time_wait_for_path(fn, create):
+    """
+        Calls create() in a thread while waiting for `fn`. The polling interval is longer
+        than the timeout, so `fn` is only seen quickly if we are woken up by inotify.
+
+        Returns the seconds taken.
+    """
+
+    def delayed():
+        time.sleep(0.2)
+        create()
+
+    t = threading.Thread(target=delayed)
+    t.start()
+    t0 = time.time()
+    try:
+        assert wait_for_path(fn, timeout=60, poll_interval=60)
+        return time.time() - t0
+    finally:
+        t.join()
+
+
+def write(fn):
+    with open(fn, 'w') as f:
+        f.write('x')
+
+
+@comptest
+def test_wait_for_path():
+    d = tempfile.mkdtemp()
+    try:
+        fn = os.path.join(d, 'output.yaml')
+        if get_libc() is not None:
+            dt = time_wait_for_path(fn, lambda: write(fn))
+            assert dt < 1, dt
+
+        assert not wait_for_path(os.path.join(d, 'missing'), timeout=0.3, poll_interval=0.1)
+    finally:
+        shutil.rmtree(d)
+
+
+@comptest
+def test_wait_for_path_parents_created_later():
+    d = tempfile.mkdtemp()
+    try:
+        # the parent directories are created after the wait starts
+        fn = os.path.join(d, 'a', 'b', 'output.yaml')
+
+        def create():
+            os.mkdir(os.path.join(d, 'a'))
+            time.sleep(0.1)
+            os.mkdir(os.path.join(d, 'a', 'b'))
+            time.sleep(0.1)
+            write(fn)
+
+        if get_libc() is not None:
+            dt = time_wait_for_path(fn, create)
+            assert dt < 1, dt
+    finally:
+        shutil.rmtree(d)
+
+
+if __name__ == '__main__':
+    run_module_tests()
@@ -0,0 +1,44 @@
+import json
+import subprocess
+import sys
+
+from comptests import comptest, run_module_tests
+
+# Importing the package (what solutions and evaluators do) should take less than this.
+IMPORT_TIME_BUDGET_SECONDS = 0.25
+
+# Modules that must not be loaded by "import duckietown_challenges".
+HEAVY_MODULES = ['duckietown_challenges.runner', 'duckietown_challenges.make_readmes', 'dt_shell', 'docker', 'boto3',
+                 'psutil', 'yaml', 'ansi2html']
+
+SCRIPT = """
+import json, sys, time
+t0 = time.time()
+import duckietown_challenges
+from duckietown_challenges import wrap_solution, wrap_evaluator
+dt = time.time() - t0
+loaded = [k for k, v in sys.modules.items() if v is not None]
+print(json.dumps(dict(dt=dt, loaded=loaded)))
+"""
+
+
+def measure_import():
+    out = subprocess.check_output([sys.executable, '-c', SCRIPT], stderr=subprocess.STDOUT)
+    line = [_ for _ in out.decode('utf-8').split('\n') if _.startswith('{')][-1]
+    return json.loads(line)
+
+
+@comptest
+def test_import_time():
+    # the best of a few tries, to be robust to a busy machine
+    results = [measure_import() for _ in range(3)]
+    loaded = results[0]['loaded']
+    heavy = [m for m in HEAVY_MODULES if m in loaded]
+    assert not heavy, 'These modules should be imported lazily: %s' % heavy
+
+    dt = min(_['dt'] for _ in results)
+    assert dt < IMPORT_TIME_BUDGET_SECONDS, 'Importing took %.3f s (budget: %s s)' % (dt, IMPORT_TIME_BUDGET_SECONDS)
+
+
+if __name__ == '__main__':
+    run_module_tests()
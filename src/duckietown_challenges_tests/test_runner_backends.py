@@ -0,0 +1,212 @@
+import os
+import shutil
+import tempfile
+
+import yaml
+from comptests import comptest, run_module_tests
+
+from duckietown_challenges.runner_backends import DockerSDKBackend, DockerComposeFail, COMPOSE_FILE, \
+    LABEL_PROJECT, LABEL_SERVICE
+
+
+class FakeEvents(object):
+    """ The 'die' events: the first container started exits. """
+
+    def __init__(self, api):
+        self.api = api
+        self.closed = False
+
+    def __iter__(self):
+        for container_id in list(self.api.started):
+            self.api.running.discard(container_id)
+            yield dict(id=container_id)
+
+    def close(self):
+        self.closed = True
+
+
+class FakeImages(object):
+    def __init__(self, api):
+        self.api = api
+        self.pulled = []
+
+    def pull(self, repository, tag=None):
+        self.pulled.append((repository, tag))
+        self.api.local_images.add('%s:%s' % (repository, tag))
+
+
+class FakeAPI(object):
+    """ Implements the part of docker.APIClient used by DockerSDKBackend. """
+
+    def __init__(self, local_images, fail_create=()):
+        self.local_images = set(local_images)
+        self.fail_create = fail_create
+        self.networks_ = {}  # id -> dict(name, labels)
+        self.containers_ = {}  # id -> dict(image, name, environment, labels, networks)
+        self.started = []
+        self.running = set()
+        self.stopped = []
+
+    def create_network(self, name, driver, labels):
+        self.networks_['n%d' % len(self.networks_)] = dict(name=name, labels=labels)
+
+    def create_endpoint_config(self, aliases):
+        return dict(aliases=aliases)
+
+    def create_networking_config(self, endpoints):
+        return endpoints
+
+    def create_host_config(self, binds, network_mode):
+        return dict(binds=binds, network_mode=network_mode)
+
+    def create_container(self, image, name, environment, volumes, labels, host_config, networking_config,
+                         detach):
+        from docker.errors import ImageNotFound, APIError
+        if image not in self.local_images:
+            raise ImageNotFound('No such image: %s' % image)
+        if labels[LABEL_SERVICE] in self.fail_create:
+            raise APIError('cannot create %s' % name)
+        container_id = 'c%d' % len(self.containers_)
+        self.containers_[container_id] = dict(image=image, name=name, environment=environment, labels=labels,
+                                              networks=list(networking_config))
+        return dict(Id=container_id)
+
+    def connect_container_to_network(self, container_id, network, aliases):
+        self.containers_[container_id]['networks'].append(network)
+
+    def events(self, since, filters, decode):
+        return FakeEvents(self)
+
+    def start(self, container_id):
+        self.started.append(container_id)
+        self.running.add(container_id)
+
+    def inspect_container(self, container_id):
+        return dict(State=dict(Running=container_id in self.running, ExitCode=0))
+
+    def stop(self, container_id, timeout):
+        self.stopped.append(container_id)
+        self.running.discard(container_id)
+
+    @staticmethod
+    def _matches(labels, filters):
+        for f in filters:
+            k, v = f.split('=', 1)
+            if labels.get(k) != v:
+                return False
+        return True
+
+    def containers(self, all, quiet, filters):
+        return [dict(Id=k) for k, c in sorted(self.containers_.items()) if self._matches(c['labels'],
+                                                                                          filters['label'])]
+
+    def remove_container(self, container_id, force):
+        del self.containers_[container_id]
+
+    def networks(self, filters):
+        return [dict(Id=k) for k, n in sorted(self.networks_.items()) if self._matches(n['labels'],
+                                                                                        [filters['label']])]
+
+    def remove_network(self, network_id):
+        del self.networks_[network_id]
+
+
+class FakeClient(object):
+    def __init__(self, local_images, fail_create=()):
+        self.api = FakeAPI(local_images, fail_create)
+        self.images = FakeImages(self.api)
+
+
+def write_config(d):
+    evaluator = dict(image='org/evaluator:1', environment=dict(a=1, b=u'tr\xe9s'),
+                     volumes=['./challenge-results:/challenge-results'],
+                     networks=dict(evaluation=dict(aliases=['evaluation'])))
+    solution = dict(image='org/solution:2', networks=dict(evaluation=None, other=None))
+    config = dict(version='3', services=dict(evaluator=evaluator, solution=solution),
+                  networks=dict(evaluation=None, other=None))
+    with open(os.path.join(d, COMPOSE_FILE), 'w') as f:
+        yaml.safe_dump(config, f)
+
+
+def check_validate(config):
+    d = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(d, COMPOSE_FILE), 'w') as f:
+            yaml.safe_dump(config, f)
+        DockerSDKBackend(client=object()).validate(d, 'project')
+    finally:
+        shutil.rmtree(d)
+
+
+@comptest
+def test_sdk_backend_validate():
+    service = dict(image='alpine:3.8', environment=dict(a=1),
+                   volumes=['./challenge-results:/challenge-results'],
+                   networks=dict(evaluation=dict(aliases=['evaluation'])))
+    config = dict(version='3', services=dict(evaluator=service), networks=dict(evaluation=None))
+    check_validate(config)
+
+    for extra in [dict(ports=['80:80']), dict(networks=dict(other=None))]:
+        s2 = dict(service)
+        s2.update(extra)
+        try:
+            check_validate(dict(version='3', services=dict(evaluator=s2), networks=dict(evaluation=None)))
+        except DockerComposeFail:
+            pass
+        else:
+            raise Exception(extra)
+
+
+@comptest
+def test_sdk_backend_up_down():
+    d = tempfile.mkdtemp()
+    try:
+        write_config(d)
+        # the solution image is missing: it is pulled
+        client = FakeClient(local_images=['org/evaluator:1'])
+        api = client.api
+        backend = DockerSDKBackend(client=client)
+        backend.up(d, 'p1')
+
+        assert client.images.pulled == [('org/solution', '2')], client.images.pulled
+        assert sorted(n['name'] for n in api.networks_.values()) == ['p1_evaluation', 'p1_other']
+        containers = dict((c['labels'][LABEL_SERVICE], c) for c in api.containers_.values())
+        evaluator = containers['evaluator']
+        assert evaluator['name'] == 'p1_evaluator_1', evaluator
+        assert evaluator['labels'][LABEL_PROJECT] == 'p1', evaluator
+        assert evaluator['environment'] == dict(a='1', b=u'tr\xe9s'), evaluator
+        assert sorted(containers['solution']['networks']) == ['p1_evaluation', 'p1_other'], containers
+        # all started; once one exited, the other one was stopped
+        assert len(api.started) == 2 and len(api.stopped) == 1, (api.started, api.stopped)
+
+        solution_id = [k for k, c in api.containers_.items() if c['labels'][LABEL_SERVICE] == 'solution'][0]
+        assert backend.get_container_id(d, 'p1', 'solution') == solution_id
+
+        backend.down(d, 'p1')
+        assert not api.containers_ and not api.networks_, (api.containers_, api.networks_)
+    finally:
+        shutil.rmtree(d)
+
+
+@comptest
+def test_sdk_backend_up_cleans_up():
+    d = tempfile.mkdtemp()
+    try:
+        write_config(d)
+        # a container cannot be created: the networks and the other containers are removed
+        client = FakeClient(local_images=['org/evaluator:1', 'org/solution:2'], fail_create=['solution'])
+        try:
+            DockerSDKBackend(client=client).up(d, 'p1')
+        except DockerComposeFail:
+            pass
+        else:
+            raise Exception()
+        assert not client.api.containers_ and not client.api.networks_, (client.api.containers_,
+                                                                         client.api.networks_)
+        assert not client.api.started
+    finally:
+        shutil.rmtree(d)
+
+
+if __name__ == '__main__':
+    run_module_tests()
@@ -0,0 +1,187 @@
+import os
+import shutil
+import tempfile
+
+from comptests import comptest, run_module_tests
+
+from duckietown_challenges import runner_cache
+from duckietown_challenges.runner import upload, upload_files
+from duckietown_challenges.runner_cache import copy_to_cache, get_file_from_cache, materialize, evict, \
+    get_cache_index, JobCacheStats
+from duckietown_challenges.utils import map_threads
+
+
+def with_tmp_cache(f):
+    def f2():
+        d = tempfile.mkdtemp()
+        cache_dir_by_value = runner_cache.cache_dir_by_value
+        runner_cache.cache_dir_by_value = os.path.join(d, 'cache')
+        try:
+            return f(d)
+        finally:
+            runner_cache.cache_dir_by_value = cache_dir_by_value
+            shutil.rmtree(d)
+
+    f2.__name__ = f.__name__
+    return f2
+
+
+@comptest
+@with_tmp_cache
+def test_cache_roundtrip(d):
+    fn = os.path.join(d, 'a')
+    with open(fn, 'w') as f:
+        f.write('contents')
+    copy_to_cache(fn, 'h1')
+
+    fn2 = os.path.join(d, 'b')
+    get_file_from_cache(fn2, 'h1')
+    with open(fn2) as f:
+        assert f.read() == 'contents'
+
+    # the files going in and out stay writable, with the default permissions;
+    # the cache entry does not share the inode with them
+    entry = os.path.join(runner_cache.cache_dir_by_value, 'h1')
+    assert os.stat(entry).st_mode & 0o777 == 0o444, oct(os.stat(entry).st_mode)
+    assert os.stat(fn).st_mode & 0o777 == os.stat(fn2).st_mode & 0o777, (oct(os.stat(fn).st_mode),
+                                                                         oct(os.stat(fn2).st_mode))
+    for f in [fn, fn2]:
+        assert os.stat(f).st_mode & 0o200, oct(os.stat(f).st_mode)
+        with open(f, 'w') as fo:
+            fo.write('modified')
+    fn3 = os.path.join(d, 'c')
+    get_file_from_cache(fn3, 'h1')
+    with open(fn3) as f:
+        assert f.read() == 'contents'
+
+    try:
+        get_file_from_cache(fn2, 'h2')
+    except KeyError:
+        pass
+    else:
+        raise Exception()
+
+
+@comptest
+@with_tmp_cache
+def test_cache_concurrent_adds(d):
+    fns = []
+    for i in range(8):
+        fn = os.path.join(d, 'f%d' % i)
+        with open(fn, 'w') as f:
+            f.write('contents' * 200000)
+        fns.append(fn)
+
+    # all the threads add the same entry at the same time
+    map_threads(lambda fn: copy_to_cache(fn, 'h1'), fns * 4, 16)
+
+    assert os.listdir(runner_cache.cache_dir_by_value) == ['h1']
+    fn2 = os.path.join(d, 'b')
+    get_file_from_cache(fn2, 'h1')
+    with open(fn2) as f:
+        assert f.read() == 'contents' * 200000
+
+
+@comptest
+@with_tmp_cache
+def test_materialize_replaces(d):
+    fn = os.path.join(d, 'a')
+    with open(fn, 'w') as f:
+        f.write('new')
+    fn2 = os.path.join(d, 'b')
+    with open(fn2, 'w') as f:
+        f.write('old')
+    method = materialize(fn, fn2)
+    assert method in ['reflink', 'copy_file_range', 'sendfile', 'copy'], method
+    with open(fn2) as f:
+        assert f.read() == 'new'
+
+
+@comptest
+@with_tmp_cache
+def test_cache_eviction(d):
+    for i in range(4):
+        fn = os.path.join(d, 'f%d' % i)
+        with open(fn, 'w') as f:
+            f.write('x' * 100)
+        copy_to_cache(fn, 'h%d' % i, origin='test')
+
+    job_stats = JobCacheStats()
+    # h0 becomes the most recently used
+    get_file_from_cache(os.path.join(d, 'g0'), 'h0', job_stats=job_stats)
+    try:
+        get_file_from_cache(os.path.join(d, 'g9'), 'h9', job_stats=job_stats)
+    except KeyError:
+        pass
+    job = job_stats.as_dict()
+    assert job['hits'] == 1 and job['misses'] == 1 and job['bytes_local'] == 100, job
+
+    index = get_cache_index()
+    entry = index.get_entry('h0')
+    assert entry['hits'] == 1 and entry['origin'] == 'test', entry
+    stats = index.get_stats()
+    assert stats['entries'] == 4, stats
+    assert stats['size'] == 400, stats
+    assert stats['hits'] == 1 and stats['misses'] == 1, stats
+    assert stats['bytes_saved'] == 100, stats
+
+    freed = evict(250, policy='lru')
+    assert freed == 200, freed
+    cached = sorted(os.listdir(runner_cache.cache_dir_by_value))
+    assert cached == ['h0', 'h3'], cached
+    assert index.get_total_size() == 200
+
+
+@comptest
+@with_tmp_cache
+def test_upload(d):
+    toupload = {}
+    for rpath, contents in [('a.txt', 'same'), ('sub/b.txt', 'same'), ('c.txt', 'other')]:
+        fn = os.path.join(d, 'wd', rpath)
+        if not os.path.exists(os.path.dirname(fn)):
+            os.makedirs(os.path.dirname(fn))
+        with open(fn, 'w') as f:
+            f.write(contents)
+        toupload[rpath] = fn
+    aws_config = dict(bucket_name='bucket', path_by_value='by-value', local_root=os.path.join(d, 'store'))
+
+    uploaded = upload(aws_config, toupload, nworkers=2)
+    assert sorted(_['rpath'] for _ in uploaded) == ['a.txt', 'c.txt', 'sub/b.txt'], uploaded
+    # one object per distinct hash
+    objects = os.listdir(os.path.join(d, 'store', 'bucket', 'by-value', 'sha256'))
+    assert len(objects) == 2, objects
+    for u in uploaded:
+        assert u['sha256hex'] in objects
+        with open(toupload[u['rpath']]) as f:
+            contents = f.read()
+        with open(os.path.join(d, 'store', 'bucket', u['storage']['s3']['object_key'])) as f:
+            assert f.read() == contents
+
+    # the outputs are also in the local cache
+    for u in uploaded:
+        entry = get_cache_index().get_entry(u['sha256hex'])
+        assert entry['origin'].startswith('output:'), entry
+
+    # uploading again finds the objects already there
+    uploaded2 = upload(aws_config, toupload, nworkers=2)
+    assert [_['sha256hex'] for _ in uploaded2] == [_['sha256hex'] for _ in uploaded]
+
+
+@comptest
+@with_tmp_cache
+def test_upload_files_exclude(d):
+    wd = os.path.join(d, 'wd')
+    os.makedirs(os.path.join(wd, 'sub'))
+    for rpath in ['log-x.html', 'sub/log-x.html', 'other.txt']:
+        with open(os.path.join(wd, rpath), 'w') as f:
+            f.write(rpath)
+
+    # only the exact relative paths are excluded, not other files with the same name
+    uploaded = upload_files(wd, None, exclude=['log-x.html'])
+    assert sorted(_['rpath'] for _ in uploaded) == ['other.txt', 'sub/log-x.html'], uploaded
+    uploaded = upload_files(wd, None, only=['log-x.html'])
+    assert [_['rpath'] for _ in uploaded] == ['log-x.html'], uploaded
+
+
+if __name__ == '__main__':
+    run_module_tests()
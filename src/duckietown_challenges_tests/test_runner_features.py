@@ -0,0 +1,25 @@
+import time
+
+from comptests import comptest, run_module_tests
+
+from duckietown_challenges.runner import get_features
+from duckietown_challenges.runner_features import FeatureProvider
+
+
+@comptest
+def test_feature_provider():
+    fp = FeatureProvider(refresh_interval=0.05)
+    f1 = fp.get_features()
+    for k in ['nprocessors', 'ram_total_mb', 'ram_available_mb', 'processor_free_percent', 'disk_available_mb']:
+        assert k in f1, k
+    f1['nprocessors'] = -1
+    time.sleep(0.2)
+    f2 = fp.get_features()
+    assert f2['nprocessors'] > 0
+
+    features = get_features(dict(nprocessors=1, map_3x3=True))
+    assert features['nprocessors'] == 1 and features['map_3x3'], features
+
+
+if __name__ == '__main__':
+    run_module_tests()
@@ -0,0 +1,49 @@
+from comptests import comptest, run_module_tests
+
+from duckietown_challenges.runner_images import ImageManager, RequiredImage
+
+
+class FakeImage(object):
+    def __init__(self, id_, repo_digests):
+        self.id = id_
+        self.attrs = dict(RepoDigests=repo_digests)
+
+
+class FakeImages(object):
+    def __init__(self, local):
+        self.local = local
+        self.pulled = []
+
+    def get(self, name):
+        from docker.errors import ImageNotFound
+        if name not in self.local:
+            raise ImageNotFound(name)
+        return self.local[name]
+
+    def pull(self, repository, tag=None):
+        self.pulled.append((repository, tag))
+
+
+class FakeClient(object):
+    def __init__(self, local):
+        self.images = FakeImages(local)
+
+
+@comptest
+def test_image_manager_skips_present():
+    local = {'a:1': FakeImage('sha256:aaa', ['a@sha256:ra']),
+             'b:1': FakeImage('sha256:bbb', [])}
+    client = FakeClient(local)
+    im = ImageManager(client)
+    required = [RequiredImage('a:1', 'sha256:ra'),  # present, by repo digest
+                RequiredImage('b:1', 'sha256:bbb'),  # present, by id
+                RequiredImage('b:1', 'sha256:new'),  # different digest
+                RequiredImage('c:2', None),  # no digest: always pulled
+                RequiredImage('d', 'sha256:ddd')]  # missing
+    pulled = im.ensure(required)
+    assert pulled == ['b:1', 'c:2', 'd'], pulled
+    assert sorted(client.images.pulled) == [('b', '1'), ('c', '2'), ('d', 'latest')], client.images.pulled
+
+
+if __name__ == '__main__':
+    run_module_tests()
@@ -0,0 +1,95 @@
+import gzip
+import io
+import os
+import shutil
+import tempfile
+
+from comptests import comptest, run_module_tests
+
+from duckietown_challenges.runner_logs import LogSink, render_log_html, read_pieces, HTML_CHUNK_BYTES
+
+
+@comptest
+def test_log_sink():
+    d = tempfile.mkdtemp()
+    try:
+        fn = os.path.join(d, 'log.txt')
+        with LogSink(fn, max_bytes=None) as sink:
+            for i in range(100):
+                sink.write('line %d\n' % i)
+        with open(fn) as f:
+            data = f.read()
+        assert data == ''.join('line %d\n' % i for i in range(100))
+        assert not sink.truncated
+
+        # capped: the beginning and the end are kept
+        fn = os.path.join(d, 'log2.txt.gz')
+        with LogSink(fn, max_bytes=50, compress=True, tail_bytes=20) as sink:
+            for i in range(100):
+                sink.write('line %02d\n' % i)
+        assert sink.truncated
+        assert sink.get_tail() == 'line 97\nline 98\nline 99\n'[-20:]
+        f = gzip.open(fn)
+        data = f.read()
+        f.close()
+        assert data.startswith('line 00\nline 01\nline 02\nline 03\nline 04\nline 05\n\n'), data
+        assert 'bytes skipped' in data
+        assert data.endswith('line 99\n'), data
+        assert 'line 06' not in data and 'line 96' not in data
+    finally:
+        shutil.rmtree(d)
+
+
+@comptest
+def test_render_log_html():
+    d = tempfile.mkdtemp()
+    try:
+        fn = os.path.join(d, 'log.txt')
+        with open(fn, 'w') as f:
+            for i in range(1000):
+                f.write('\x1b[31mline %03d\x1b[0m <%d>\n' % (i, i))
+        fn_html = os.path.join(d, 'log.html')
+        render_log_html(fn, fn_html, max_bytes=2000)
+        with open(fn_html) as f:
+            html = f.read()
+        assert html.startswith('<!DOCTYPE'), html[:100]
+        assert 'line 000' in html and 'line 999' in html
+        assert 'line 500' not in html
+        assert 'bytes not shown here' in html
+        assert '&lt;999&gt;' in html and 'ansi31' in html
+    finally:
+        shutil.rmtree(d)
+
+
+@comptest
+def test_read_pieces():
+    data = b'a\n' + b'b' * 25 + b'\nc\nd'
+    pieces = list(read_pieces(io.BytesIO(data), block_size=10))
+    assert b''.join(pieces) == data
+    assert all(len(_) <= 20 for _ in pieces), pieces
+    # the pieces end at a newline unless a line is longer than the block
+    assert pieces[0] == b'a\n', pieces
+    assert pieces[-1] == b'd', pieces
+
+
+@comptest
+def test_render_log_html_long_line():
+    d = tempfile.mkdtemp()
+    try:
+        # a log without newlines, longer than the blocks
+        fn = os.path.join(d, 'log.txt')
+        with open(fn, 'w') as f:
+            f.write('x' * (3 * HTML_CHUNK_BYTES) + 'END')
+        fn_html = os.path.join(d, 'log.html')
+        render_log_html(fn, fn_html, max_bytes=2000)
+        with open(fn_html) as f:
+            html = f.read()
+        assert html.count('x') < 3000, html.count('x')
+        assert 'END' in html
+        assert '%d bytes not shown' % (3 * HTML_CHUNK_BYTES + 3 - 2000) in html
+    finally:
+        shutil.rmtree(d)
+
+
+if __name__ == '__main__':
+    run_module_tests()
@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+
+from comptests import comptest, run_module_tests
+
+from duckietown_challenges.runner_metrics import MetricsRegistry
+from duckietown_challenges.runner_polling import PollScheduler
+
+
+@comptest
+def test_metrics_render():
+    registry = MetricsRegistry()
+    registry.inc('dtc_jobs_claimed_total')
+    registry.record_job('success', {'download': 0.3, 'up': 42.0},
+                        dict(hits=3, misses=1, bytes_local=300, bytes_downloaded=100))
+    scheduler = PollScheduler(initial_interval=5, max_interval=60)
+    scheduler.on_nothing_left(0.1)
+    registry.register_scheduler('w0', scheduler)
+
+    s = registry.render()
+    lines = s.split('\n')
+    assert 'dtc_jobs_claimed_total 1.0' in lines, s
+    assert 'dtc_jobs_finished_total{result="success"} 1.0' in lines, s
+    assert 'dtc_job_phase_seconds_bucket{phase="download",le="0.5"} 1' in lines, s
+    assert 'dtc_job_phase_seconds_bucket{phase="up",le="30.0"} 0' in lines, s
+    assert 'dtc_job_phase_seconds_bucket{phase="up",le="+Inf"} 1' in lines, s
+    assert 'dtc_job_phase_seconds_count{phase="up"} 1' in lines, s
+    assert 'dtc_cache_hit_ratio 0.75' in lines, s
+    assert 'dtc_polls_total{outcome="empty",worker="w0"} 1.0' in lines, s
+    assert '# TYPE dtc_poll_interval_seconds gauge' in lines, s
+
+    d = tempfile.mkdtemp()
+    try:
+        fn = os.path.join(d, 'evaluator.prom')
+        registry.write_textfile(fn)
+        with open(fn) as f:
+            assert 'dtc_upload_bytes_total' in f.read()
+        assert os.listdir(d) == ['evaluator.prom']
+    finally:
+        shutil.rmtree(d)
+
+
+if __name__ == '__main__':
+    run_module_tests()
@@ -0,0 +1,27 @@
+from comptests import comptest, run_module_tests
+
+from duckietown_challenges import runner_pipeline
+from duckietown_challenges.runner_pipeline import pipeline_loop, PrepareFailed
+from duckietown_challenges.runner_polling import PollScheduler
+
+
+@comptest
+def test_pipeline_prepare_fails():
+    # if the prepare thread dies, the loop exits instead of waiting forever
+    def claim_next(args, scheduler):
+        raise ValueError('claim failed')
+
+    original = runner_pipeline.claim_next
+    runner_pipeline.claim_next = claim_next
+    try:
+        pipeline_loop({}, PollScheduler(initial_interval=1, max_interval=1))
+    except PrepareFailed as e:
+        assert 'claim failed' in str(e), e
+    else:
+        raise Exception()
+    finally:
+        runner_pipeline.claim_next = original
+
+
+if __name__ == '__main__':
+    run_module_tests()
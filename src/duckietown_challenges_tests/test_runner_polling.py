@@ -0,0 +1,24 @@
+from comptests import comptest, run_module_tests
+
+from duckietown_challenges.runner_polling import PollScheduler
+
+
+@comptest
+def test_poll_backoff():
+    s = PollScheduler(initial_interval=1.0, max_interval=3.0, factor=2.0, jitter=0.0)
+    waits = [s.on_nothing_left(0.5) for _ in range(4)]
+    assert waits == [1.0, 2.0, 3.0, 3.0], waits
+    assert s.on_error() == 3.0
+
+    stats = s.get_stats()
+    assert stats['polls'] == 5 and stats['polls_empty'] == 4 and stats['polls_error'] == 1, stats
+    assert stats['idle_seconds_current'] == 2.0, stats
+
+    assert s.on_job() == 0.0
+    assert s.get_current_interval() == 1.0
+    stats = s.get_stats()
+    assert stats['jobs'] == 1 and stats['idle_seconds_current'] == 0.0 and stats['idle_seconds'] == 2.0, stats
+
+
+if __name__ == '__main__':
+    run_module_tests()
@@ -0,0 +1,28 @@
+import time
+
+from comptests import comptest, run_module_tests
+
+from duckietown_challenges.runner_timing import PhaseTimer
+
+
+@comptest
+def test_phase_timer():
+    timer = PhaseTimer()
+    with timer.phase('download'):
+        time.sleep(0.01)
+    try:
+        with timer.phase('up'):
+            raise ValueError()
+    except ValueError:
+        pass
+    with timer.phase('download'):
+        time.sleep(0.01)
+
+    timing = timer.as_dict()
+    assert list(timing) == ['download', 'up', 'total'], timing
+    assert timing['download'] >= 0.02, timing
+    assert timing['total'] >= timing['download'], timing
+
+
+if __name__ == '__main__':
+    run_module_tests()
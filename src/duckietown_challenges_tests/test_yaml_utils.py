@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+
+from comptests import comptest, run_module_tests
+
+from duckietown_challenges.yaml_utils import read_yaml_file, write_yaml, encode_data, decode_data, \
+    ENCODING_YAML, ENCODING_JSON, ENCODING_MSGPACK, MSGPACK_MAGIC
+
+
+@comptest
+def test_protocol_encodings():
+    d = tempfile.mkdtemp()
+    try:
+        data = OrderedDict([('status', 'success'), ('msg', None), ('scores', {'lf': 91.5, 'n': 3}),
+                            ('list', [1, 'two', u'tr\xe9s'])])
+        for encoding in [ENCODING_YAML, ENCODING_JSON, ENCODING_MSGPACK]:
+            fn = os.path.join(d, 'data-%s.yaml' % encoding)
+            write_yaml(data, fn, encoding=encoding)
+            data2 = read_yaml_file(fn)
+            assert list(data2) == list(data), (encoding, data2)
+            assert dict(data2) == dict(data), (encoding, data2)
+            # the ASCII strings are str, as when reading YAML
+            assert all(type(_) is str for _ in data2), (encoding, data2)
+
+        # JSON cannot represent this; YAML is used instead
+        import datetime
+        fn = os.path.join(d, 'date.yaml')
+        data = dict(when=datetime.datetime(2018, 10, 1))
+        write_yaml(data, fn, encoding=ENCODING_JSON)
+        assert read_yaml_file(fn) == data
+    finally:
+        shutil.rmtree(d)
+
+
+def has_msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        return False
+    return True
+
+
+@comptest
+def test_protocol_encodings_exact():
+    # JSON and msgpack cannot represent these exactly; YAML is used instead
+    cases = [(ENCODING_JSON, {1: 'a'}), (ENCODING_JSON, {'b': (1, 2)}), (ENCODING_JSON, {'c': float('inf')}),
+             (ENCODING_MSGPACK, {'b': (1, 2)})]
+    for encoding, data in cases:
+        s = encode_data(data, encoding)
+        assert not s.lstrip().startswith(b'{') and not s.startswith(MSGPACK_MAGIC), (encoding, s)
+        assert decode_data(s) == data, (encoding, s)
+
+    # not equal to itself, so checked on the encoding used
+    s = encode_data({'c': float('nan')}, ENCODING_JSON)
+    assert 'NaN' not in s and not s.lstrip().startswith(b'{'), s
+    x = decode_data(s)['c']
+    assert isinstance(x, float) and x != x, s
+
+    # these are represented exactly
+    data = {'a': [1, 2.5, None, True], 'b': {'c': u'tr\xe9s'}}
+    s = encode_data(data, ENCODING_JSON)
+    assert s.startswith(b'{'), s
+    assert decode_data(s) == data
+    if has_msgpack():
+        # msgpack has integer keys
+        data[1] = 'one'
+        s = encode_data(data, ENCODING_MSGPACK)
+        assert s.startswith(MSGPACK_MAGIC), s
+        assert decode_data(s) == data
+
+
+if __name__ == '__main__':
+    run_module_tests()